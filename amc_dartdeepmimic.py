@@ -1,5 +1,8 @@
-from dartdeepmimic import DartDeepMimicEnv
+from dartdeepmimic import DartDeepMimicEnv, pad2length
 from amc import AMC
+from transformations import compose_matrix, euler_from_matrix
+from math import pi
+import numpy as np
 
 
 def sd2rr(rvector):
@@ -0,0 +1,109 @@
+import time
+import numpy as np
+
+
+def batched_policy(pi, stochastic=True):
+    """
+    Wrap a baselines MlpPolicy so that it acts on a whole (batch, obs_dim)
+    array in a single session run. pi.act() only takes one observation at a
+    time, but the function it's built on (pi._act) works on any batch size.
+    Returns a function mapping observations to (actions, value predictions)
+    """
+    def act_fn(obs):
+        actions, vpreds = pi._act(stochastic, obs)
+        return actions, vpreds
+    return act_fn
+
+
+class AsyncRollouts:
+    """
+    Collects experience from a SharedMemoryVecEnv without lock-stepping the
+    workers. Whenever some workers finish a step, the observations of all
+    of those which are ready go through act_fn in a single batch and they
+    are sent off again straight away, so the physics of the slow workers
+    overlaps with inference for the fast ones.
+
+    act_fn maps a (batch, obs_dim) array to (actions, value predictions),
+    see batched_policy()
+    """
+
+    def __init__(self, vec_env, act_fn):
+
+        self.vec_env = vec_env
+        self.act_fn = act_fn
+        self._obs = None
+
+        # Where the time goes, and how big the batches end up being
+        self.inference_time = 0.
+        self.wait_time = 0.
+        self.num_batches = 0
+        self.num_inferred = 0
+
+    def _act(self, indices, obs, segments):
+        start = time.time()
+        actions, vpreds = self.act_fn(obs)
+        self.inference_time += time.time() - start
+        self.num_batches += 1
+        self.num_inferred += len(indices)
+
+        for i, index in enumerate(indices):
+            segments[index]["obs"].append(obs[i])
+            segments[index]["actions"].append(actions[i])
+            segments[index]["vpreds"].append(vpreds[i])
+        self.vec_env.step_async_subset(indices, actions)
+
+    def collect(self, num_steps=None, steps_per_env=None):
+        """
+        Take (at least) num_steps environment steps in total, spread over
+        however many each worker manages, or exactly steps_per_env steps in
+        every environment (which still overlap, but fill a (T, N) layout).
+        Returns a list w/ one dict per environment holding arrays of its
+        obs, actions, vpreds, rewards and dones, plus "next_ob" (the
+        observation following the last step, to bootstrap values from).
+        Episodes carry on between calls
+        """
+        if (num_steps is None) == (steps_per_env is None):
+            raise RuntimeError("Give either num_steps or steps_per_env")
+        if self._obs is None:
+            self._obs = self.vec_env.reset()
+
+        num_envs = self.vec_env.num_envs
+        segments = [{"obs": [], "actions": [], "vpreds": [],
+                     "rewards": [], "dones": []} for _ in range(num_envs)]
+
+        everyone = np.arange(num_envs)
+        self._act(everyone, self._obs[everyone], segments)
+        num_started = num_envs
+
+        while True:
+            start = time.time()
+            indices, obs, rewards, dones, _ = self.vec_env.wait_ready()
+            self.wait_time += time.time() - start
+
+            for i, index in enumerate(indices):
+                segments[index]["rewards"].append(rewards[i])
+                segments[index]["dones"].append(dones[i])
+            self._obs[indices] = obs
+
+            # Don't start steps past the budget, but let those already
+            # running finish
+            if steps_per_env is None:
+                go = np.arange(len(indices)) < num_steps - num_started
+            else:
+                go = np.array([len(segments[index]["obs"]) < steps_per_env
+                               for index in indices], dtype=bool)
+            if go.any():
+                self._act(indices[go], obs[go], segments)
+                num_started += int(go.sum())
+            elif self.vec_env.num_pending == 0:
+                break
+
+        for index, segment in enumerate(segments):
+            for key in segment:
+                segment[key] = np.array(segment[key])
+            segment["next_ob"] = self._obs[index].copy()
+
+        return segments
+
+    def mean_batch_size(self):
+        return self.num_inferred / max(self.num_batches, 1)
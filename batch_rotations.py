@@ -0,0 +1,162 @@
+""" Vectorized versions of the angle conversions in euclideanSpace
+
+The functions in euclideanSpace (and the nibabel routines they wrap) take a
+single angle at a time and branch in Python, which adds up quickly when they
+get called for every joint on every step. The routines here operate on whole
+stacks of angles at once and follow exactly the same conventions, so that
+the results can be used interchangeably.
+"""
+
+import numpy as np
+
+from euclideanSpace import _FLOAT_EPS_4
+
+
+def quats2euler(quats, cy_thresh=_FLOAT_EPS_4):
+    ''' Convert a stack of quaternions to Euler angles
+
+    Equivalent to ``mat2euler(quat2mat(q))`` applied to every row, without
+    ever forming the rotation matrices.
+
+    Parameters
+    ----------
+    quats : array shape (N, 4)
+       Quaternions in w, x, y, z format. They do not need to be normalized;
+       (near) zero quaternions are treated as the identity rotation
+    cy_thresh : scalar, optional
+       threshold below which cos(y) is considered to be zero, see mat2euler
+
+    Returns
+    -------
+    zyx : array shape (N, 3)
+       Rotations in radians around z, y, x axes for every quaternion
+    '''
+    quats = np.asarray(quats, dtype=float)
+    sqnorms = np.sum(np.square(quats), axis=1)
+    degenerate = sqnorms < np.finfo(float).eps
+    quats = np.where(degenerate[:, None], [1.0, 0, 0, 0], quats)
+    scale = 2.0 / np.where(degenerate, 1.0, sqnorms)
+
+    w, x, y, z = quats.T
+
+    # Only the entries of the rotation matrix which mat2euler reads
+    r11 = 1.0 - scale * (y*y + z*z)
+    r12 = scale * (x*y - w*z)
+    r13 = scale * (x*z + w*y)
+    r21 = scale * (x*y + w*z)
+    r22 = 1.0 - scale * (x*x + z*z)
+    r23 = scale * (y*z - w*x)
+    r33 = 1.0 - scale * (x*x + y*y)
+
+    return _entries2euler(r11, r12, r13, r21, r22, r23, r33, cy_thresh)
+
+
+def angle_axes2euler(angle_axes, cy_thresh=_FLOAT_EPS_4):
+    ''' Convert a stack of angle, axis pairs to Euler angles
+
+    Equivalent to ``angle_axis2euler(theta, vector)`` applied to every row,
+    without ever forming the rotation matrices.
+
+    Parameters
+    ----------
+    angle_axes : array shape (N, 4)
+       Rows of angle of rotation followed by the (not necessarily
+       normalized) axis of rotation. Rows with a (near) zero axis are
+       treated as the identity rotation
+    cy_thresh : scalar, optional
+       threshold below which cos(y) is considered to be zero, see mat2euler
+
+    Returns
+    -------
+    zyx : array shape (N, 3)
+       Rotations in radians around z, y, x axes for every angle, axis pair
+    '''
+    angle_axes = np.asarray(angle_axes, dtype=float)
+    theta = angle_axes[:, 0]
+    x, y, z = angle_axes[:, 1:].T
+
+    n = np.sqrt(x*x + y*y + z*z)
+    degenerate = n < np.finfo(float).eps
+    theta = np.where(degenerate, 0.0, theta)
+    n = np.where(degenerate, 1.0, n)
+    x = x/n
+    y = y/n
+    z = z/n
+
+    # Same operations (and order) as angle_axis2mat, for the entries of the
+    # rotation matrix which mat2euler reads
+    c = np.cos(theta); s = np.sin(theta); C = 1-c
+    xs = x*s;   ys = y*s;   zs = z*s
+    xC = x*C;   yC = y*C;   zC = z*C
+    xyC = x*yC; yzC = y*zC; zxC = z*xC
+
+    return _entries2euler(x*xC+c, xyC-zs, zxC+ys,
+                          xyC+zs, y*yC+c, yzC-xs,
+                          z*zC+c, cy_thresh)
+
+
+def _entries2euler(r11, r12, r13, r21, r22, r23, r33, cy_thresh):
+    # Batched version of the body of mat2euler
+    cy = np.sqrt(r33*r33 + r23*r23)
+    regular = cy > cy_thresh
+
+    zyx = np.empty((len(r11), 3))
+    zyx[:, 0] = np.where(regular, np.arctan2(-r12, r11), np.arctan2(r21, r22))
+    zyx[:, 1] = np.arctan2(r13, cy)
+    zyx[:, 2] = np.where(regular, np.arctan2(-r23, r33), 0.0)
+
+    return zyx
+
+
+def euler2quats(zyx):
+    ''' Convert a stack of Euler angles to quaternions
+
+    Equivalent to ``euler2quat(z, y, x)`` applied to every row
+
+    Parameters
+    ----------
+    zyx : array shape (..., 3)
+       Rotation angles in radians around z, y, x axes
+
+    Returns
+    -------
+    quats : array shape (..., 4)
+       Quaternions in w, x, y, z format
+    '''
+    half = np.asarray(zyx, dtype=float) / 2.0
+    cz, cy, cx = np.moveaxis(np.cos(half), -1, 0)
+    sz, sy, sx = np.moveaxis(np.sin(half), -1, 0)
+
+    return np.stack([cx*cy*cz - sx*sy*sz,
+                     cx*sy*sz + cy*cz*sx,
+                     cx*cz*sy - sx*cy*sz,
+                     cx*cy*sz + sx*cz*sy], axis=-1)
+
+
+def quats_inverse(quats):
+    ''' Multiplicative inverse of every quaternion in a (..., 4) stack '''
+    quats = np.asarray(quats, dtype=float)
+    return quats * [1.0, -1, -1, -1] \
+        / np.sum(np.square(quats), axis=-1, keepdims=True)
+
+
+def relative_angles(inv_refs, quats):
+    ''' Angle of the rotation between reference and actual orientations
+
+    Equivalent to ``2 * arccos(mult(inv_ref, quat)[0])`` for every pair of
+    rows. Only the real part of the product is ever formed
+
+    Parameters
+    ----------
+    inv_refs : array shape (..., 4)
+       Inverses of the reference quaternions
+    quats : array shape (..., 4)
+       Actual quaternions
+
+    Returns
+    -------
+    angles : array shape (...)
+    '''
+    w1, x1, y1, z1 = np.moveaxis(inv_refs, -1, 0)
+    w2, x2, y2, z2 = np.moveaxis(quats, -1, 0)
+    return 2 * np.arccos(w1*w2 - x1*x2 - y1*y2 - z1*z2)
@@ -0,0 +1,202 @@
+from visak_dartdeepmimic import VisakDartDeepMimicEnv
+from copy import deepcopy
+import xml.etree.ElementTree as ET
+import numpy as np
+import tempfile
+import os
+
+# Distance (along the direction of travel) between neighbouring characters.
+# The reference clips cover less than 5m, so characters can never touch
+DEFAULT_LANE_SPACING = 10.
+# The ground box in kima_original.skel is 500m long
+MAX_WORLD_EXTENT = 450.
+
+
+def lane_offsets(num_characters, lane_spacing):
+    """
+    World-space offset of each character, centered on the origin and spread
+    along the x axis
+    """
+    offsets = np.zeros((num_characters, 3))
+    offsets[:, 0] = (np.arange(num_characters)
+                     - (num_characters - 1) / 2.) * lane_spacing
+    return offsets
+
+
+def make_multi_character_skel(skel_path, offsets):
+    """
+    Write out a copy of the world in skel_path in which the last skeleton
+    (the humanoid) is duplicated once per row of offsets, each copy being
+    shifted by that offset. Returns the path to the new file, which is put
+    next to the original so that relative mesh paths keep working
+    """
+    tree = ET.parse(skel_path)
+    world = tree.getroot().find("world")
+    template = world.findall("skeleton")[-1]
+    world.remove(template)
+
+    for index, offset in enumerate(offsets):
+        skel = deepcopy(template)
+        skel.set("name", template.get("name") + str(index))
+
+        transformation = skel.find("transformation")
+        if transformation is None:
+            transformation = ET.Element("transformation")
+            transformation.text = "0 0 0 0 0 0"
+            skel.insert(0, transformation)
+
+        values = [float(v) for v in transformation.text.split()]
+        values[:3] = np.add(values[:3], offset)
+        transformation.text = " ".join(str(v) for v in values)
+
+        world.append(skel)
+
+    fd, path = tempfile.mkstemp(suffix=".skel",
+                                dir=os.path.dirname(os.path.realpath(skel_path)))
+    with os.fdopen(fd, "wb") as fp:
+        tree.write(fp)
+
+    return path
+
+
+class BatchedVisakDartDeepMimicEnv(VisakDartDeepMimicEnv):
+    """
+    Simulates num_characters copies of the humanoid in a single DART world,
+    so that world stepping and all the other per-step python overhead is paid
+    once for the whole batch instead of once per character.
+
+    pydart2 doesn't expose DART's collision filter, so characters are kept
+    from interacting by giving each one its own lane far away from the
+    others. All the single-character methods (reward, _get_obs,
+    should_terminate...) keep working: they act on whichever character was
+    last picked by select_character
+    """
+
+    def __init__(self, num_characters, *args,
+                 lane_spacing=DEFAULT_LANE_SPACING, **kwargs):
+
+        if num_characters < 1:
+            raise RuntimeError("Need at least one character")
+        if (num_characters - 1) * lane_spacing > MAX_WORLD_EXTENT:
+            raise RuntimeError("Characters don't fit on the ground, "
+                               + "use fewer of them or a smaller spacing")
+
+        self.num_characters = num_characters
+        self.lane_offsets = lane_offsets(num_characters, lane_spacing)
+        # Reference frames get constructed in the parent's __init__ using the
+        # plain (unshifted) skeleton
+        self._lane_offset = np.zeros(3)
+        self._world_path = None
+
+        try:
+            VisakDartDeepMimicEnv.__init__(self, *args, **kwargs)
+        finally:
+            if self._world_path is not None:
+                os.remove(self._world_path)
+
+        if self.history is not None:
+            raise NotImplementedError("Observation history isn't supported"
+                                      + " with multiple characters")
+
+        self.characters = self.dart_world.skeletons[1:]
+        for skel in self.characters:
+            self.configure_skeleton(skel)
+
+        self.framenums = np.zeros(self.num_characters, dtype=int)
+        self.start_framenums = [None] * self.num_characters
+        self._character = 0
+        self.select_character(0)
+
+    def _world_skel_path(self):
+        self._world_path = make_multi_character_skel(self.skel_path,
+                                                     self.lane_offsets)
+        return self._world_path
+
+    def select_character(self, index):
+        """
+        Point robot_skeleton and framenum (and start_framenum) at the given
+        character
+        """
+        self.framenums[self._character] = self.framenum
+        self.start_framenums[self._character] = self.start_framenum
+        self._character = index
+        self.robot_skeleton = self.characters[index]
+        self.framenum = self.framenums[index]
+        self.start_framenum = self.start_framenums[index]
+        self._lane_offset = self.lane_offsets[index]
+
+    ##################################################################
+    # World-space quantities need the lane offset taken out of them  #
+    # before they get compared against the reference motion          #
+    ##################################################################
+
+    def _get_ee_positions(self, skel):
+        return VisakDartDeepMimicEnv._get_ee_positions(self, skel) \
+            - self._lane_offset
+
+    def com_diff(self, skel, framenum):
+        com = self.kinematics(skel).coms[0] - self._lane_offset
+        return np.sum(np.square(self.RefComs[framenum] - com))
+
+    #######################
+    # Batched environment #
+    #######################
+
+    def reset_character(self, index, framenum=None, noise=True):
+        """
+        Reset a single character (e.g. one which just finished an episode)
+        without disturbing the others
+        """
+        self.select_character(index)
+        ob = self._reset_state(framenum, noise)
+        self.framenums[index] = self.framenum
+        return ob
+
+    def reset_batch(self, framenums=None, noise=True):
+        """
+        Reset every character, returns a (num_characters, obs_dim) array of
+        observations
+        """
+        self.dart_world.reset()
+
+        obs = np.zeros((self.num_characters, self.obs_dim))
+        for i in range(self.num_characters):
+            obs[i] = self.reset_character(i,
+                                          None if framenums is None
+                                          else framenums[i],
+                                          noise)
+        return obs
+
+    def step_batch(self, actions):
+        """
+        Apply one row of actions to each character and advance them all
+        together. Returns arrays of observations, rewards and dones plus a
+        list of infos. Characters which are done are NOT reset automatically,
+        use reset_character for that
+        """
+        ndofs = self.robot_skeleton.ndofs
+        targets = np.zeros((self.num_characters, ndofs))
+        for i in range(self.num_characters):
+            self.select_character(i)
+            targets[i] = self.pd_target(actions[i])
+
+        tau = np.zeros(ndofs)
+        # TODO Should be step_resolution instead of 4
+        for _ in range(4):
+            for skel, target in zip(self.characters, targets):
+                tau[6:] = self.PID(skel, target)
+                skel.set_forces(tau)
+            self.dart_world.step()
+
+        obs = np.zeros((self.num_characters, self.obs_dim))
+        rewards = np.zeros(self.num_characters)
+        dones = np.zeros(self.num_characters, dtype=bool)
+        infos = [None] * self.num_characters
+
+        for i in range(self.num_characters):
+            self.select_character(i)
+            obs[i], rewards[i], dones[i], infos[i] \
+                = self._finish_step(actions[i])
+        self.framenums[self._character] = self.framenum
+
+        return obs, rewards, dones, infos
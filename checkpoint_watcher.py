@@ -0,0 +1,170 @@
+""" Evaluate checkpoints as training writes them
+
+Run next to training, as a separate process:
+
+    python checkpoint_watcher.py --prefix out/params_ \\
+        --metrics out/metrics.jsonl
+
+Every poll, new .npz checkpoints under the prefix (see checkpoints.py) are
+copied out as exported policies, so that training pruning them midway
+doesn't matter, and evaluated w/ deterministic episodes by the workers of
+eval_harness. One JSON line per checkpoint is appended to the metrics file.
+The watcher and its workers run at the lowest CPU priority, and training
+never waits on them. Restarting the watcher skips checkpoints which are
+already in the metrics file.
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+
+from eval_harness import make_jobs, make_pool, evaluate, summarize
+from numpy_policy import export_policy
+
+
+def find_checkpoints(prefix):
+    """
+    {iteration: checkpoint prefix} of the checkpoints written under prefix
+    """
+    pattern = re.compile(re.escape(prefix) + r"(\d+)\.npz$")
+    checkpoints = {}
+    for path in glob.glob(glob.escape(prefix) + "*.npz"):
+        match = pattern.match(path)
+        if match is not None:
+            checkpoints[int(match.group(1))] = path[:-len(".npz")]
+    return checkpoints
+
+
+def evaluated_checkpoints(metrics_path):
+    if not os.path.exists(metrics_path):
+        return set()
+    with open(metrics_path) as metrics_file:
+        return {json.loads(line)["checkpoint"] for line in metrics_file
+                if line.strip()}
+
+
+def metrics_line(checkpoint, iteration, rows):
+    """
+    Flatten summarize()'s rows into a single record
+    """
+    record = {"checkpoint": checkpoint, "iteration": iteration,
+              "time": time.time()}
+    for row in rows:
+        for key, value in row.items():
+            if key in ["checkpoint", "start"]:
+                continue
+            name = row["start"] + "_" + key
+            if isinstance(value, tuple):
+                record[name + "_mean"], record[name + "_ci"] = \
+                    float(value[0]), float(value[1])
+            else:
+                record[name] = value
+    return record
+
+
+class CheckpointWatcher:
+
+    def __init__(self, prefix, metrics_path, env_fn, seeds,
+                 start_frames=(0,), rsi=True, max_steps=1000,
+                 num_workers=1):
+
+        self.prefix = prefix
+        self.metrics_path = metrics_path
+        self.seeds = seeds
+        self.start_frames = start_frames
+        self.rsi = rsi
+        self.max_steps = max_steps
+
+        self.done = evaluated_checkpoints(metrics_path)
+        self._directory = tempfile.mkdtemp(prefix="ddm_watcher_")
+        self._pool = make_pool(env_fn, num_workers)
+
+    def poll(self):
+        """
+        Evaluate every checkpoint not evaluated yet, oldest first. Returns
+        the number evaluated
+        """
+        pending = sorted((iteration, checkpoint) for iteration, checkpoint
+                         in find_checkpoints(self.prefix).items()
+                         if checkpoint not in self.done)
+        for iteration, checkpoint in pending:
+            self.evaluate(iteration, checkpoint)
+        return len(pending)
+
+    def evaluate(self, iteration, checkpoint):
+        export_path = os.path.join(self._directory,
+                                   "%d.npz" % iteration)
+        try:
+            export_policy(checkpoint, export_path)
+        except (IOError, OSError):
+            # Pruned by training before we got to it
+            self.done.add(checkpoint)
+            return
+
+        jobs = make_jobs([export_path], self.seeds, self.start_frames,
+                         self.rsi)
+        results = evaluate(None, jobs, max_steps=self.max_steps,
+                           stochastic=False, pool=self._pool)
+        record = metrics_line(checkpoint, iteration, summarize(results))
+
+        with open(self.metrics_path, "a") as metrics_file:
+            metrics_file.write(json.dumps(record) + "\n")
+        self.done.add(checkpoint)
+        os.remove(export_path)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+
+    from functools import partial
+    from visak_dartdeepmimic import make_walk_env
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate new checkpoints as training writes them")
+    parser.add_argument("--prefix", required=True,
+                        help="Output prefix passed to the training script")
+    parser.add_argument("--metrics", required=True,
+                        help="JSON lines file to append results to")
+    parser.add_argument("--poll-interval", type=float, default=30.,
+                        help="Seconds between looks for new checkpoints")
+    parser.add_argument("--seeds", nargs="+", type=int,
+                        default=list(range(4)))
+    parser.add_argument("--start-frames", nargs="*", type=int, default=[0])
+    parser.add_argument("--no-rsi", dest="rsi", action="store_false")
+    parser.add_argument("--max-steps", type=int, default=1000)
+    parser.add_argument("--history-length", type=int, default=0,
+                        help="Same as passed to the training script")
+    parser.add_argument("--num-workers", type=int, default=1)
+    parser.add_argument("--niceness", type=int, default=19,
+                        help="Added to the priority of the watcher and its "
+                        + "workers, so that training gets the CPU first")
+    parser.add_argument("--once", action="store_true",
+                        help="Evaluate what's there and exit")
+    args = parser.parse_args()
+
+    # Before the pool starts, so that the workers inherit it
+    os.nice(args.niceness)
+
+    # Episodes are normalized w/ the statistics saved along w/ each
+    # checkpoint, if any (see NumpyPolicy.prepare_env)
+    env_fn = partial(make_walk_env, history_length=args.history_length)
+    watcher = CheckpointWatcher(args.prefix, args.metrics, env_fn,
+                                args.seeds, args.start_frames, args.rsi,
+                                args.max_steps, args.num_workers)
+    try:
+        while True:
+            watcher.poll()
+            if args.once:
+                break
+            time.sleep(args.poll_interval)
+    finally:
+        watcher.close()
@@ -0,0 +1,216 @@
+""" Checkpointing off the training thread
+
+A CheckpointManager is made once per run. save() only fetches the values of
+the variables (one session run, so the snapshot is consistent) and hands
+them to a background thread, which writes them out as an .npz, prunes old
+checkpoints and rewrites an index file. Checkpoints are kept if they are
+among the last keep_last or the keep_best highest scoring ones.
+
+A checkpoint is referred to by its prefix (e.g. out_prefix + "100"): the
+variables live in prefix + ".npz", and the observation statistics of the
+environment, if any, next to it at running_stats.obs_stats_path(prefix).
+restore() also accepts prefixes of old tf.train.Saver checkpoints.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+from running_stats import obs_stats_path
+
+# Index of the checkpoints written under an output prefix
+INDEX_SUFFIX = "checkpoints.json"
+
+
+def variables_path(prefix):
+    return prefix + ".npz"
+
+
+def _save_npz(path, arrays):
+    # Write then rename, so that a crash never leaves half a checkpoint
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+class CheckpointManager:
+
+    def __init__(self, out_prefix, keep_last=5, keep_best=3, obs_stats=None,
+                 var_list=None):
+
+        self.out_prefix = out_prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.obs_stats = obs_stats
+        self.index_path = out_prefix + INDEX_SUFFIX
+
+        # Defaults to what tf.train.Saver() would save. Everything is built
+        # here, once, so that neither saving nor restoring adds to the graph
+        self.variables = tf.global_variables() if var_list is None \
+            else var_list
+        self._placeholders = [tf.placeholder(v.dtype.base_dtype, v.shape)
+                              for v in self.variables]
+        self._assign = tf.group(*[tf.assign(v, p) for v, p
+                                  in zip(self.variables, self._placeholders)])
+        self._saver = None
+
+        self.entries = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as index_file:
+                self.entries = json.load(index_file)["checkpoints"]
+
+        self._queue = queue.Queue(maxsize=2)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    ##########
+    # Saving #
+    ##########
+
+    def save(self, iteration, score=None, sess=None, timesteps=None):
+        """
+        Snapshot the variables (and obs statistics) and queue them for
+        writing. score, e.g. the mean episode reward, decides which
+        checkpoints count as the best. timesteps, the number of steps
+        trained on so far, is recorded in the index. Only blocks if the
+        writer is two checkpoints behind
+        """
+        self._raise_writer_error()
+        sess = tf.get_default_session() if sess is None else sess
+
+        values = sess.run(self.variables)
+        arrays = {v.name: value for v, value in zip(self.variables, values)}
+        stats = None
+        if self.obs_stats is not None:
+            # The statistics are updated in place, so copy them
+            stats = {key: np.array(value) for key, value
+                     in self.obs_stats.state_dict().items()}
+
+        self._queue.put((iteration, score, timesteps, arrays, stats))
+
+    def _write_loop(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            try:
+                if self._error is None:
+                    self._write(*job)
+            except Exception as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _write(self, iteration, score, timesteps, arrays, stats):
+        prefix = self.out_prefix + str(iteration)
+        # Variables last: a checkpoint counts as there once they are (see
+        # checkpoint_watcher.find_checkpoints), so it has to be complete
+        if stats is not None:
+            _save_npz(obs_stats_path(prefix), stats)
+        _save_npz(variables_path(prefix), arrays)
+
+        self.entries = [e for e in self.entries if e["prefix"] != prefix]
+        self.entries.append({"iteration": iteration, "prefix": prefix,
+                             "score": None if score is None else float(score),
+                             "timesteps": None if timesteps is None
+                             else int(timesteps),
+                             "time": time.time()})
+        self._prune()
+        self._write_index()
+
+    def _prune(self):
+        by_iteration = sorted(self.entries, key=lambda e: e["iteration"])
+        scored = [e for e in self.entries if e["score"] is not None]
+        by_score = sorted(scored, key=lambda e: e["score"], reverse=True)
+
+        keep = {e["prefix"] for e in by_iteration[-self.keep_last:]} \
+            if self.keep_last > 0 else set()
+        keep.update(e["prefix"] for e in by_score[:self.keep_best])
+
+        for entry in self.entries:
+            if entry["prefix"] not in keep:
+                for path in [variables_path(entry["prefix"]),
+                             obs_stats_path(entry["prefix"])]:
+                    if os.path.exists(path):
+                        os.remove(path)
+        self.entries = [e for e in by_iteration if e["prefix"] in keep]
+
+    def _write_index(self):
+        index = {"checkpoints": self.entries,
+                 "latest": self.latest(), "best": self.best()}
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as index_file:
+            json.dump(index, index_file, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            raise RuntimeError("Writing a checkpoint failed") \
+                from self._error
+
+    def latest(self):
+        """
+        Prefix of the most recent checkpoint written, or None
+        """
+        if not self.entries:
+            return None
+        return max(self.entries, key=lambda e: e["iteration"])["prefix"]
+
+    def best(self):
+        """
+        Prefix of the highest scoring checkpoint written, or None
+        """
+        scored = [e for e in self.entries if e["score"] is not None]
+        if not scored:
+            return None
+        return max(scored, key=lambda e: e["score"])["prefix"]
+
+    def flush(self):
+        """
+        Wait for every queued checkpoint to be written
+        """
+        self._queue.join()
+        self._raise_writer_error()
+
+    def close(self):
+        self._queue.put(None)
+        self._writer.join()
+        self._raise_writer_error()
+
+    #############
+    # Restoring #
+    #############
+
+    def restore(self, prefix, sess=None):
+        """
+        Load the checkpoint at prefix into the variables (and the obs
+        statistics, if saved along), in a single session run
+        """
+        sess = tf.get_default_session() if sess is None else sess
+
+        if not os.path.exists(variables_path(prefix)):
+            # Checkpoint from before the manager existed
+            if self._saver is None:
+                self._saver = tf.train.Saver(self.variables)
+            self._saver.restore(sess, prefix)
+        else:
+            with np.load(variables_path(prefix)) as data:
+                missing = [v.name for v in self.variables
+                           if v.name not in data]
+                if missing:
+                    raise RuntimeError("Checkpoint " + prefix + " lacks "
+                                       + ", ".join(missing))
+                sess.run(self._assign,
+                         feed_dict={p: data[v.name] for v, p
+                                    in zip(self.variables,
+                                           self._placeholders)})
+
+        if self.obs_stats is not None \
+           and os.path.exists(obs_stats_path(prefix)):
+            self.obs_stats.load(obs_stats_path(prefix))
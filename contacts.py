@@ -0,0 +1,79 @@
+import numpy as np
+from pydart2 import pydart2_api as papi
+
+# Layout of a contact as handed out by pydart2 (same as Contact.state)
+CONTACT_ROW_LENGTH = 10
+POINT = slice(0, 3)
+FORCE = slice(3, 6)
+SKEL_IDS = [6, 8]
+BODY_IDS = [7, 9]
+
+# Bodies of the kima humanoid which shouldn't ever touch the ground
+KIMA_FORBIDDEN_CONTACTS = ("head",)
+
+
+class ContactSummary:
+    """
+    All the contacts of a world at a given step as arrays, read straight from
+    pydart2's contact buffer instead of going through one Python Contact
+    object per contact.
+
+    Row i of every array describes contact i. skel_ids and body_ids have two
+    columns, one for each side of the contact
+    """
+
+    def __init__(self, raw):
+        self.points = raw[:, POINT]
+        self.forces = raw[:, FORCE]
+        self.skel_ids = raw[:, SKEL_IDS].astype(int)
+        self.body_ids = raw[:, BODY_IDS].astype(int)
+
+    @classmethod
+    def from_world(cls, world):
+        n = papi.collisionresult__getNumContacts(world.id)
+        raw = papi.collisionresult__getContacts(world.id,
+                                                n * CONTACT_ROW_LENGTH)
+        return cls(np.asarray(raw, dtype=float).reshape(n,
+                                                        CONTACT_ROW_LENGTH))
+
+    def __len__(self):
+        return len(self.points)
+
+    def touching(self, skel_id, other_skel_id, num_bodies):
+        """
+        Boolean mask over the bodies of skeleton skel_id, true for those in
+        contact with any body of skeleton other_skel_id
+        """
+        mask = np.zeros(num_bodies, dtype=bool)
+        for side in range(2):
+            pairs = (self.skel_ids[:, side] == skel_id) \
+                & (self.skel_ids[:, 1 - side] == other_skel_id)
+            mask[self.body_ids[pairs, side]] = True
+        return mask
+
+
+class GroundContacts:
+    """
+    Tracks which bodies of a skeleton touch the ground. Bodies whose name
+    starts with one of forbidden_prefixes (e.g. the head) are flagged once,
+    up front, so that checking for a fall is a single mask operation
+    """
+
+    def __init__(self, skel, ground, forbidden_prefixes=KIMA_FORBIDDEN_CONTACTS):
+        self.skel_id = skel.id
+        self.ground_id = ground.id
+        self.num_bodies = len(skel.bodynodes)
+        self.forbidden = np.array([body.name.startswith(forbidden_prefixes)
+                                   for body in skel.bodynodes])
+
+    def bodies(self, summary):
+        """
+        Boolean mask over the skeleton's bodies, true for those on the ground
+        """
+        return summary.touching(self.skel_id, self.ground_id, self.num_bodies)
+
+    def forbidden_contact(self, summary):
+        """
+        Whether any forbidden body is on the ground
+        """
+        return bool(np.any(self.bodies(summary) & self.forbidden))
@@ -0,0 +1,152 @@
+""" Placing rollout workers and the learner on CPU cores
+
+With many environment workers next to a TensorFlow learner on one machine,
+every process's BLAS / OpenMP pool and TF's own thread pools each assume
+they have the whole machine, and throughput collapses under
+oversubscription. A PlacementPlan gives every rollout worker a core of its
+own and the learner whatever cores are left, w/ BLAS limited to a single
+thread everywhere and TF's pools sized to the learner's cores:
+
+    plan = PlacementPlan(num_workers=8)
+    plan.pin_learner()
+    sess = U.make_session(num_cpu=plan.learner_threads)
+    server = ForkServer(env_fn, placement=plan)
+
+BLAS and OpenMP only read their thread counts when they load, so an
+entry script should call limit_blas_threads() before numpy (or TF) is
+first imported. Later on, the limit only applies to libraries that are
+already loaded if threadpoolctl is installed. describe() tells whether it
+did.
+
+Pinning relies on os.sched_setaffinity, so it's a no-op off Linux.
+"""
+
+import os
+import sys
+
+# Read by the BLAS / OpenMP libraries when they load
+BLAS_THREAD_VARS = ["OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS",
+                    "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS",
+                    "NUMEXPR_NUM_THREADS"]
+
+
+def available_cpus():
+    """
+    Cores this process may run on, in order
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def share_cpus(cpus, index, count):
+    """
+    Contiguous share number index out of count of cpus, e.g. for one of
+    several MPI ranks on the same machine
+    """
+    if count > len(cpus):
+        return [cpus[index % len(cpus)]]
+    start = index * len(cpus) // count
+    return cpus[start:(index + 1) * len(cpus) // count]
+
+
+# What limit_blas_threads() set before BLAS was loaded, if anything
+_threads_at_load = None
+
+
+def limit_blas_threads(num_threads=1):
+    """
+    Set the thread count of BLAS / OpenMP pools, for libraries loaded from
+    now on (and child processes) through the environment, and for those
+    already loaded through threadpoolctl if it's installed. Returns whether
+    the limit applies to this process: False if numpy was loaded first and
+    threadpoolctl is missing
+    """
+    global _threads_at_load
+    for var in BLAS_THREAD_VARS:
+        os.environ[var] = str(num_threads)
+    # numpy loads BLAS, and everything else using it loads numpy
+    if "numpy" not in sys.modules:
+        _threads_at_load = num_threads
+        return True
+    if _threads_at_load == num_threads:
+        return True
+    try:
+        from threadpoolctl import threadpool_limits
+    except ImportError:
+        return False
+    threadpool_limits(num_threads)
+    return True
+
+
+def _set_affinity(cpus):
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+class PlacementPlan:
+    """
+    Worker i runs on worker_cpus[i], taken from the end of cpus so that the
+    learner keeps the first ones. When there are fewer spare cores than
+    workers, the learner keeps the first core only and the workers go round
+    robin over the others (and share all of them w/ the learner if there's
+    just one)
+    """
+
+    def __init__(self, num_workers, cpus=None, pin=True):
+
+        cpus = available_cpus() if cpus is None else sorted(cpus)
+        if not cpus:
+            raise RuntimeError("No CPUs to place workers on")
+        self.num_workers = num_workers
+        self.pin = pin
+        # Whether pin_learner() managed to limit BLAS to a single thread
+        self.blas_limited = None
+
+        if num_workers < len(cpus):
+            self.learner_cpus = cpus[:len(cpus) - num_workers]
+            self.worker_cpus = cpus[len(cpus) - num_workers:]
+        elif len(cpus) > 1:
+            self.learner_cpus = cpus[:1]
+            self.worker_cpus = [cpus[1 + i % (len(cpus) - 1)]
+                                for i in range(num_workers)]
+        else:
+            self.learner_cpus = cpus
+            self.worker_cpus = cpus * num_workers
+
+    @property
+    def learner_threads(self):
+        """
+        Size for TF's intra and inter op pools
+        """
+        return len(self.learner_cpus)
+
+    def pin_learner(self):
+        """
+        Call in the learner process, before TF's session is made
+        """
+        self.blas_limited = limit_blas_threads(1)
+        if self.pin:
+            _set_affinity(self.learner_cpus)
+
+    def pin_worker(self, index):
+        """
+        Call in the process of worker number index
+        """
+        limit_blas_threads(1)
+        if self.pin:
+            _set_affinity([self.worker_cpus[index]])
+
+    def describe(self):
+        lines = ["Learner on cores %s w/ %i TF threads%s"
+                 % (",".join(map(str, self.learner_cpus)),
+                    self.learner_threads, "" if self.pin else " (unpinned)")]
+        for index, cpu in enumerate(self.worker_cpus):
+            lines.append("Worker %i on core %i" % (index, cpu))
+        if self.blas_limited is False:
+            lines.append("BLAS threads NOT limited: numpy was loaded before "
+                         + "limit_blas_threads() and threadpoolctl isn't "
+                         + "installed")
+        elif self.blas_limited:
+            lines.append("BLAS limited to a single thread")
+        return "\n".join(lines)
@@ -1,16 +1,17 @@
 from gym.envs.dart import dart_env
-from math import exp, pi
-from numpy.linalg import norm
-from transformations import compose_matrix, euler_from_matrix
-import argparse
 import numpy as np
 import pydart2 as pydart
 import random
-import warnings
 from copy import deepcopy
-from euclideanSpace import angle_axis2euler, euler2quat
+from euclideanSpace import euler2quat
 from quaternions import mult, inverse
-from math import atan2
+from obs_history import ObservationHistory
+from running_stats import RunningMeanStd
+from batch_rotations import quats2euler, angle_axes2euler
+from kinematics import KinematicsMixin, EndEffectors
+from termination import TerminationRules
+from rsi_sampler import AdaptiveStartSampler
+from rng_streams import seed_env
 
 # ROOT_KEY isn't customizeable. It should correspond
 # to the name of the root node in the amc (which is usually "root")
@@ -68,7 +69,12 @@ def get_metadict(skel, type_lambda):
     return metadict
 
 
-class DartDeepMimicEnv(dart_env.DartEnv):
+class DartDeepMimicEnv(KinematicsMixin, dart_env.DartEnv):
+
+    # List of (body name, local offset) pairs, see kinematics.EndEffectors
+    END_EFFECTORS = None
+    # List of termination.TerminationRule used by should_terminate
+    TERMINATION_RULES = None
 
     def __init__(self,
                  skel_path,
@@ -95,11 +101,13 @@ class DartDeepMimicEnv(dart_env.DartEnv):
                  # gravity,
                  # self_collide,
                  seed,
+                 history_length=0,
+                 normalize_obs=False,
+                 adaptive_rsi=False,
     ):
 
+        # Seeded along w/ gym's np_random once DartEnv has made it
         self.random = random.Random()
-        if seed is not None:
-            self.random.seed(seed)
 
         ##############################################
         # Set angle conversion methods appropriately #
@@ -121,15 +129,21 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         elif self.statemode == StateMode.GEN_AXIS:
             raise NotImplementedError()
 
+        # angles_from_netvector decodes all the quaternions / angle-axes in
+        # one batch, reps2euler does the conversion and angle_from_rep is
+        # just here for anyone converting a single angle
+        self.reps2euler = None
+
         if self.actionmode == ActionMode.GEN_EULER:
             self.angle_from_rep = lambda x: x
 
         elif self.actionmode == ActionMode.GEN_QUAT:
-            raise NotImplementedError()
+            self.reps2euler = quats2euler
+            self.angle_from_rep = lambda quat: quats2euler([quat])[0][::-1]
 
         elif self.actionmode == ActionMode.GEN_AXIS:
-            self.angle_from_rep = lambda aa: angle_axis2euler(theta=aa[0],
-                                                             vector=aa[1:])[::-1]
+            self.reps2euler = angle_axes2euler
+            self.angle_from_rep = lambda aa: angle_axes2euler([aa])[0][::-1]
 
 
         self.pos_noise, self.vel_noise = pos_noise, vel_noise
@@ -155,6 +169,14 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         # TODO Make sure that -1 is the right skel to use: CLI parameter?
         ref_skel = pydart.World(.0001, self.skel_path).skeletons[-1]
 
+        if self.END_EFFECTORS is not None:
+            self.end_effectors = EndEffectors(ref_skel, self.END_EFFECTORS)
+
+        self.termination = None
+        if self.TERMINATION_RULES is not None:
+            self.termination = TerminationRules(self.TERMINATION_RULES,
+                                                2 * ref_skel.ndofs)
+
         # The lambda should, given a joint name, return a JointType code
         self.metadict = get_metadict(ref_skel, self.type_lambda)
 
@@ -171,6 +193,8 @@ class DartDeepMimicEnv(dart_env.DartEnv):
                 # TODO Support non-rotational actuated joints?
                 raise NotImplementedError("Non-rot actuated joints unsupported")
 
+        self._build_action_indices()
+
         #####################################
         # Parse reference mocap information #
         #####################################
@@ -180,27 +204,53 @@ class DartDeepMimicEnv(dart_env.DartEnv):
                                                  self.mocap_path)
         self.num_frames = len(self.RefQs)
 
+        # Random start frames favor the parts of the clip where episodes
+        # fail, instead of being uniform
+        self.start_sampler = None
+        if adaptive_rsi:
+            self.start_sampler = AdaptiveStartSampler(self.num_frames)
+        # Start frame of the current episode, None unless it was random
+        self.start_framenum = None
+
         ############################################
         # Calculate observation, action dimensions #
         ############################################
 
         self.obs_dim = len(self._get_obs(ref_skel))
+
+        # Running statistics used to normalize observations before they
+        # reach the policy (or the history)
+        self.obs_stats = None
+        if normalize_obs:
+            self.obs_stats = RunningMeanStd(self.obs_dim)
         self.action_dim = sum([ActionMode.lengths[self.actionmode]
                                if len(self.metadict[name][0]) > 1 else 1
                                for name in self._actuated_dof_names])
 
+        # With a history the policy sees the last history_length
+        # (observation, action) pairs stacked together
+        self.history = None
+        if history_length > 0:
+            self.history = ObservationHistory(history_length,
+                                              self.obs_dim, self.action_dim)
+            self.obs_dim = self.history.stacked_dim
+
         # The control bounds don't actually do anything lol, they're just
         # there to give the environment dimensions (according to Visak)
         control_bounds = np.array([10*np.ones(self.action_dim,),
                                    -10*np.ones(self.action_dim,)])
 
         dart_env.DartEnv.__init__(self,
-                                  [self.skel_path],
+                                  [self._world_skel_path()],
                                   self.action_dim,
                                   self.obs_dim,
                                   control_bounds,
                                   disableViewer=False)
 
+        # Frame sampling and reset noise get streams of their own
+        if seed is not None:
+            seed_env(self, seed)
+
         #######################################
         # Just set a bunch of self.parameters #
         #######################################
@@ -327,6 +377,14 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         #     for body in skel.bodynodes:
         #         body.set_friction_coeff(self.default_friction)
 
+    def _world_skel_path(self):
+        """
+        Path to the skel file the simulation world gets loaded from. This is
+        normally just the control skeleton, but subclasses can swap in a
+        different world built around it
+        """
+        return self.skel_path
+
     def construct_frames(self, ref_skel, ref_motion_path):
 
         with open(ref_motion_path, "rb") as fp:
@@ -347,7 +405,7 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
             RefQuats[i] = self.quaternion_angles(ref_skel)
             # TODO TBH I'm still not sure bodynodes[0] is the thing to use
-            RefComs[i] = ref_skel.bodynodes[0].com()
+            RefComs[i] = self.kinematics(ref_skel).coms[0]
             RefEEs[i] = self._get_ee_positions(ref_skel)
 
         # TODO Should I use np.array on RefQs?
@@ -386,7 +444,8 @@ class DartDeepMimicEnv(dart_env.DartEnv):
     def vel_diff(self, skel, framenum):
 
         # TODO I can just use [i] instead of [i,:], right?
-        return np.sum(np.square(self.skel.dq - self.RefDQs[framenum]))
+        return np.sum(np.square(self.kinematics(skel).dq
+                                - self.RefDQs[framenum]))
 
     def ee_diff(self, skel, framenum):
 
@@ -395,29 +454,47 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
     def com_diff(self, skel, framenum):
         # TODO TBH I'm still not sure bodynodes[0] is the thing to use
-        return np.sum(np.square(self.RefComs[framenum] - skel.bodynodes[0].com()))
+        return np.sum(np.square(self.RefComs[framenum]
+                                - self.kinematics(skel).coms[0]))
 
-    def reward(self, skel, framenum):
+    def tracking_errors(self, skel, framenum):
+        """
+        The differences from reference frame framenum which the reward is
+        made of, by term
+        """
+        return {"pos": self.pos_diff(skel, framenum),
+                "vel": self.vel_diff(skel, framenum),
+                "ee": self.ee_diff(skel, framenum),
+                "com": self.com_diff(skel, framenum)}
 
-        diff_pos = self.pos_diff(skel, framenum)
-        diff_vel = self.vel_diff(skel, framenum)
-        diff_ee = self.ee_diff(skel, framenum)
-        diff_com = self.com_diff(skel, framenum)
+    def reward_from_errors(self, errors):
 
-        return self.pos_weight * np.exp(self.pos_decay * diff_pos) \
-            + self.vel_weight * np.exp(self.vel_decay * diff_vel) \
-            + self.ee_weight * np.exp(self.ee_decay * diff_ee) \
-            + self.com_weight * np.exp(self.com_decay * diff_com)
+        return self.pos_weight * np.exp(self.pos_decay * errors["pos"]) \
+            + self.vel_weight * np.exp(self.vel_decay * errors["vel"]) \
+            + self.ee_weight * np.exp(self.ee_decay * errors["ee"]) \
+            + self.com_weight * np.exp(self.com_decay * errors["com"])
+
+    def reward(self, skel, framenum):
+
+        return self.reward_from_errors(self.tracking_errors(skel, framenum))
 
     def step(self, a):
         return self._step(a)
 
+    def pd_target(self, nvec):
+        """
+        Full-length vector of joint targets for the PD controller given a
+        network output
+        """
+        target = np.zeros(self.robot_skeleton.ndofs,)
+        target[6:] = self.target_angles(self.angles_from_netvector(nvec))
+        return target
+
     def _step(self, nvec):
 
         # TODO Do I need to clamp anything in this range?
         tau = np.zeros(self.robot_skeleton.ndofs)
-        target = np.zeros(self.robot_skeleton.ndofs,)
-        target[6:] = self.target_angles(self.angles_from_netvector(nvec))
+        target = self.pd_target(nvec)
 
         # TODO Should be step_resolution instead of 4
         for i in range(4):
@@ -426,17 +503,28 @@ class DartDeepMimicEnv(dart_env.DartEnv):
             self.robot_skeleton.set_forces(tau)
             self.dart_world.step()
 
-        R_total = self.reward(self.robot_skeleton, self.framenum)
+        return self._finish_step(nvec)
+
+    def _finish_step(self, nvec):
+        """
+        Everything that happens in a step after the simulation has been
+        advanced: reward, termination, observation and frame bookkeeping
+        """
+        errors = self.tracking_errors(self.robot_skeleton, self.framenum)
+        R_total = self.reward_from_errors(errors)
 
-        s = self.state_vector()
         done = self.should_terminate()
+        if self.start_sampler is not None and self.start_framenum is not None \
+           and (done or self.framenum + 1 >= self.num_frames - 1):
+            self.start_sampler.record(self.start_framenum, failed=done)
+            self.start_framenum = None
 
         # TODO Implement proper rude termination
         if done:
             R_total = 0.
 
         # TODO Implement finiteness check on obs by uncommenting below
-        ob = self._get_obs()
+        ob = self._observe(self._get_obs(), nvec)
         # if not np.isfinite(ob).all():
         #     raise RuntimeError("Ran into an infinite state")
 
@@ -444,22 +532,32 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         if self.framenum >= self.num_frames-1:
             done = True
 
-        return ob, R_total, done, {}
+        return ob, R_total, done, {"tracking_errors": errors}
 
     def get_random_framenum(self, default=None):
         if default is not None:
             return default
+        elif self.start_sampler is not None:
+            return self.start_sampler.sample(self.random)
         else:
             return self.random.randint(0, self.num_frames - 1)
 
     def reset(self, framenum=None, noise=True):
 
+        self.dart_world.reset()
+
+        return self._reset_state(framenum, noise)
+
+    def _reset_state(self, framenum=None, noise=True):
+        """
+        Put the robot skeleton in a (noisy) reference pose without touching
+        the rest of the world
+        """
         pnoise = int(noise) * self.pos_noise
         vnoise = int(noise) * self.vel_noise
 
-        self.dart_world.reset()
-
         self.framenum = self.get_random_framenum(framenum)
+        self.start_framenum = self.framenum if framenum is None else None
 
         qpos = self.RefQs[self.framenum,
                           :].reshape(self.robot_skeleton.ndofs) \
@@ -473,7 +571,7 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
         self.set_state(qpos, qvel)
 
-        return self._get_obs()
+        return self._observe(self._get_obs())
 
     def _get_ee_positions(self, skel):
         """
@@ -481,37 +579,41 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         """
         # TODO I'd like to parse ee indices and offsets myself one day
         # bit of a pipe dream IMO but it's certainly ideal
-        raise NotImplementedError()
+        if self.end_effectors is None:
+            raise NotImplementedError()
+        return self.kinematics(skel).ee_positions
 
     def _get_obs(self, skel=None):
 
         if skel is None:
             skel = self.robot_skeleton
 
+        kin = self.kinematics(skel)
+        q, dq, coms = kin.q, kin.dq, kin.coms
+
         state = np.array([self.framenum / self.num_frames])
 
         for dof_name in self._dof_names:
 
             indices, body_index, joint_type = self.metadict[dof_name]
-            body = skel.bodynodes[body_index]
             fi, li = indices[0], indices[-1] + 1
 
             tpos = None
             # TODO Pass in an actual angular velocity instead of dq
-            tvel = skel.dq[fi:li]
+            tvel = dq[fi:li]
             # TODO TBH I'm still not sure bodynodes[0] is the thing to use
-            bpos = body.com() - skel.bodynodes[0].com()
-            bvel = body.dC
+            bpos = coms[body_index] - coms[0]
+            bvel = kin.com_velocities[body_index]
 
             if joint_type == JointType.TRANS:
-                tpos = skel.q[fi:li]
+                tpos = q[fi:li]
 
             elif joint_type == JointType.ROT:
                 if len(indices) > 1:
-                    padded_angle = pad2length(skel.q[fi:li], 3)
+                    padded_angle = pad2length(q[fi:li], 3)
                     tpos = self.angle_to_rep(padded_angle)
                 else:
-                    tpos = skel.q[fi:fi+1]
+                    tpos = q[fi:fi+1]
 
             elif joint_type == JointType.FREE:
                 raise NotImplementedError()
@@ -523,15 +625,30 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
         return state
 
+    def _observe(self, ob, action=None):
+        """
+        Turn a raw observation into what actually gets handed to the policy.
+        An action of None means that ob is the first one of an episode
+        """
+        if self.obs_stats is not None:
+            self.obs_stats.update(ob)
+            self.obs_stats.normalize(ob, out=ob)
+        if self.history is None:
+            return ob
+        if action is None:
+            return self.history.reset(ob)
+        return self.history.push(ob, action)
+
     def quaternion_angles(self, skel):
 
         angles = [None] * len(self._rotational_dof_names)
+        q = self.kinematics(skel).q
 
         for quat_index, dof_name in enumerate(self._rotational_dof_names):
 
             indices, _, __ = self.metadict[dof_name]
 
-            euler_angle = pad2length(skel.q[indices[0]:indices[-1]+1],
+            euler_angle = pad2length(q[indices[0]:indices[-1]+1],
                                      3)
 
             angles[quat_index] = euler2quat(z=euler_angle[2],
@@ -591,6 +708,44 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
     #     return reward
 
+    def _build_action_indices(self):
+        """
+        Precompute where every piece of the network output ends up in the
+        vector of actuated dofs, so that actions can be decoded with a couple
+        of fancy-indexing operations instead of a loop over joints
+        """
+        rep_length = ActionMode.lengths[self.actionmode]
+
+        single_nv, single_q = [], []
+        multi_nv, multi_q, multi_angle = [], [], []
+        q_index = 0
+        nv_index = 0
+
+        for dof_name in self._actuated_dof_names:
+            indices, _, __ = self.metadict[dof_name]
+
+            if len(indices) == 1:
+                single_nv.append(nv_index)
+                single_q.append(q_index)
+                nv_index += 1
+            else:
+                joint_index = len(multi_nv)
+                multi_nv.append(list(range(nv_index, nv_index + rep_length)))
+                for i in range(len(indices)):
+                    multi_q.append(q_index + i)
+                    multi_angle.append(3 * joint_index + i)
+                nv_index += rep_length
+
+            q_index += len(indices)
+
+        self._num_actuated_dofs = q_index
+        self._single_nv_indices = np.array(single_nv, dtype=int)
+        self._single_q_indices = np.array(single_q, dtype=int)
+        self._multi_nv_indices = np.array(multi_nv, dtype=int).reshape(-1,
+                                                                       rep_length)
+        self._multi_q_indices = np.array(multi_q, dtype=int)
+        self._multi_angle_indices = np.array(multi_angle, dtype=int)
+
     def angles_from_netvector(self, netvector):
         """
         Given a neural network output, return a set of target angle for
@@ -598,6 +753,9 @@ class DartDeepMimicEnv(dart_env.DartEnv):
         """
         # TODO Eventually should allow targets for translational dofs too?
 
+        if self.reps2euler is not None:
+            return self.batched_angles_from_netvector(netvector)
+
         target_q = np.zeros(len(self.robot_skeleton.q) - 6)
         q_index = 0
         nv_index = 0
@@ -628,10 +786,37 @@ class DartDeepMimicEnv(dart_env.DartEnv):
 
         return target_q
 
-    # def should_terminate(self, newstate):
-    #     done = self.framenum >= self.num_frames
-    #     done = done or reward < self.reward_cutoff
-    #     return done
+    def batched_angles_from_netvector(self, netvector):
+        """
+        Quaternion / angle-axis mode version of angles_from_netvector: the
+        rotations of every joint are converted to the skeleton's euler
+        convention in a single batched computation
+        """
+        netvector = np.asarray(netvector)
+        if len(netvector) != self.action_dim:
+            raise RuntimeError("Not all net outputs used")
+
+        target_q = np.zeros(self._num_actuated_dofs)
+        target_q[self._single_q_indices] = netvector[self._single_nv_indices]
+
+        # reps2euler gives (z, y, x) while the skeleton stores (x, y, z)
+        euler_angles = self.reps2euler(
+            netvector[self._multi_nv_indices])[:, ::-1]
+        target_q[self._multi_q_indices] \
+            = euler_angles.reshape(-1)[self._multi_angle_indices]
+
+        return target_q
+
+    def should_terminate(self):
+        """
+        Check the termination rules against the current state of the robot
+        skeleton. self.termination.summary() tells how often each fired
+        since its counts were last reset
+        """
+        if self.termination is None:
+            raise NotImplementedError()
+        kin = self.kinematics()
+        return self.termination.should_terminate(kin.state, kin.coms[0][1])
 
 
     # def PID(self, skel, dof_targets):
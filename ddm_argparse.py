@@ -1,23 +1,34 @@
 import argparse
-from dartdeepmimic import DartDeepMimicEnv
-import visak_dartdeepmimic
-import amc_dartdeepmimic
+import importlib
 import os
 
 class DartDeepMimicArgParse(argparse.ArgumentParser):
 
-    classes = {"amc": amc_dartdeepmimic.AMCDartDeepMimicEnv,
-               "rawqdq": visak_dartdeepmimic.VisakDartDeepMimicEnv}
+    # Environment classes as (module, class name), only imported once picked
+    # so that e.g. the AMC parser isn't loaded when training on raw q/dq data
+    classes = {"amc": ("amc_dartdeepmimic", "AMCDartDeepMimicEnv"),
+               "rawqdq": ("visak_dartdeepmimic", "VisakDartDeepMimicEnv")}
+
+    @classmethod
+    def env_class(cls, mode):
+        module_name, class_name = cls.classes[mode]
+        return getattr(importlib.import_module(module_name), class_name)
 
     def __init__(self):
         super().__init__()
-        self.add_argument('--environment-mode', type=str, default="ddm",
-                          help='One of "ddm" or "vdmm", specifies which env'
-                          + ' to instantiate')
+        self.add_argument('--environment-mode', type=str, default="rawqdq",
+                          choices=sorted(self.classes),
+                          help='Which env to instantiate: "rawqdq" reads '
+                          + 'positions and velocities from text files, '
+                          + '"amc" parses an AMC file')
         self.add_argument('--control-skel-path', required=True,
                           help='Path to the control skeleton')
         self.add_argument('--ref-motion-path', required=True,
-                          help='Path to the reference motion AMC')
+                          help='Path to the reference motion AMC (or '
+                          + 'positions file in rawqdq mode)')
+        self.add_argument('--ref-motion-vel-path', default=None,
+                          help='Path to the reference velocities file, '
+                          + 'rawqdq mode only')
         self.add_argument('--policy-query-frequency', required=False,
                           type=float, default= 30,
                           help="Number of times per second to query policy")
@@ -80,10 +91,12 @@ class DartDeepMimicArgParse(argparse.ArgumentParser):
         self.add_argument('--com-inner-weight', type=float, default=-10,
                           help="Coefficient for com difference exponentiation in reward")
 
-        self.add_argument('--p-gain', type=float, default=300,
-                            help="P for the PD controller")
-        self.add_argument('--d-gain', type=float, default=50,
-                          help="D for the PD controller")
+        self.add_argument('--p-gain', type=float, default=None,
+                          help="P for the PD controller, the same for every "
+                          + "dof. Defaults to Visak's per-joint gains")
+        self.add_argument('--d-gain', type=float, default=None,
+                          help="D for the PD controller, the same for every "
+                          + "dof. Defaults to Visak's per-joint gains")
 
         gravity_group = self.add_mutually_exclusive_group()
         gravity_group.add_argument('--gravity',
@@ -112,64 +125,104 @@ class DartDeepMimicArgParse(argparse.ArgumentParser):
                                    action='store_false')
 
         self.set_defaults(delta=True, help="Are we in delta actions mode?")
-        self.add_argument('--seed', help='RNG seed', type=int,
-                          default=None)
+        self.add_argument('--history-length', type=int, default=0,
+                          help="Number of past (observation, action) pairs "
+                          + "stacked into the policy's input")
+        self.add_argument('--normalize-obs', action="store_true",
+                          help="Normalize observations w/ running "
+                          + "statistics kept by the env, saved along w/ "
+                          + "checkpoints")
+        self.add_argument('--adaptive-rsi', action="store_true",
+                          help="Draw random start frames more often where "
+                          + "episodes fail, instead of uniformly")
+        self.add_argument('--seed', type=int, default=None,
+                          help="Root seed every random stream is derived "
+                          + "from (see rng_streams.py)")
+
+        ppo_group = self.add_argument_group("PPO hyperparameters")
+        ppo_group.add_argument('--clip-param', type=float, default=0.2,
+                               help="Clipping range of the surrogate loss")
+        ppo_group.add_argument('--entcoeff', type=float, default=0.0,
+                               help="Weight of the entropy bonus")
+        ppo_group.add_argument('--optim-epochs', type=int, default=10,
+                               help="Passes over each batch of experience")
+        ppo_group.add_argument('--optim-stepsize', type=float, default=3e-4,
+                               help="Adam learning rate")
+        ppo_group.add_argument('--optim-batchsize', type=int, default=64,
+                               help="Minibatch size")
+        ppo_group.add_argument('--gamma', type=float, default=1.0,
+                               help="Discount factor")
+        ppo_group.add_argument('--lam', type=float, default=0.95,
+                               help="GAE lambda")
+        ppo_group.add_argument('--schedule', type=str, default="linear",
+                               help='Learning rate schedule, "constant" or '
+                               + '"linear"')
+        ppo_group.add_argument('--num-envs', type=int, default=1,
+                               help="Environments stepped in parallel, each "
+                               + "in its own process. Above 1 switches to "
+                               + "the vectorized trainer in ppo.py")
         self.args = None
 
-    def parse_args(self):
-        self.args = super().parse_args()
+    def parse_args(self, args=None):
+        self.args = super().parse_args(args)
         return self.args
 
-    def get_env(self):
-
-        dir_prefix = os.path.dirname(os.path.realpath(__file__)) + "/"
-
-        return DartDeepMimicArgParse.classes[self.args.environment_mode](
-            skeleton_path=dir_prefix + self.args.control_skel_path,
-            refmotion_path=None,
-            statemode=1, actionmode=2,
-            # pos_weight=.65, pos_inner_weight=-2,
-            # vel_weight=.1, vel_inner_weight=-.1,
-            # ee_weight=.15, ee_inner_weight=-40,
-            # com_weight=.1, com_inner_weight=-10,
-            default_damping=10, default_spring=0,
-            default_friction=20,
-            visualize=self.args.visualize,
-            screen_width=80, screen_height=45,
-            # gravity=True,
-            self_collide=True,
-            delta_actions=self.args.delta,
-            rng_seed=self.args.seed)
-
-        return DartDeepMimicArgParse.classes[self.args.environment_mode](
-            skeleton_path=self.args.control_skel_path,
-            refmotion_path=self.args.ref_motion_path,
-            policy_query_frequency=self.args.policy_query_frequency,
-            # refmotion_dt=self.args.ref_motion_dt,
+    def ppo_hyperparameters(self):
+        """
+        Keyword arguments shared by pposgd_simple.learn and ppo.learn
+        """
+        return {"clip_param": self.args.clip_param,
+                "entcoeff": self.args.entcoeff,
+                "optim_epochs": self.args.optim_epochs,
+                "optim_stepsize": self.args.optim_stepsize,
+                "optim_batchsize": self.args.optim_batchsize,
+                "gamma": self.args.gamma,
+                "lam": self.args.lam,
+                "schedule": self.args.schedule}
+
+    def env_kwargs(self):
+        """
+        Constructor arguments of the environment picked by
+        --environment-mode. Relative paths are taken from this directory.
+        --max-torque, --max-angle, --reward-cutoff, the default joint and
+        body parameters, --gravity and --self-collide aren't taken by the
+        environments (yet), so they don't appear here
+        """
+        dir_prefix = os.path.dirname(os.path.realpath(__file__))
+
+        kwargs = dict(
+            skel_path=os.path.join(dir_prefix, self.args.control_skel_path),
+            mocap_path=os.path.join(dir_prefix, self.args.ref_motion_path),
             statemode=self.args.state_mode,
             actionmode=self.args.action_mode,
-            p_gain=self.args.p_gain,
-            d_gain=self.args.d_gain,
-            pos_init_noise=self.args.pos_init_noise,
-            vel_init_noise=self.args.vel_init_noise,
-            reward_cutoff=self.args.reward_cutoff,
+            pos_noise=self.args.pos_init_noise,
+            vel_noise=self.args.vel_init_noise,
             pos_weight=self.args.pos_weight,
-            pos_inner_weight=self.args.pos_inner_weight,
+            pos_decay=self.args.pos_inner_weight,
             vel_weight=self.args.vel_weight,
-            vel_inner_weight=self.args.vel_inner_weight,
+            vel_decay=self.args.vel_inner_weight,
             ee_weight=self.args.ee_weight,
-            ee_inner_weight=self.args.ee_inner_weight,
+            ee_decay=self.args.ee_inner_weight,
             com_weight=self.args.com_weight,
-            com_inner_weight=self.args.com_inner_weight,
-            max_torque=self.args.max_torque,
-            max_angle=self.args.max_angle,
-            default_damping=self.args.default_damping,
-            default_spring=self.args.default_spring,
-            default_friction=self.args.default_friction,
-            visualize=self.args.visualize,
-            # simsteps_per_dataframe=self.args.simsteps_per_dataframe,
-            screen_width=self.args.window_width,
-            screen_height=self.args.window_height,
-            gravity=self.args.gravity,
-            self_collide=self.args.selfcollide,
-            rng_seed=self.args.seed)
+            com_decay=self.args.com_inner_weight,
+            delta_actions=self.args.delta,
+            history_length=self.args.history_length,
+            normalize_obs=self.args.normalize_obs,
+            adaptive_rsi=self.args.adaptive_rsi,
+            seed=self.args.seed)
+
+        if self.args.environment_mode == "rawqdq":
+            if self.args.ref_motion_vel_path is None:
+                raise RuntimeError("--ref-motion-vel-path is needed in "
+                                   + "rawqdq mode")
+            kwargs.update(
+                mocap_vel_path=os.path.join(dir_prefix,
+                                            self.args.ref_motion_vel_path),
+                p_gain=self.args.p_gain,
+                d_gain=self.args.d_gain)
+
+        return kwargs
+
+    def get_env(self):
+        return self.env_class(self.args.environment_mode)(
+            **self.env_kwargs())
@@ -0,0 +1,234 @@
+""" Headless evaluation of many checkpoints at once
+
+Every (checkpoint, seed, start) combination is one episode, run without
+rendering in a pool of worker processes which each build the environment
+once. Episodes start either from a fixed reference frame or from a random
+one (reference state initialization, as in training), and the results are
+summarized per checkpoint and kind of start as means w/ Student t
+confidence intervals of the return, the episode length and each tracking
+error term.
+
+    python eval_harness.py --checkpoints out/params_100 out/params_200 \\
+        --seeds 0 1 2 3 4 5 6 7 --start-frames 0
+"""
+
+import argparse
+import csv
+import math
+from collections import namedtuple, OrderedDict
+import multiprocessing
+from statistics import NormalDist
+import numpy as np
+
+from fork_server import reseed
+from rng_streams import stream_seed
+from numpy_policy import NumpyPolicy
+
+# start is a reference frame number, or RSI for a random one
+EvalJob = namedtuple("EvalJob", ["checkpoint", "seed", "start"])
+RSI = "rsi"
+
+# Set up in every worker by _init_worker. Only the policy of the last
+# checkpoint is kept: jobs come grouped by checkpoint (see make_jobs), and
+# a long lived pool (e.g. the watcher's) sees an endless stream of them
+_env = None
+_policies = {}
+
+
+def _init_worker(env_fn):
+    global _env
+    _env = env_fn()
+
+
+def _policy(checkpoint):
+    if checkpoint not in _policies:
+        _policies.clear()
+        _policies[checkpoint] = NumpyPolicy.load(checkpoint)
+    return _policies[checkpoint]
+
+
+def run_episode(env, policy, job, max_steps, stochastic=False):
+    """
+    Run a single episode of job, returning its return, length and the
+    tracking errors averaged over its steps
+    """
+    reseed(env, job.seed)
+    policy.random.seed(stream_seed(job.seed, "policy"))
+    # Workers run jobs of different checkpoints one after the other, so
+    # this also undoes what the previous one set
+    policy.prepare_env(env)
+
+    ob = env.reset(framenum=None if job.start == RSI else job.start,
+                   noise=False)
+
+    total_reward, length = 0., 0
+    error_sums = {}
+    done = False
+    while not done and length < max_steps:
+        action, _ = policy.act(stochastic, ob)
+        ob, reward, done, info = env.step(action)
+        total_reward += reward
+        length += 1
+        for term, error in info.get("tracking_errors", {}).items():
+            error_sums[term] = error_sums.get(term, 0.) + error
+
+    result = OrderedDict([("checkpoint", job.checkpoint),
+                          ("seed", job.seed), ("start", job.start),
+                          ("return", total_reward), ("length", length)])
+    for term, error_sum in sorted(error_sums.items()):
+        result[term + "_error"] = error_sum / length
+    return result
+
+
+def _run_job(args):
+    job, max_steps, stochastic = args
+    return run_episode(_env, _policy(job.checkpoint), job, max_steps,
+                       stochastic)
+
+
+def make_jobs(checkpoints, seeds, start_frames=(0,), rsi=True):
+    starts = list(start_frames) + ([RSI] if rsi else [])
+    return [EvalJob(checkpoint, seed, start)
+            for checkpoint in checkpoints
+            for start in starts
+            for seed in seeds]
+
+
+def make_pool(env_fn, num_workers=None):
+    """
+    Pool of num_workers processes (all cores by default), each w/ its own
+    environment built by env_fn, for evaluate() to reuse
+    """
+    return multiprocessing.Pool(num_workers, initializer=_init_worker,
+                                initargs=(env_fn,))
+
+
+def evaluate(env_fn, jobs, max_steps=1000, stochastic=False,
+             num_workers=None, pool=None):
+    """
+    Run every job in a pool of num_workers processes, or in pool if given.
+    Returns the results of the episodes in the order of jobs
+    """
+    args = [(job, max_steps, stochastic) for job in jobs]
+    if pool is not None:
+        return pool.map(_run_job, args, chunksize=1)
+    with make_pool(env_fn, num_workers) as pool:
+        return pool.map(_run_job, args, chunksize=1)
+
+
+def t_quantile(p, df):
+    """
+    Quantile p of Student's t distribution w/ df degrees of freedom. W/o
+    scipy, it's exact for df <= 2 and otherwise Hill's expansion around the
+    normal quantile, within 1% from df = 3 on
+    """
+    try:
+        from scipy.stats import t
+    except ImportError:
+        pass
+    else:
+        return float(t.ppf(p, df))
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) * math.sqrt(2 / (4 * p * (1 - p)))
+    z = NormalDist().inv_cdf(p)
+    return (z + (z ** 3 + z) / (4 * df)
+            + (5 * z ** 5 + 16 * z ** 3 + 3 * z) / (96 * df ** 2)
+            + (3 * z ** 7 + 19 * z ** 5 + 17 * z ** 3 - 15 * z)
+            / (384 * df ** 3)
+            + (79 * z ** 9 + 776 * z ** 7 + 1482 * z ** 5 - 1920 * z ** 3
+               - 945 * z) / (92160 * df ** 4))
+
+
+def summarize(results, confidence=0.95):
+    """
+    One row per (checkpoint, start kind): number of episodes, then the
+    (mean, confidence interval half width) of every other quantity. Fixed
+    start frames are pooled together, apart from RSI. The intervals use
+    the t distribution, as there are usually only a handful of episodes
+    """
+    groups = OrderedDict()
+    for result in results:
+        kind = RSI if result["start"] == RSI else "fixed"
+        groups.setdefault((result["checkpoint"], kind), []).append(result)
+
+    rows = []
+    for (checkpoint, kind), group in groups.items():
+        row = OrderedDict([("checkpoint", checkpoint), ("start", kind),
+                           ("episodes", len(group))])
+        for key in group[0]:
+            if key in ["checkpoint", "seed", "start"]:
+                continue
+            values = np.array([result[key] for result in group], dtype=float)
+            half_width = t_quantile((1 + confidence) / 2, len(values) - 1) \
+                * values.std(ddof=1) / np.sqrt(len(values)) \
+                if len(values) > 1 else np.nan
+            row[key] = (values.mean(), half_width)
+        rows.append(row)
+    return rows
+
+
+def format_table(rows):
+    """
+    Plain text table of summarize()'s rows
+    """
+    if not rows:
+        return ""
+    header = list(rows[0].keys())
+    lines = [header]
+    for row in rows:
+        lines.append([str(value) if not isinstance(value, tuple)
+                      else "%.4g +- %.2g" % value for value in row.values()])
+    widths = [max(len(line[i]) for line in lines) for i in range(len(header))]
+    return "\n".join("  ".join(cell.ljust(width)
+                               for cell, width in zip(line, widths))
+                     for line in lines)
+
+
+def write_csv(results, path):
+    """
+    Per episode results, one row each
+    """
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.DictWriter(csv_file, fieldnames=list(results[0].keys()))
+        writer.writeheader()
+        writer.writerows(results)
+
+
+if __name__ == "__main__":
+
+    from functools import partial
+    from visak_dartdeepmimic import make_walk_env
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate checkpoints headlessly on all cores")
+    parser.add_argument("--checkpoints", nargs="+", required=True,
+                        help="Checkpoint prefixes or exported .npz policies")
+    parser.add_argument("--seeds", nargs="+", type=int,
+                        default=list(range(8)))
+    parser.add_argument("--start-frames", nargs="*", type=int, default=[0],
+                        help="Reference frames to start episodes from")
+    parser.add_argument("--no-rsi", dest="rsi", action="store_false",
+                        help="Don't run episodes from random start frames")
+    parser.add_argument("--max-steps", type=int, default=1000)
+    parser.add_argument("--history-length", type=int, default=0,
+                        help="Same as the policies were trained w/")
+    parser.add_argument("--stochastic", action="store_true",
+                        help="Sample actions instead of taking the mean")
+    parser.add_argument("--num-workers", type=int, default=None)
+    parser.add_argument("--confidence", type=float, default=0.95)
+    parser.add_argument("--csv", type=str, default=None,
+                        help="Where to also write the per-episode results")
+    args = parser.parse_args()
+
+    jobs = make_jobs(args.checkpoints, args.seeds, args.start_frames,
+                     args.rsi)
+    # Normalization is set up per policy, from what it was exported w/
+    env_fn = partial(make_walk_env, history_length=args.history_length)
+    results = evaluate(env_fn, jobs, max_steps=args.max_steps,
+                       stochastic=args.stochastic,
+                       num_workers=args.num_workers)
+    print(format_table(summarize(results, args.confidence)))
+    if args.csv is not None:
+        write_csv(results, args.csv)
@@ -1,27 +1,15 @@
 import argparse
-import ddm_argparse
-from baselines.common import tf_util as U
-from baselines.ppo1 import mlp_policy, pposgd_simple
-import numpy as np
-import tensorflow as tf
-import random
-from test_ddm import raw_env
-import argparse
-from train_jesus import make_dart_env
-from gym.envs.registration import register
+from env_jesus import DartHumanoid3D_cartesian
+from numpy_policy import NumpyPolicy
+from rng_streams import new_root_seed
 
 class PolicyLoaderAgent(object):
     """The world's simplest agent!"""
-    def __init__(self, param_path, obs_space, action_space, hid_size,
-                 num_hid_layers):
+    def __init__(self, param_path, action_space):
         self.action_space = action_space
 
-        self.actor = mlp_policy.MlpPolicy("pi", obs_space, action_space,
-                                          hid_size=hid_size,
-                                          num_hid_layers=num_hid_layers)
-        U.initialize()
-        saver = tf.train.Saver()
-        saver.restore(tf.get_default_session(), param_path)
+        # Either an export from numpy_policy.py or a checkpoint prefix
+        self.actor = NumpyPolicy.load(param_path)
 
     def act(self, observation, reward, done):
         action2, unknown = self.actor.act(False, observation)
@@ -33,11 +21,6 @@ if __name__ == "__main__":
     # parser = ddm_argparse.DartDeepMimicArgParse()
     parser = argparse.ArgumentParser()
     parser.add_argument("--params-prefix", required=True, type=str)
-    # parser.add_argument('--hidden-dims', type=str, default="64,64",
-    #                     help="Within quotes, sizes of each hidden layer "
-    #                     + "seperated by commas [also, no whitespace]")
-    parser.add_argument('--hid-size', default=64, type=int)
-    parser.add_argument('--num-hid-layers', default=2, type=int)
     terminate_group = parser.add_mutually_exclusive_group()
     terminate_group.add_argument('--use-env-done',
                                 dest='terminate',
@@ -56,29 +39,25 @@ if __name__ == "__main__":
                             action='store_true')
     parser.set_defaults(randinit=True,
                         help="Whether to initialize from start or randomly")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Root seed of the env's random streams, see "
+                        + "rng_streams.py")
 
     args = parser.parse_args()
     # parser.args.control_skel_path = "/home/anish/Code/deepmimic/assets/skel/kima_original.skel"
     # hidden_dims = [int(i) for i in args.hidden_dims.split(",")]
     # env = parser.get_env()
     # env = raw_env(0)
-    env = make_dart_env("raw-v0", 5)
-
-    U.make_session(num_cpu=1).__enter__()
+    root_seed = new_root_seed() if args.seed is None else args.seed
+    print("Root seed: " + str(root_seed))
+    env = DartHumanoid3D_cartesian(root_seed)
 
-    U.initialize()
-
-    agent = PolicyLoaderAgent(args.params_prefix,
-                              env.observation_space,
-                              env.action_space,
-                              hid_size=args.hid_size,
-                              num_hid_layers=args.num_hid_layers)
+    agent = PolicyLoaderAgent(args.params_prefix, env.action_space)
 
     episode_count = 100
     reward = 0
     done = False
 
-    env = env.env
     env.num_frames = 300
 
     while True:
@@ -88,7 +67,8 @@ if __name__ == "__main__":
         else:
             # ob = env.reset(random.randint(0, env.num_frames - 1),
             #                pos_stdv=0, vel_stdv=0)
-            ob = env.reset(random.randint(0, env.num_frames - 1))
+            # reset() takes no frame, it draws the start frame from env.random
+            ob = env.reset()
 
         done = False
         cum_reward = 0
@@ -1,26 +1,15 @@
 import argparse
-import ddm_argparse
-from baselines.common import tf_util as U
-from baselines.ppo1 import mlp_policy, pposgd_simple
-import numpy as np
-import tensorflow as tf
-import random
-from test_ddm import vddm_env
-import argparse
-from gym.envs.registration import register
+from visak_dartdeepmimic import make_walk_env
+from numpy_policy import NumpyPolicy
+from rng_streams import new_root_seed
 
 class PolicyLoaderAgent(object):
     """The world's simplest agent!"""
-    def __init__(self, param_path, obs_space, action_space, hid_size,
-                 num_hid_layers):
+    def __init__(self, actor, action_space):
         self.action_space = action_space
 
-        self.actor = mlp_policy.MlpPolicy("pi", obs_space, action_space,
-                                          hid_size=hid_size,
-                                          num_hid_layers=num_hid_layers)
-        U.initialize()
-        saver = tf.train.Saver()
-        saver.restore(tf.get_default_session(), param_path)
+        # A NumpyPolicy, from an export or a checkpoint prefix
+        self.actor = actor
 
     def act(self, observation, reward, done):
         action2, unknown = self.actor.act(False, observation)
@@ -32,11 +21,6 @@ if __name__ == "__main__":
     # parser = ddm_argparse.DartDeepMimicArgParse()
     parser = argparse.ArgumentParser()
     parser.add_argument("--params-prefix", required=True, type=str)
-    # parser.add_argument('--hidden-dims', type=str, default="64,64",
-    #                     help="Within quotes, sizes of each hidden layer "
-    #                     + "seperated by commas [also, no whitespace]")
-    parser.add_argument('--hid-size', default=64, type=int)
-    parser.add_argument('--num-hid-layers', default=2, type=int)
     terminate_group = parser.add_mutually_exclusive_group()
     terminate_group.add_argument('--use-env-done',
                                 dest='terminate',
@@ -55,19 +39,23 @@ if __name__ == "__main__":
                             action='store_true')
     parser.set_defaults(randinit=True,
                         help="Whether to initialize from start or randomly")
+    parser.add_argument("--history-length", type=int, default=0,
+                        help="Same as the policy was trained w/")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Root seed of the env's random streams, see "
+                        + "rng_streams.py")
 
     args = parser.parse_args()
-    env = vddm_env(random.randint(0, 30000))
-
-    U.make_session(num_cpu=1).__enter__()
-
-    U.initialize()
+    root_seed = new_root_seed() if args.seed is None else args.seed
+    print("Root seed: " + str(root_seed))
+    actor = NumpyPolicy.load(args.params_prefix)
+    env = make_walk_env(root_seed,
+                        normalize_obs=actor.env_obs_stats is not None,
+                        history_length=args.history_length)
+    # Observations normalized w/ the statistics saved along w/ the policy
+    actor.prepare_env(env)
 
-    agent = PolicyLoaderAgent(args.params_prefix,
-                              env.observation_space,
-                              env.action_space,
-                              hid_size=args.hid_size,
-                              num_hid_layers=args.num_hid_layers)
+    agent = PolicyLoaderAgent(actor, env.action_space)
 
     episode_count = 100
     reward = 0
@@ -77,8 +65,7 @@ if __name__ == "__main__":
         if not args.randinit:
             ob = env.reset(framenum=0, noise=False)
         else:
-            ob = env.reset(framenum=random.randint(0, env.num_frames - 1),
-                           noise=False)
+            ob = env.reset(framenum=env.get_random_framenum(), noise=False)
 
         done = False
         cum_reward = 0
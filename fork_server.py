@@ -0,0 +1,148 @@
+""" Prewarmed environment workers
+
+Building an environment means initializing pydart, parsing the skel file and
+its meshes, loading the reference motion and constructing its frames, which
+takes seconds. A ForkServer pays for that once: a server process builds a
+single template environment, and every worker is then an os.fork() of the
+server, inheriting the fully built environment (reference tables included,
+shared copy-on-write) for the cost of a fork.
+"""
+
+import gc
+import multiprocessing
+from multiprocessing.connection import Client, Connection, wait, \
+    answer_challenge, deliver_challenge
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
+from vec_env import _worker
+from rng_streams import seed_env, seed_process
+
+
+def reseed(env, root_seed, rank=0, env_index=0):
+    """
+    Give a forked copy of an environment its own random streams, otherwise
+    every worker would replay the template's. See rng_streams.py
+    """
+    seed_process(root_seed, rank, env_index)
+    seed_env(env, root_seed, rank, env_index)
+
+
+def _serve(env_fn, control, address, authkey, placement):
+    """
+    Build the template environment, then fork a worker off it for every
+    request until told to close
+    """
+    env = env_fn()
+    # Forked workers are never waited on, let the kernel reap them
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    # Keep the garbage collector from touching (and so copying) every page
+    # holding the template's objects in each worker
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+    control.send(None)
+
+    while True:
+        command = control.recv()
+
+        if command == "close":
+            break
+
+        index, root_seed, rank = command
+        if os.fork() == 0:
+            # Worker
+            try:
+                control.close()
+                reseed(env, root_seed, rank, index)
+                conn = Client(address, authkey=authkey)
+                conn.send(index)
+                _worker(index, lambda: env, conn, placement)
+            finally:
+                os._exit(0)
+
+    env.close()
+
+
+class ForkServer:
+    """
+    Forks environment workers off a prewarmed template built by env_fn (a
+    picklable callable, as for SharedMemoryVecEnv). Workers connect back
+    over a unix socket and then speak the SharedMemoryVecEnv protocol, e.g.
+
+        server = ForkServer(partial(make_walk_env))
+        env = SharedMemoryVecEnv.from_fork_server(server, 16, root_seed)
+
+    Workers are pinned according to placement, a
+    cpu_placement.PlacementPlan, if given. spawn() gives up on a worker
+    which hasn't connected back after spawn_timeout seconds. The server
+    relies on os.fork(), so this only works on unix
+    """
+
+    def __init__(self, env_fn, placement=None, spawn_timeout=60.):
+
+        self.spawn_timeout = spawn_timeout
+        self._directory = tempfile.mkdtemp(prefix="ddm_fork_server_")
+        self._authkey = os.urandom(16)
+        # A plain socket rather than a Listener, whose accept() can't time
+        # out
+        address = os.path.join(self._directory, "socket")
+        self._listener = socket.socket(socket.AF_UNIX)
+        self._listener.bind(address)
+        self._listener.listen()
+
+        context = multiprocessing.get_context("fork")
+        self._control, server_control = context.Pipe()
+        self._process = context.Process(target=_serve,
+                                        args=(env_fn, server_control,
+                                              address, self._authkey,
+                                              placement),
+                                        daemon=True)
+        self._process.start()
+        server_control.close()
+
+        # Wait for the template to be built
+        self._control.recv()
+        self.closed = False
+
+    def spawn(self, index, root_seed, rank=0):
+        """
+        Fork a worker serving environment number index of rank, w/ the
+        streams derived from root_seed. Returns the connection to it
+        """
+        self._raise_if_dead()
+        self._control.send((index, root_seed, rank))
+
+        # A worker dying before it connects (or the server dying) would
+        # otherwise leave us waiting forever
+        ready = wait([self._listener, self._process.sentinel],
+                     self.spawn_timeout)
+        if self._listener not in ready:
+            self._raise_if_dead()
+            raise RuntimeError("Worker %i didn't connect back within %g s"
+                               % (index, self.spawn_timeout))
+        sock, _ = self._listener.accept()
+        conn = Connection(sock.detach())
+        # Same handshake as Listener.accept()
+        deliver_challenge(conn, self._authkey)
+        answer_challenge(conn, self._authkey)
+        if conn.recv() != index:
+            raise RuntimeError("Forked worker connected out of order")
+        return conn
+
+    def _raise_if_dead(self):
+        if not self._process.is_alive():
+            raise RuntimeError("Fork server died w/ exit code %s"
+                               % self._process.exitcode)
+
+    def close(self):
+        if self.closed:
+            return
+        if self._process.is_alive():
+            self._control.send("close")
+        self._process.join()
+        self._listener.close()
+        shutil.rmtree(self._directory, ignore_errors=True)
+        self.closed = True
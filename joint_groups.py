@@ -0,0 +1,190 @@
+""" Joint layout of the kima humanoid used by the hand-written environments
+
+env_jesus, raw_env_reduced and humanoid_redux all hard-code the same
+skeleton. The table here describes it once, and JointGroups turns it into
+index arrays so that observations, action decoding and the quaternion
+reward work on all joints at the same time instead of one limb after the
+other.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+from batch_rotations import euler2quats, quats_inverse, relative_angles, \
+    angle_axes2euler
+
+# name: only there for humans
+# body: index of the body the joint moves. Groups without a body (the
+#       thorax) aren't part of the per-body observation, and are compared
+#       dof by dof instead of as a rotation
+# dofs: indices into q of the (z, y, x) euler angles of the joint, None for
+#       axes the joint doesn't have
+# actions: slice of the network output driving the joint, either an angle
+#          followed by an axis or a single angle for hinges
+JointGroup = namedtuple("JointGroup", ["name", "body", "dofs", "actions"])
+
+KIMA_JOINT_GROUPS = [
+    JointGroup("lthigh", 2, (8, 7, 6), slice(0, 4)),
+    JointGroup("lknee", 3, (None, None, 9), slice(4, 5)),
+    JointGroup("lfoot", 4, (11, None, 10), slice(5, 9)),
+    JointGroup("rthigh", 5, (14, 13, 12), slice(9, 13)),
+    JointGroup("rknee", 6, (None, None, 15), slice(13, 14)),
+    JointGroup("rfoot", 7, (17, None, 16), slice(14, 18)),
+    JointGroup("thorax", None, (20, 19, 18), slice(18, 22)),
+    JointGroup("larm", 12, (23, 22, 21), slice(22, 26)),
+    JointGroup("lelbow", 13, (None, None, 24), slice(26, 27)),
+    JointGroup("rarm", 15, (27, 26, 25), slice(27, 31)),
+    JointGroup("relbow", 16, (None, None, 28), slice(31, 32)),
+]
+
+
+class JointGroups:
+    """
+    Gather/scatter index arrays derived from a list of JointGroups.
+
+    The observation is, for every group with a body: the body COM relative
+    to the root COM, the joint rotation as a quaternion, the body COM
+    velocity and the joint dq. Then q and dq of the groups without a body,
+    and finally the phase
+    """
+
+    def __init__(self, groups, ndofs, root_dofs=6):
+
+        self.groups = groups
+        self.ndofs = ndofs
+        self.root_dofs = root_dofs
+
+        body_groups = [g for g in groups if g.body is not None]
+        direct_groups = [g for g in groups if g.body is None]
+
+        ##################################################
+        # Rotations, used by the observation and reward #
+        ##################################################
+
+        self.bodies = np.array([g.body for g in body_groups])
+        # Missing axes point one past the end of q, which gets padded w/ 0
+        self._euler_indices = np.array([[ndofs if i is None else i
+                                         for i in g.dofs]
+                                        for g in body_groups])
+        self.direct_dofs = np.array([i for g in direct_groups
+                                     for i in sorted(self._present(g))])
+
+        ###############
+        # Observation #
+        ###############
+
+        relpos, quat, vel, dq_obs, dq_dofs = [], [], [], [], []
+        index = 0
+        for g in body_groups:
+            relpos.append(range(index, index + 3))
+            quat.append(range(index + 3, index + 7))
+            vel.append(range(index + 7, index + 10))
+            index += 10
+            for dof in sorted(self._present(g)):
+                dq_obs.append(index)
+                dq_dofs.append(dof)
+                index += 1
+
+        self._obs_relpos = np.array(relpos)
+        self._obs_quat = np.array(quat)
+        self._obs_vel = np.array(vel)
+        self._obs_dq = np.array(dq_obs)
+        self._obs_dq_dofs = np.array(dq_dofs)
+        num_direct = len(self.direct_dofs)
+        self._obs_direct_q = np.arange(index, index + num_direct)
+        self._obs_direct_dq = self._obs_direct_q + num_direct
+        self.obs_dim = index + 2 * num_direct + 1
+
+        ###################
+        # Action decoding #
+        ###################
+
+        hinge_actions, hinge_dofs = [], []
+        aa_actions, aa_dofs, aa_angles = [], [], []
+        for g in groups:
+            actions = range(g.actions.start, g.actions.stop)
+            if len(actions) == 1:
+                hinge_actions.append(actions[0])
+                hinge_dofs.append(g.dofs[2])
+            else:
+                for axis, dof in enumerate(g.dofs):
+                    if dof is not None:
+                        aa_dofs.append(dof)
+                        aa_angles.append(3 * len(aa_actions) + axis)
+                aa_actions.append(actions)
+
+        self.action_dim = max(g.actions.stop for g in groups)
+        self._hinge_actions = np.array(hinge_actions)
+        self._hinge_targets = np.array(hinge_dofs) - root_dofs
+        self._aa_actions = np.array(aa_actions)
+        self._aa_targets = np.array(aa_dofs) - root_dofs
+        self._aa_angles = np.array(aa_angles)
+
+    @staticmethod
+    def _present(group):
+        return [i for i in group.dofs if i is not None]
+
+    def eulers(self, qs):
+        """
+        Given an (..., ndofs) array of skeleton positions, return the
+        (..., num body groups, 3) array of (z, y, x) euler angles of the
+        joints
+        """
+        qs = np.asarray(qs, dtype=float)
+        padded = np.concatenate([qs, np.zeros(qs.shape[:-1] + (1,))], axis=-1)
+        return padded[..., self._euler_indices]
+
+    def quats(self, qs):
+        return euler2quats(self.eulers(qs))
+
+    def reference_quat_inverses(self, positions):
+        """
+        Precompute the inverse reference quaternion of every joint on every
+        frame of a (num frames, ndofs) array of reference positions. Returns
+        a (num frames, num body groups, 4) array
+        """
+        return quats_inverse(self.quats(positions))
+
+    def quat_reward(self, q, inv_ref_quats, ref_q):
+        """
+        Reward for matching the pose of a reference frame, given the frame's
+        precomputed inverse quaternions and its positions
+        """
+        diffs = np.concatenate([relative_angles(inv_ref_quats, self.quats(q)),
+                                q[self.direct_dofs] - ref_q[self.direct_dofs]])
+        return np.exp(-2*np.sum(np.square(diffs)))
+
+    def observation(self, kin, phase):
+        """
+        Build the observation from a KinematicSnapshot and the phase of the
+        reference motion
+        """
+        q, dq, coms = kin.q, kin.dq, kin.coms
+
+        obs = np.empty(self.obs_dim)
+        obs[self._obs_relpos] = coms[self.bodies] - coms[0]
+        obs[self._obs_quat] = self.quats(q)
+        obs[self._obs_vel] = kin.com_velocities[self.bodies]
+        obs[self._obs_dq] = dq[self._obs_dq_dofs]
+        obs[self._obs_direct_q] = q[self.direct_dofs]
+        obs[self._obs_direct_dq] = dq[self.direct_dofs]
+        obs[-1] = phase
+
+        return obs
+
+    def targets(self, actions):
+        """
+        Decode a network output into target angles for the actuated (non
+        root) dofs
+        """
+        actions = np.asarray(actions, dtype=float)
+
+        targets = np.zeros(self.ndofs - self.root_dofs)
+        targets[self._hinge_targets] = actions[self._hinge_actions]
+        eulers = angle_axes2euler(actions[self._aa_actions])
+        targets[self._aa_targets] = eulers.reshape(-1)[self._aa_angles]
+
+        return targets
+
+
+KIMA_JOINTS = JointGroups(KIMA_JOINT_GROUPS, ndofs=29)
@@ -0,0 +1,186 @@
+import numpy as np
+
+# End effectors of the kima humanoid as (body name, offset in body frame).
+# The order is the one the reference end effector data is stored in
+KIMA_END_EFFECTORS = [("r-upperarm_body", [0., -0.60, -0.15]),
+                      ("l-upperarm_body", [0., -0.60, -0.15]),
+                      ("r-foot_body", [0., 0., -0.20]),
+                      ("l-foot_body", [0., 0., -0.20])]
+
+
+class EndEffectors:
+    """
+    A set of points fixed to bodies of a skeleton, declared as a list of
+    (body name, local offset) pairs. Their world positions are computed for
+    all of them at once from the body world transforms
+    """
+
+    def __init__(self, skel, spec):
+        body_names = [body.name for body in skel.bodynodes]
+        self.names = [name for name, _ in spec]
+        self.body_indices = np.array([body_names.index(name)
+                                      for name in self.names])
+        self.offsets = np.array([offset for _, offset in spec], dtype=float)
+
+    def positions(self, transforms):
+        """
+        Given the (nbodies, 4, 4) world transforms of the skeleton, return a
+        numpy array w/ each row being the position of an end effector
+        """
+        body_transforms = transforms[self.body_indices]
+        return np.einsum("nij,nj->ni", body_transforms[:, :3, :3],
+                         self.offsets) + body_transforms[:, :3, 3]
+
+
+class KinematicSnapshot:
+    """
+    Lazily fetched, cached copy of everything we read off a skeleton during a
+    step: q, dq, body COMs, body COM velocities and body world transforms.
+
+    Every pydart accessor crosses into C++ and allocates, and the same values
+    used to be fetched over and over by the observation, reward and
+    termination code. A snapshot fetches each quantity (for all bodies at
+    once) the first time it's needed and keeps it around until the state
+    changes.
+
+    If a world is given the snapshot invalidates itself whenever the world is
+    stepped. Anything else which changes the skeleton state (set_state,
+    set_positions...) needs to be followed by a call to invalidate(). Without
+    a world the snapshot never refreshes itself, so it should only be used
+    for a single read of the state.
+
+    When given a set of EndEffectors the snapshot also caches their world
+    positions, so they are computed once per step no matter how many of the
+    reward, observation and debug drawing code need them.
+
+    The arrays handed out are shared between all readers, DON'T modify them
+    """
+
+    def __init__(self, skel, world=None, end_effectors=None):
+        self.skel = skel
+        self.world = world
+        self.end_effectors = end_effectors
+        self.invalidate()
+
+    def invalidate(self):
+        self._frame = None if self.world is None else self.world.frame
+        self._q = None
+        self._dq = None
+        self._state = None
+        self._coms = None
+        self._com_velocities = None
+        self._transforms = None
+        self._ee_positions = None
+
+    def _refresh(self):
+        if self.world is not None and self.world.frame != self._frame:
+            self.invalidate()
+
+    @property
+    def q(self):
+        self._refresh()
+        if self._q is None:
+            self._q = self.skel.q
+        return self._q
+
+    @property
+    def dq(self):
+        self._refresh()
+        if self._dq is None:
+            self._dq = self.skel.dq
+        return self._dq
+
+    @property
+    def state(self):
+        """
+        Same thing as DartEnv.state_vector, [q, dq]
+        """
+        self._refresh()
+        if self._state is None:
+            self._state = np.concatenate([self.q, self.dq])
+        return self._state
+
+    @property
+    def coms(self):
+        """
+        (nbodies, 3) array of body centers of mass in world coordinates
+        """
+        self._refresh()
+        if self._coms is None:
+            self._coms = np.array([body.com() for body in self.skel.bodynodes])
+        return self._coms
+
+    @property
+    def com_velocities(self):
+        """
+        (nbodies, 3) array of linear velocities of the body centers of mass
+        """
+        self._refresh()
+        if self._com_velocities is None:
+            self._com_velocities = np.array([body.dC
+                                             for body in self.skel.bodynodes])
+        return self._com_velocities
+
+    @property
+    def transforms(self):
+        """
+        (nbodies, 4, 4) array of body to world transforms
+        """
+        self._refresh()
+        if self._transforms is None:
+            self._transforms = np.array([body.world_transform()
+                                         for body in self.skel.bodynodes])
+        return self._transforms
+
+    @property
+    def ee_positions(self):
+        """
+        (num end effectors, 3) array of end effector world positions
+        """
+        self._refresh()
+        if self._ee_positions is None:
+            self._ee_positions = self.end_effectors.positions(self.transforms)
+        return self._ee_positions
+
+
+class KinematicsMixin:
+    """
+    Gives a DartEnv a kinematics() method which hands out snapshots of its
+    skeletons, and keeps those snapshots in sync with set_state. Should come
+    before DartEnv in the list of base classes.
+
+    Set end_effectors (an EndEffectors instance) to have the snapshots track
+    end effector positions as well
+    """
+
+    end_effectors = None
+
+    def kinematics(self, skel=None):
+        """
+        Return the kinematic snapshot of skel (the robot skeleton by default).
+        Skeletons in the simulation world get a cached snapshot which is
+        refreshed every time the world steps; any other skeleton gets a
+        throwaway one which is only good for the current state
+        """
+        if skel is None:
+            skel = self.robot_skeleton
+
+        snapshots = self.__dict__.setdefault("_snapshots", {})
+        snapshot = snapshots.get(id(skel))
+        if snapshot is not None:
+            return snapshot
+
+        world = getattr(self, "dart_world", None)
+        if world is None or skel not in world.skeletons:
+            return KinematicSnapshot(skel, end_effectors=self.end_effectors)
+
+        snapshot = KinematicSnapshot(skel, world, self.end_effectors)
+        snapshots[id(skel)] = snapshot
+        return snapshot
+
+    def set_state(self, qpos, qvel):
+        super().set_state(qpos, qvel)
+        self.kinematics().invalidate()
+
+    def state_vector(self):
+        return self.kinematics().state
@@ -0,0 +1,72 @@
+""" Helpers for data-parallel training under mpirun
+
+baselines' ppo1 already averages gradients (MpiAdam) and the policy's own
+observation filter over MPI.COMM_WORLD, so running the training scripts w/
+
+    mpirun -np 4 python train_dartdeepmimic.py ...
+
+gives N ranks collecting rollouts in parallel. What's left is giving every
+rank random streams of its own, keeping checkpoints to a single rank, and keeping the
+observation statistics held by the environments in sync.
+"""
+
+from mpi4py import MPI
+
+from running_stats import RunningMeanStd
+from rng_streams import new_root_seed
+
+
+def rank():
+    return MPI.COMM_WORLD.Get_rank()
+
+
+def is_root():
+    return rank() == 0
+
+
+def node_rank_and_size():
+    """
+    Rank among, and number of, the ranks running on this machine. Every
+    rank has to call it
+    """
+    node = MPI.COMM_WORLD.Split_type(MPI.COMM_TYPE_SHARED)
+    return node.Get_rank(), node.Get_size()
+
+
+def size():
+    return MPI.COMM_WORLD.Get_size()
+
+
+def shared_root_seed(seed=None):
+    """
+    seed, or fresh entropy picked by rank 0 when it's None, the same on
+    every rank. Ranks then derive their own streams from it, see
+    rng_streams.py
+    """
+    if seed is None and is_root():
+        seed = new_root_seed()
+    return MPI.COMM_WORLD.bcast(seed)
+
+
+class RunningStatsSync:
+    """
+    Keeps a RunningMeanStd identical across ranks. Between calls to sync()
+    every rank adds its own samples; sync() then gathers what each rank
+    added since the last sync and merges all of it on every rank, so that
+    the result is the same as one instance having seen every sample
+    """
+
+    def __init__(self, stats, comm=None):
+        self.stats = stats
+        self.comm = MPI.COMM_WORLD if comm is None else comm
+        self._base = stats.copy()
+
+    def sync(self):
+        local = self.stats.since(self._base)
+        merged = self._base.copy()
+        for state in self.comm.allgather(local.state_dict()):
+            other = RunningMeanStd(self.stats.mean.shape)
+            other.load_state_dict(state)
+            merged.merge(other)
+        self.stats.load_state_dict(merged.state_dict())
+        self._base = self.stats.copy()
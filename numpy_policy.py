@@ -0,0 +1,189 @@
+""" Running trained policies without TensorFlow
+
+export_policy() pulls the weights of a baselines ppo1 MlpPolicy (and its
+observation filter) out of a checkpoint into a small .npz, and NumpyPolicy
+runs the same forward pass in plain NumPy, on one observation or a batch.
+TensorFlow is only needed to read old tf.train.Saver checkpoints; the .npz
+checkpoints written by CheckpointManager are read directly.
+"""
+
+import os
+import numpy as np
+
+from running_stats import MIN_VARIANCE, CLIP_RANGE, RunningMeanStd, \
+    obs_stats_path
+
+# Name of the policy's scope in the checkpoints, see train_*.py
+POLICY_SCOPE = "pi"
+
+
+def variables_path(prefix):
+    # Same as checkpoints.variables_path, which can't be imported w/o TF
+    return prefix + ".npz"
+
+
+def _read_checkpoint(prefix):
+    """
+    {variable name without the ":0": array} for a checkpoint prefix
+    """
+    if os.path.exists(variables_path(prefix)):
+        with np.load(variables_path(prefix)) as data:
+            return {name.split(":")[0]: data[name] for name in data}
+
+    import tensorflow as tf
+    reader = tf.train.NewCheckpointReader(prefix)
+    return {name: reader.get_tensor(name)
+            for name in reader.get_variable_to_shape_map()}
+
+
+def _mlp(variables, scope):
+    """
+    Weights and biases of fc1, fc2, ... then final under scope
+    """
+    layers = []
+    while scope + "/fc%i/kernel" % (len(layers) + 1) in variables:
+        name = scope + "/fc%i" % (len(layers) + 1)
+        layers.append((variables[name + "/kernel"], variables[name + "/bias"]))
+    layers.append((variables[scope + "/final/kernel"],
+                   variables[scope + "/final/bias"]))
+    return layers
+
+
+def export_arrays(checkpoint_prefix, scope=POLICY_SCOPE):
+    """
+    Arrays making up the exported policy, see export_policy()
+    """
+    variables = _read_checkpoint(checkpoint_prefix)
+    arrays = {}
+
+    obfilter = scope + "/obfilter/"
+    count = variables[obfilter + "count"]
+    mean = variables[obfilter + "runningsum"] / count
+    # Same formula as baselines' MpiRunningMeanStd
+    var = variables[obfilter + "runningsumsq"] / count - np.square(mean)
+    arrays["obs_mean"] = mean
+    arrays["obs_std"] = np.sqrt(np.maximum(var, MIN_VARIANCE))
+
+    for head in ["pol", "vf"]:
+        for i, (kernel, bias) in enumerate(_mlp(variables, scope + "/" + head)):
+            arrays["%s_kernel_%i" % (head, i)] = kernel
+            arrays["%s_bias_%i" % (head, i)] = bias
+    arrays["logstd"] = variables[scope + "/pol/logstd"].reshape(-1)
+
+    # Statistics kept by the environment itself, if it normalizes
+    if os.path.exists(obs_stats_path(checkpoint_prefix)):
+        with np.load(obs_stats_path(checkpoint_prefix)) as data:
+            for key in data:
+                arrays["env_obs_stats_" + key] = data[key]
+
+    return arrays
+
+
+def export_policy(checkpoint_prefix, out_path, scope=POLICY_SCOPE):
+    """
+    Write the policy of the checkpoint at checkpoint_prefix to out_path
+    """
+    np.savez(out_path, **export_arrays(checkpoint_prefix, scope))
+
+
+class NumpyPolicy:
+    """
+    Gaussian MLP policy equivalent to a ppo1 MlpPolicy w/ tanh hidden
+    layers. act() has the same signature and return values as MlpPolicy's
+    """
+
+    def __init__(self, arrays, seed=None):
+
+        self.obs_mean = arrays["obs_mean"]
+        self.obs_std = arrays["obs_std"]
+        self.pol = self._layers(arrays, "pol")
+        self.vf = self._layers(arrays, "vf")
+        self.std = np.exp(arrays["logstd"])
+        self.random = np.random.RandomState(seed)
+
+        # To be loaded into the environment evaluated, if it normalizes
+        # observations itself
+        self.env_obs_stats = None
+        if "env_obs_stats_count" in arrays:
+            self.env_obs_stats = RunningMeanStd(arrays["env_obs_stats_mean"]
+                                                .shape)
+            self.env_obs_stats.load_state_dict(
+                {key: arrays["env_obs_stats_" + key]
+                 for key in ["count", "mean", "m2"]})
+
+    @staticmethod
+    def _layers(arrays, head):
+        layers = []
+        while "%s_kernel_%i" % (head, len(layers)) in arrays:
+            i = len(layers)
+            layers.append((arrays["%s_kernel_%i" % (head, i)],
+                           arrays["%s_bias_%i" % (head, i)]))
+        return layers
+
+    @classmethod
+    def load(cls, path, seed=None):
+        """
+        Load either an exported .npz or straight from a checkpoint prefix
+        """
+        if path.endswith(".npz"):
+            with np.load(path) as data:
+                return cls(dict(data), seed)
+        return cls(export_arrays(path), seed)
+
+    @staticmethod
+    def _forward(layers, x):
+        for kernel, bias in layers[:-1]:
+            x = np.tanh(x @ kernel + bias)
+        kernel, bias = layers[-1]
+        return x @ kernel + bias
+
+    def act_batch(self, stochastic, obs):
+        """
+        Actions and value predictions for a (batch, obs_dim) array
+        """
+        obz = np.clip((np.asarray(obs) - self.obs_mean) / self.obs_std,
+                      -CLIP_RANGE, CLIP_RANGE)
+        actions = self._forward(self.pol, obz)
+        if stochastic:
+            actions = actions + self.std * self.random.standard_normal(
+                actions.shape)
+        return actions, self._forward(self.vf, obz)[:, 0]
+
+    def act(self, stochastic, ob):
+        actions, vpreds = self.act_batch(stochastic, np.asarray(ob)[None])
+        return actions[0], vpreds[0]
+
+    def prepare_env(self, env):
+        """
+        Have env observe the way this policy was trained: normalized by the
+        frozen statistics it was exported w/, or not at all when it has
+        none, replacing whatever an earlier policy left in env. Raises when
+        env's observations aren't the size the policy takes, e.g. for
+        another history length
+        """
+        env = env.unwrapped
+        if env.observation_space.shape[0] != len(self.obs_mean):
+            raise RuntimeError("Policy takes observations of size %i, the "
+                               "env gives %i: was it trained w/ another "
+                               "history length?"
+                               % (len(self.obs_mean),
+                                  env.observation_space.shape[0]))
+        if self.env_obs_stats is None:
+            env.obs_stats = None
+        else:
+            env.obs_stats = self.env_obs_stats.copy()
+            env.obs_stats.frozen = True
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Export a checkpointed policy to a TF-free .npz")
+    parser.add_argument("--params-prefix", required=True, type=str,
+                        help="Prefix of the checkpoint to export")
+    parser.add_argument("--out-path", required=True, type=str)
+    args = parser.parse_args()
+
+    export_policy(args.params_prefix, args.out_path)
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+class ObservationHistory:
+    """
+    Keeps the last K (observation, action) pairs in a preallocated ring
+    buffer so that policies can be fed a stacked history without any
+    per-step allocation.
+
+    Every row is written twice, once at slot i and once at slot i + K. That
+    way the K most recent rows always form one contiguous slice of the buffer
+    and the stacked history can be handed out as a view.
+    """
+
+    def __init__(self, length, obs_dim, action_dim):
+
+        if length < 1:
+            raise RuntimeError("History length should be positive")
+
+        self.length = length
+        self.obs_dim = obs_dim
+        self.action_dim = action_dim
+        self.row_dim = obs_dim + action_dim
+        self.stacked_dim = length * self.row_dim
+
+        self._buffer = np.zeros((2 * length, self.row_dim))
+        self._head = 0
+
+    def stacked(self):
+        """
+        Return the last K rows (oldest first) flattened into a single vector.
+
+        The result is a VIEW into the ring buffer: it will change on the next
+        push, so copy it if you need to hold onto it
+        """
+        start = self._head + 1
+        return self._buffer[start:start + self.length].reshape(-1)
+
+    def reset(self, obs):
+        """
+        Fill the whole history with obs (and zero actions), which is what the
+        policy should see at the start of an episode
+        """
+        self._buffer[:, :self.obs_dim] = obs
+        self._buffer[:, self.obs_dim:] = 0
+        self._head = self.length - 1
+        return self.stacked()
+
+    def push(self, obs, action):
+        """
+        Record an observation along with the action which led to it, and
+        return the updated stacked history
+        """
+        self._head = (self._head + 1) % self.length
+
+        for row in (self._head, self._head + self.length):
+            self._buffer[row, :self.obs_dim] = obs
+            self._buffer[row, self.obs_dim:] = action
+
+        return self.stacked()
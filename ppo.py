@@ -0,0 +1,275 @@
+""" PPO over a batch of environments
+
+Same algorithm and losses as baselines' pposgd_simple, but experience comes
+from a vectorized environment (e.g. SharedMemoryVecEnv) through
+AsyncRollouts, so that workers aren't lock-stepped: every environment
+takes T steps per iteration, each batch of actions going to whichever
+workers are ready. The per-environment segments are scattered into
+preallocated (T, N) arrays, GAE is computed for all environments at once,
+and optimization runs on shuffled minibatches drawn by index from flat
+views of those arrays.
+"""
+
+from collections import deque
+import time
+import numpy as np
+import tensorflow as tf
+from baselines import logger
+from baselines.common import tf_util as U, zipsame
+from baselines.common.mpi_adam import MpiAdam
+
+from async_rollout import AsyncRollouts, batched_policy
+from telemetry import maybe_timed
+
+
+class RolloutBuffer:
+    """
+    T steps of experience from N environments. dones[t, i] is set when the
+    episode of environment i ended at step t, in which case obs[t + 1, i]
+    is the first observation of the next one
+    """
+
+    def __init__(self, horizon, num_envs, obs_dim, action_dim):
+        self.horizon = horizon
+        self.num_envs = num_envs
+        shape = (horizon, num_envs)
+
+        self.obs = np.zeros(shape + (obs_dim,), dtype=np.float32)
+        self.actions = np.zeros(shape + (action_dim,), dtype=np.float32)
+        self.rewards = np.zeros(shape)
+        self.dones = np.zeros(shape, dtype=bool)
+        self.vpreds = np.zeros(shape)
+        self.advantages = np.zeros(shape)
+        self.returns = np.zeros(shape)
+        # Value of the observation following the last step
+        self.last_vpreds = np.zeros(num_envs)
+
+    def __len__(self):
+        return self.horizon * self.num_envs
+
+    def flat(self, name):
+        """
+        (T * N, ...) view of one of the arrays, no copy involved
+        """
+        array = getattr(self, name)
+        return array.reshape((len(self),) + array.shape[2:])
+
+
+def compute_gae(rewards, vpreds, dones, last_vpreds, gamma, lam,
+                advantages=None):
+    """
+    Generalized advantage estimation on (T, N) arrays, looping over time
+    only. Returns the advantages and the value targets (advantages + vpreds)
+    """
+    if advantages is None:
+        advantages = np.empty_like(rewards)
+
+    next_vpreds = last_vpreds
+    lastgaelam = np.zeros_like(last_vpreds)
+    for t in reversed(range(len(rewards))):
+        nonterminal = 1. - dones[t]
+        delta = rewards[t] + gamma * next_vpreds * nonterminal - vpreds[t]
+        lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+        advantages[t] = lastgaelam
+        next_vpreds = vpreds[t]
+
+    return advantages, advantages + vpreds
+
+
+def minibatch_indices(num_samples, batch_size, rng):
+    """
+    Shuffled index arrays covering num_samples in batches of batch_size.
+    Like baselines' Dataset, the leftover partial batch is dropped
+    """
+    permutation = rng.permutation(num_samples)
+    for start in range(0, num_samples - batch_size + 1, batch_size):
+        yield permutation[start:start + batch_size]
+
+
+def learn(vec_env, policy_fn, *,
+          horizon,
+          clip_param, entcoeff,
+          optim_epochs, optim_stepsize, optim_batchsize,
+          gamma, lam,
+          max_timesteps=0, max_iters=0,
+          adam_epsilon=1e-5,
+          schedule='constant',
+          callback=None,
+          seed=None,
+          telemetry=None):
+    """
+    Arguments mean the same as for pposgd_simple.learn(), except that every
+    iteration collects horizon steps from each of vec_env's environments
+    instead of timesteps_per_actorbatch steps from a single one. callback is
+    called w/ (locals(), globals()) at the start of every iteration. Time
+    spent on each phase goes to telemetry (a Telemetry) if given
+    """
+    ob_space = vec_env.observation_space
+    ac_space = vec_env.action_space
+    num_envs = vec_env.num_envs
+    if horizon * num_envs < optim_batchsize:
+        raise RuntimeError("An iteration doesn't fill a single minibatch")
+
+    #######################################
+    # Losses, exactly as in pposgd_simple #
+    #######################################
+
+    pi = policy_fn("pi", ob_space, ac_space)
+    oldpi = policy_fn("oldpi", ob_space, ac_space)
+    atarg = tf.placeholder(dtype=tf.float32, shape=[None])
+    ret = tf.placeholder(dtype=tf.float32, shape=[None])
+    lrmult = tf.placeholder(name='lrmult', dtype=tf.float32, shape=[])
+    clip_param = clip_param * lrmult
+
+    ob = U.get_placeholder_cached(name="ob")
+    ac = pi.pdtype.sample_placeholder([None])
+
+    kloldnew = oldpi.pd.kl(pi.pd)
+    ent = pi.pd.entropy()
+    meankl = tf.reduce_mean(kloldnew)
+    meanent = tf.reduce_mean(ent)
+    pol_entpen = (-entcoeff) * meanent
+
+    ratio = tf.exp(pi.pd.logp(ac) - oldpi.pd.logp(ac))
+    surr1 = ratio * atarg
+    surr2 = tf.clip_by_value(ratio, 1.0 - clip_param,
+                             1.0 + clip_param) * atarg
+    pol_surr = - tf.reduce_mean(tf.minimum(surr1, surr2))
+    vf_loss = tf.reduce_mean(tf.square(pi.vpred - ret))
+    total_loss = pol_surr + pol_entpen + vf_loss
+    losses = [pol_surr, pol_entpen, vf_loss, meankl, meanent]
+    loss_names = ["pol_surr", "pol_entpen", "vf_loss", "kl", "ent"]
+
+    var_list = pi.get_trainable_variables()
+    lossandgrad = U.function([ob, ac, atarg, ret, lrmult],
+                             losses + [U.flatgrad(total_loss, var_list)])
+    adam = MpiAdam(var_list, epsilon=adam_epsilon)
+
+    assign_old_eq_new = U.function(
+        [], [], updates=[tf.assign(oldv, newv) for (oldv, newv)
+                         in zipsame(oldpi.get_variables(),
+                                    pi.get_variables())])
+
+    U.initialize()
+    adam.sync()
+
+    act = batched_policy(pi, stochastic=True)
+    rollouts = AsyncRollouts(vec_env, act)
+    rng = np.random.RandomState(seed)
+
+    buffer = RolloutBuffer(horizon, num_envs, ob_space.shape[0],
+                           ac_space.shape[0])
+
+    episodes_so_far = 0
+    timesteps_so_far = 0
+    iters_so_far = 0
+    tstart = time.time()
+    lenbuffer = deque(maxlen=100)
+    rewbuffer = deque(maxlen=100)
+    cur_ep_ret = np.zeros(num_envs)
+    cur_ep_len = np.zeros(num_envs, dtype=int)
+
+    assert sum([max_iters > 0, max_timesteps > 0]) == 1, \
+        "Only one time constraint permitted"
+
+    while True:
+        if callback:
+            callback(locals(), globals())
+        if max_timesteps and timesteps_so_far >= max_timesteps:
+            break
+        elif max_iters and iters_so_far >= max_iters:
+            break
+
+        if schedule == 'constant':
+            cur_lrmult = 1.0
+        elif schedule == 'linear':
+            cur_lrmult = max(1.0 - float(timesteps_so_far) / max_timesteps,
+                             0)
+        else:
+            raise NotImplementedError
+
+        logger.log("********** Iteration %i ************" % iters_so_far)
+
+        ######################
+        # Collect experience #
+        ######################
+
+        # Inference and simulation overlap, so rollouts times them itself:
+        # time spent waiting on workers counts as simulation
+        inference_time = rollouts.inference_time
+        wait_time = rollouts.wait_time
+        segments = rollouts.collect(steps_per_env=horizon)
+        for i, segment in enumerate(segments):
+            for name in ["obs", "actions", "vpreds", "rewards", "dones"]:
+                getattr(buffer, name)[:, i] = segment[name]
+        next_obs = np.array([segment["next_ob"] for segment in segments])
+        with maybe_timed(telemetry, "inference"):
+            _, buffer.last_vpreds[:] = act(next_obs)
+        if telemetry is not None:
+            telemetry.seconds["inference"] += \
+                rollouts.inference_time - inference_time
+            telemetry.seconds["simulation"] += rollouts.wait_time - wait_time
+            telemetry.resets += int(buffer.dones.sum())
+
+        for t in range(horizon):
+            dones = buffer.dones[t]
+            cur_ep_ret += buffer.rewards[t]
+            cur_ep_len += 1
+            rewbuffer.extend(cur_ep_ret[dones])
+            lenbuffer.extend(cur_ep_len[dones])
+            episodes_so_far += int(dones.sum())
+            cur_ep_ret[dones] = 0
+            cur_ep_len[dones] = 0
+
+        _, buffer.returns[:] = compute_gae(buffer.rewards, buffer.vpreds,
+                                           buffer.dones, buffer.last_vpreds,
+                                           gamma, lam, buffer.advantages)
+
+        ############
+        # Optimize #
+        ############
+
+        advantages = buffer.flat("advantages")
+        advantages -= advantages.mean()
+        advantages /= advantages.std()
+
+        flat_obs = buffer.flat("obs")
+        flat_actions = buffer.flat("actions")
+        flat_returns = buffer.flat("returns")
+
+        if hasattr(pi, "ob_rms"):
+            pi.ob_rms.update(flat_obs)
+        assign_old_eq_new()
+
+        logger.log("Optimizing...")
+        logger.log(("%13s" * len(loss_names)) % tuple(loss_names))
+        with maybe_timed(telemetry, "optimization"):
+            for _ in range(optim_epochs):
+                batch_losses = []
+                for batch in minibatch_indices(len(buffer), optim_batchsize,
+                                               rng):
+                    *newlosses, g = lossandgrad(flat_obs[batch],
+                                                flat_actions[batch],
+                                                advantages[batch],
+                                                flat_returns[batch],
+                                                cur_lrmult)
+                    adam.update(g, optim_stepsize * cur_lrmult)
+                    batch_losses.append(newlosses)
+                logger.log(("%13.6f" * len(loss_names))
+                           % tuple(np.mean(batch_losses, axis=0)))
+
+        for (lossval, name) in zipsame(np.mean(batch_losses, axis=0),
+                                       loss_names):
+            logger.record_tabular("loss_" + name, lossval)
+        logger.record_tabular("EpLenMean", np.mean(lenbuffer)
+                              if lenbuffer else np.nan)
+        logger.record_tabular("EpRewMean", np.mean(rewbuffer)
+                              if rewbuffer else np.nan)
+        logger.record_tabular("EpisodesSoFar", episodes_so_far)
+        timesteps_so_far += len(buffer)
+        iters_so_far += 1
+        logger.record_tabular("TimestepsSoFar", timesteps_so_far)
+        logger.record_tabular("TimeElapsed", time.time() - tstart)
+        logger.dump_tabular()
+
+    return pi
@@ -0,0 +1,80 @@
+""" Independent random streams for parallel workers from one root seed
+
+Seeding workers w/ seed + i (or a fixed seed) leaves their streams
+correlated at best and identical at worst, e.g. every forked worker
+replaying its template's. Instead, every stream a run draws from is
+derived from a single root seed through numpy's SeedSequence, keyed by
+
+    (rank, env_index, stream)
+
+so that streams of different MPI ranks, environments and purposes never
+overlap, and the whole run is reproduced from the root seed recorded in
+its metadata. The streams of an environment are
+
+- frames: reference frames to start episodes from (env.random)
+- reset_noise: the noise added to the start state (gym's env.np_random)
+- process: the random and np.random modules of the process it runs in
+
+and a rank's policy samples actions from its policy stream, and its
+learner shuffles minibatches w/ its learner stream, both w/ env_index 0.
+The learner can't take the rank's process stream, which belongs to the
+environment number 0 of vectorized workers.
+"""
+
+import json
+import random
+import numpy as np
+
+# Append only, a stream's index is part of its key
+STREAMS = ["frames", "reset_noise", "process", "policy", "learner"]
+
+RUN_METADATA_SUFFIX = "run.json"
+
+
+def new_root_seed():
+    """
+    Fresh entropy from the OS, for when no seed is given. Record it
+    """
+    return int(np.random.SeedSequence().entropy)
+
+
+def stream_seed(root_seed, stream, rank=0, env_index=0):
+    """
+    32 bit seed of one stream, fit for random.Random, RandomState, gym's
+    env.seed() and tf.set_random_seed alike
+    """
+    sequence = np.random.SeedSequence(
+        root_seed, spawn_key=(rank, env_index, STREAMS.index(stream)))
+    return int(sequence.generate_state(1)[0])
+
+
+def seed_env(env, root_seed, rank=0, env_index=0):
+    """
+    Seed the frame sampling and reset noise streams of env (unwrapped or
+    not)
+    """
+    env = env.unwrapped
+    env.seed(stream_seed(root_seed, "reset_noise", rank, env_index))
+    if hasattr(env, "random"):
+        env.random.seed(stream_seed(root_seed, "frames", rank, env_index))
+
+
+def seed_process(root_seed, rank=0, env_index=0):
+    """
+    Seed the random and np.random modules of the worker process running
+    env_index
+    """
+    seed = stream_seed(root_seed, "process", rank, env_index)
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def write_run_metadata(path, root_seed, **info):
+    """
+    Record the root seed (and the layout it's split over, in info) so that
+    the run can be reproduced
+    """
+    metadata = dict(info, root_seed=root_seed, streams=STREAMS,
+                    stream_key=["rank", "env_index", "stream"])
+    with open(path, "w") as metadata_file:
+        json.dump(metadata, metadata_file, indent=2)
@@ -0,0 +1,116 @@
+""" Reference state initialization weighted by difficulty
+
+Uniformly random start frames spend most episodes on the parts of a clip
+the policy already tracks. AdaptiveStartSampler splits the clip into
+buckets of frames, keeps a running failure rate (episodes ending through
+early termination) for each, and starts episodes in a bucket proportionally
+to its failure rate. Sampling goes through an alias table, so it's O(1)
+however many buckets there are, and the table only gets rebuilt every so
+many episodes.
+"""
+
+import numpy as np
+
+
+class AliasTable:
+    """
+    Vose's alias method: after O(n) setup, draws index i w/ probability
+    weights[i] / sum(weights) using one uniform index and one coin flip
+    """
+
+    def __init__(self, weights):
+
+        weights = np.asarray(weights, dtype=float)
+        n = len(weights)
+        if n == 0 or weights.min() < 0 or weights.sum() <= 0:
+            raise RuntimeError("Weights should be nonnegative, not all zero")
+
+        scaled = weights * (n / weights.sum())
+        self.prob = np.ones(n)
+        self.alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1]
+        large = [i for i in range(n) if scaled[i] >= 1]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1 - scaled[s]
+            (small if scaled[l] < 1 else large).append(l)
+        # Whatever's left is 1 up to rounding errors
+        for i in small + large:
+            self.prob[i] = 1.
+
+    def __len__(self):
+        return len(self.prob)
+
+    def sample(self, rng):
+        """
+        rng is a random.Random (e.g. an env's self.random)
+        """
+        i = rng.randrange(len(self.prob))
+        return i if rng.random() < self.prob[i] else int(self.alias[i])
+
+    def probabilities(self):
+        """
+        Probability of drawing each index, mostly for checking
+        """
+        p = self.prob / len(self)
+        np.add.at(p, self.alias, (1 - self.prob) / len(self))
+        return p
+
+
+class AdaptiveStartSampler:
+    """
+    Picks start frames out of range(num_frames).
+
+    failure_rates holds an exponential moving average (w/ factor
+    smoothing) of whether episodes started in each bucket terminated early.
+    A uniform_mix share of the probability stays spread evenly so that no
+    bucket ever stops being visited
+    """
+
+    def __init__(self, num_frames, num_buckets=20, rebuild_interval=50,
+                 smoothing=0.05, uniform_mix=0.2):
+
+        self.num_frames = num_frames
+        self.num_buckets = min(num_buckets, num_frames)
+        self.rebuild_interval = rebuild_interval
+        self.smoothing = smoothing
+        self.uniform_mix = uniform_mix
+
+        # First frame of each bucket, plus the end
+        self.edges = np.linspace(0, num_frames,
+                                 self.num_buckets + 1).astype(int)
+        self.failure_rates = np.zeros(self.num_buckets)
+        self.episodes = np.zeros(self.num_buckets, dtype=int)
+        self.num_recorded = 0
+        self.table = AliasTable(self.weights())
+
+    def bucket(self, framenum):
+        return int(np.searchsorted(self.edges, framenum, side="right")) - 1
+
+    def weights(self):
+        total = self.failure_rates.sum()
+        uniform = np.full(self.num_buckets, 1. / self.num_buckets)
+        if total <= 0:
+            return uniform
+        return self.uniform_mix * uniform \
+            + (1 - self.uniform_mix) * self.failure_rates / total
+
+    def sample(self, rng):
+        bucket = self.table.sample(rng)
+        return rng.randrange(self.edges[bucket], self.edges[bucket + 1])
+
+    def record(self, start_framenum, failed):
+        """
+        Report how an episode started at start_framenum went
+        """
+        bucket = self.bucket(start_framenum)
+        self.failure_rates[bucket] += self.smoothing \
+            * (float(failed) - self.failure_rates[bucket])
+        self.episodes[bucket] += 1
+
+        self.num_recorded += 1
+        if self.num_recorded % self.rebuild_interval == 0:
+            self.table = AliasTable(self.weights())
@@ -0,0 +1,132 @@
+import numpy as np
+
+# Same floor on the variance and clipping range as baselines' MlpPolicy, so
+# that switching normalization over from the policy doesn't change what it
+# gets fed
+MIN_VARIANCE = 1e-2
+CLIP_RANGE = 5.0
+
+
+class RunningMeanStd:
+    """
+    Running mean and variance of a stream of vectors, updated with Welford's
+    algorithm so that it's numerically stable over hundreds of millions of
+    samples.
+
+    Statistics gathered separately (e.g. by different worker processes) can
+    be combined with merge(), which gives exactly the same result as if all
+    the samples had been seen by a single instance
+    """
+
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        # Sum of squared differences from the mean
+        self.m2 = np.zeros(shape)
+        # Set to False to stop update() from changing the statistics, e.g.
+        # during evaluation
+        self.frozen = False
+
+    @property
+    def var(self):
+        if self.count == 0:
+            return np.ones_like(self.m2)
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        return np.sqrt(np.maximum(self.var, MIN_VARIANCE))
+
+    def update(self, x):
+        """
+        Add a single sample to the statistics
+        """
+        if self.frozen:
+            return
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def update_batch(self, xs):
+        """
+        Add a (num samples, *shape) array of samples to the statistics
+        """
+        if self.frozen or len(xs) == 0:
+            return
+        xs = np.asarray(xs)
+        self._combine(len(xs), xs.mean(axis=0),
+                      np.sum(np.square(xs - xs.mean(axis=0)), axis=0))
+
+    def merge(self, other):
+        """
+        Fold the statistics of another RunningMeanStd into this one
+        """
+        if other.count > 0:
+            self._combine(other.count, other.mean, other.m2)
+
+    def since(self, base):
+        """
+        Statistics of only the samples added after this instance was in the
+        state base (a copy of an earlier state of it). Inverse of merge()
+        """
+        diff = RunningMeanStd(self.mean.shape)
+        count = self.count - base.count
+        if count > 0:
+            diff.count = count
+            diff.mean = (self.count * self.mean - base.count * base.mean) \
+                / count
+            delta = diff.mean - base.mean
+            diff.m2 = self.m2 - base.m2 \
+                - np.square(delta) * (base.count * count / self.count)
+        return diff
+
+    def copy(self):
+        other = RunningMeanStd(self.mean.shape)
+        other.load_state_dict(self.state_dict())
+        other.frozen = self.frozen
+        return other
+
+    def _combine(self, count, mean, m2):
+        # Chan et al.'s parallel variant of Welford's update
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean = self.mean + delta * (count / total)
+        self.m2 = self.m2 + m2 + np.square(delta) * (self.count * count / total)
+        self.count = total
+
+    def normalize(self, x, out=None):
+        """
+        Return (x - mean) / std clipped to +-CLIP_RANGE. Pass out=x to
+        normalize x in place
+        """
+        out = np.subtract(x, self.mean, out=out)
+        out /= self.std
+        return np.clip(out, -CLIP_RANGE, CLIP_RANGE, out=out)
+
+    ###############
+    # Persistence #
+    ###############
+
+    def state_dict(self):
+        return {"count": np.array(self.count), "mean": self.mean,
+                "m2": self.m2}
+
+    def load_state_dict(self, state):
+        self.count = int(state["count"])
+        self.mean = np.array(state["mean"], dtype=float)
+        self.m2 = np.array(state["m2"], dtype=float)
+
+    def save(self, path):
+        np.savez(path, **self.state_dict())
+
+    def load(self, path):
+        with np.load(path) as data:
+            self.load_state_dict(data)
+
+
+def obs_stats_path(checkpoint_prefix):
+    """
+    Where the observation statistics belonging to a checkpoint are kept
+    """
+    return checkpoint_prefix + ".obs_stats.npz"
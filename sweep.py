@@ -0,0 +1,450 @@
+""" Local hyperparameter sweeps over train_dartdeepmimic.py
+
+A sweep is described by a JSON spec: arguments shared by every run, a grid
+of values to take the product of and/or parameters to sample at random,
+e.g.
+
+    {"args": {"--control-skel-path": "assets/skel/kima_original.skel",
+              "--ref-motion-path": "assets/mocap/walk/positions.txt",
+              "--ref-motion-vel-path": "assets/mocap/walk/velocities.txt",
+              "--state-mode": 1, "--action-mode": 2,
+              "--train-num-timesteps": 20000000},
+     "grid": {"--pos-weight": [0.5, 0.65], "--num-envs": [1, 4]},
+     "random": {"samples": 8, "seed": 0,
+                "params": {"--ee-inner-weight": ["uniform", -60, -20],
+                           "--p-gain": ["log_uniform", 100, 1000],
+                           "--delta": ["choice", true, false]}}}
+
+Random samples are crossed w/ the grid. A value of true passes a flag
+alone, false leaves it out, or passes the --no- form of the flags which
+default to on (--delta, --gravity and --self-collide).
+
+    python sweep.py --spec spec.json --dir sweeps/rewards
+
+runs the jobs on the cores available (or --cpus), as many at once as fit:
+a job takes --num-envs + 1 cores when it has vectorized workers, one
+otherwise, or "cpus_per_job" from the spec, and is pinned to them. Every
+attempt at a job writes its checkpoints, telemetry and log under a
+directory of its own, e.g. 003/attempt_2/. The queue lives in queue.json in
+the sweep's directory and is rewritten on every change, so running the
+same command again (the spec can then be left out) resumes an interrupted
+sweep: jobs that were running start a new attempt from the latest
+checkpoint of the previous ones, w/ --train-num-timesteps (if given) cut
+down by the timesteps that checkpoint was trained on. The learning rate schedule starts over on the
+remaining budget. Once everything has run, the final metrics of every job
+(over all its attempts) are printed as a table and written to results.csv.
+"""
+
+import argparse
+import itertools
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+
+from cpu_placement import available_cpus
+from eval_harness import format_table, write_csv
+
+# Same as checkpoints.INDEX_SUFFIX, which can't be imported w/o TF
+INDEX_SUFFIX = "checkpoints.json"
+
+QUEUE_NAME = "queue.json"
+# Passed as --output-params-prefix under each attempt's directory. Attempts
+# don't share a prefix, so that a new one neither overwrites nor prunes the
+# checkpoints of the one it resumes from
+OUTPUT_PREFIX = "params_"
+ATTEMPT_PATTERN = re.compile(r"attempt_(\d+)$")
+DEFAULT_SCRIPT = os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                              "train_dartdeepmimic.py")
+
+# Paired w/ a --no- form in ddm_argparse.py, and on by default
+NEGATABLE_FLAGS = ["--delta", "--gravity", "--self-collide"]
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+# Same as log_grapher.py, on baselines' iteration summaries in the log
+ITERATION_PATTERN = re.compile(
+    r"EpLenMean\s+\|\s+([0-9e\+\-\.]+).*?EpRewMean\s+\|\s+([0-9e\+\-\.]+)"
+    r".*?TimestepsSoFar\s+\|\s+([0-9e\+\.]+)", re.S)
+
+
+def sample_value(distribution, rng):
+    """
+    distribution is [kind, *parameters] w/ kind one of uniform,
+    log_uniform, int_uniform or choice
+    """
+    kind, parameters = distribution[0], distribution[1:]
+    if kind == "uniform":
+        return rng.uniform(*parameters)
+    elif kind == "log_uniform":
+        low, high = parameters
+        return math.exp(rng.uniform(math.log(low), math.log(high)))
+    elif kind == "int_uniform":
+        return rng.randint(*parameters)
+    elif kind == "choice":
+        return rng.choice(parameters)
+    else:
+        raise ValueError("Unknown distribution " + str(kind))
+
+
+def expand_spec(spec):
+    """
+    Parameters of every job of spec, in order
+    """
+    grid = spec.get("grid", {})
+    names = sorted(grid)
+    points = [dict(zip(names, values))
+              for values in itertools.product(*[grid[n] for n in names])]
+
+    if "random" in spec:
+        rng = random.Random(spec["random"].get("seed", 0))
+        distributions = spec["random"]["params"]
+        samples = [{name: sample_value(distributions[name], rng)
+                    for name in sorted(distributions)}
+                   for _ in range(spec["random"]["samples"])]
+        points = [dict(point, **sample) for sample in samples
+                  for point in points]
+
+    return points
+
+
+def job_args(args):
+    """
+    Command line arguments out of {flag: value}
+    """
+    argv = []
+    for flag, value in args.items():
+        if value is True:
+            argv.append(flag)
+        elif value is False and flag in NEGATABLE_FLAGS:
+            argv.append("--no-" + flag[2:])
+        elif value is False or value is None:
+            continue
+        elif isinstance(value, list):
+            argv += [flag] + [str(v) for v in value]
+        else:
+            argv += [flag, str(value)]
+    return argv
+
+
+def job_cpus(spec, args):
+    if "cpus_per_job" in spec:
+        return spec["cpus_per_job"]
+    num_envs = int(args.get("--num-envs", 1))
+    return num_envs + 1 if num_envs > 1 else 1
+
+
+def read_json_lines(path):
+    if not os.path.exists(path):
+        return []
+    with open(path) as json_file:
+        return [json.loads(line) for line in json_file if line.strip()]
+
+
+def attempt_directories(directory):
+    """
+    Directories of the attempts at the job run in directory, in order
+    """
+    if not os.path.isdir(directory):
+        return []
+    attempts = []
+    for name in os.listdir(directory):
+        match = ATTEMPT_PATTERN.match(name)
+        if match:
+            attempts.append((int(match.group(1)), name))
+    return [os.path.join(directory, name) for _, name in sorted(attempts)]
+
+
+def attempt_directory(directory, attempt):
+    return os.path.join(directory, "attempt_%i" % attempt)
+
+
+def job_metrics(directory):
+    """
+    Final metrics of the job run in directory, None where missing. Every
+    attempt counts its timesteps from 0, so they're added up
+    """
+    metrics = {"timesteps": None, "final_ep_rew_mean": None,
+               "max_ep_rew_mean": None, "final_ep_len_mean": None,
+               "best_checkpoint_score": None, "steps_per_second": None}
+
+    iterations = []
+    scores = []
+    speeds = []
+    timesteps = 0
+    for attempt in attempt_directories(directory):
+        log_path = os.path.join(attempt, "train.log")
+        if os.path.exists(log_path):
+            with open(log_path, errors="replace") as log_file:
+                attempt_iterations = [
+                    tuple(map(float, match)) for match
+                    in ITERATION_PATTERN.findall(log_file.read())]
+            if attempt_iterations:
+                timesteps += int(attempt_iterations[-1][2])
+                iterations += attempt_iterations
+
+        index_path = os.path.join(attempt, OUTPUT_PREFIX + INDEX_SUFFIX)
+        if os.path.exists(index_path):
+            with open(index_path) as index_file:
+                scores += [entry["score"] for entry
+                           in json.load(index_file)["checkpoints"]
+                           if entry["score"] is not None]
+
+        telemetry_path = os.path.join(attempt,
+                                      OUTPUT_PREFIX + "telemetry.jsonl")
+        speeds += [record["steps_per_second"] for record
+                   in read_json_lines(telemetry_path)
+                   if record["steps_per_second"] is not None]
+
+    if iterations:
+        lengths, rewards, _ = zip(*iterations)
+        metrics["final_ep_len_mean"] = lengths[-1]
+        metrics["final_ep_rew_mean"] = rewards[-1]
+        metrics["max_ep_rew_mean"] = max(rewards)
+        metrics["timesteps"] = timesteps
+    if scores:
+        metrics["best_checkpoint_score"] = max(scores)
+    if speeds:
+        metrics["steps_per_second"] = sum(speeds) / len(speeds)
+
+    return metrics
+
+
+def latest_checkpoint(directory):
+    """
+    (attempt number, index entry) of the latest checkpoint of the last
+    attempt at the job run in directory which wrote one, or None
+    """
+    for attempt in reversed(attempt_directories(directory)):
+        index_path = os.path.join(attempt, OUTPUT_PREFIX + INDEX_SUFFIX)
+        if not os.path.exists(index_path):
+            continue
+        with open(index_path) as index_file:
+            index = json.load(index_file)
+        for entry in index["checkpoints"]:
+            if entry["prefix"] == index["latest"]:
+                number = ATTEMPT_PATTERN.match(os.path.basename(attempt))
+                return int(number.group(1)), entry
+    return None
+
+
+class Sweep:
+    """
+    The queue of a sweep, kept in directory. spec is only needed the first
+    time, later on the queue is loaded back
+    """
+
+    def __init__(self, directory, spec=None, cpus=None):
+
+        self.directory = directory
+        self.queue_path = os.path.join(directory, QUEUE_NAME)
+        self.cpus = available_cpus() if cpus is None else sorted(cpus)
+        self._processes = {}
+
+        if os.path.exists(self.queue_path):
+            with open(self.queue_path) as queue_file:
+                state = json.load(queue_file)
+            self.spec, self.jobs = state["spec"], state["jobs"]
+            # Whatever was running when we stopped has to start again
+            for job in self.jobs:
+                if job["status"] == RUNNING:
+                    job["status"] = PENDING
+        elif spec is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.spec = spec
+            self.jobs = [{"id": "%03d" % i, "params": params,
+                          "cpus": job_cpus(spec, dict(spec.get("args", {}),
+                                                      **params)),
+                          "status": PENDING, "attempts": 0}
+                         for i, params in enumerate(expand_spec(spec))]
+        else:
+            raise RuntimeError("No sweep in " + directory
+                               + ", a spec is needed to start one")
+
+        for job in self.jobs:
+            if job["cpus"] > len(self.cpus):
+                raise RuntimeError("Job %s needs %i cores, only %i available"
+                                   % (job["id"], job["cpus"], len(self.cpus)))
+        self.save()
+
+    def save(self):
+        # Write then rename, so that an interruption never corrupts it
+        tmp_path = self.queue_path + ".tmp"
+        with open(tmp_path, "w") as queue_file:
+            json.dump({"spec": self.spec, "jobs": self.jobs}, queue_file,
+                      indent=2)
+        os.replace(tmp_path, self.queue_path)
+
+    def job_directory(self, job):
+        return os.path.join(self.directory, job["id"])
+
+    def resume_point(self, job):
+        """
+        (checkpoint prefix, timesteps it was trained on) for the next
+        attempt at job to start from, or (None, 0) to start from scratch.
+        Every attempt counts its timesteps from 0, so the offset it started
+        at (recorded in the queue by _launch) is added
+        """
+        latest = latest_checkpoint(self.job_directory(job))
+        if latest is None:
+            return None, 0
+        attempt, entry = latest
+        offset = job.get("start_timesteps", {}).get(str(attempt), 0)
+        return entry["prefix"], offset + (entry.get("timesteps") or 0)
+
+    def command(self, job, attempt=None):
+        """
+        Command line of attempt number attempt at job, by default the next
+        """
+        directory = self.job_directory(job)
+        attempt = job["attempts"] + 1 if attempt is None else attempt
+        args = dict(self.spec.get("args", {}), **job["params"])
+        # Resuming, w/ what's left of the budget after the checkpoint
+        checkpoint, done = self.resume_point(job)
+        if done and "--train-num-timesteps" in args:
+            args["--train-num-timesteps"] = max(
+                int(float(args["--train-num-timesteps"])) - done, 1)
+        argv = [sys.executable, self.spec.get("script", DEFAULT_SCRIPT)]
+        argv += job_args(args)
+        argv += ["--output-params-prefix",
+                 os.path.join(attempt_directory(directory, attempt),
+                              OUTPUT_PREFIX)]
+        if checkpoint is not None:
+            argv += ["--initial-params-path", checkpoint]
+        return argv
+
+    def free_cpus(self):
+        used = {cpu for job in self.jobs if job["status"] == RUNNING
+                for cpu in job["cores"]}
+        return [cpu for cpu in self.cpus if cpu not in used]
+
+    def _launch(self, job, cores):
+
+        attempt = job["attempts"] + 1
+        directory = attempt_directory(self.job_directory(job), attempt)
+        os.makedirs(directory, exist_ok=True)
+
+        def pin():
+            if hasattr(os, "sched_setaffinity"):
+                os.sched_setaffinity(0, cores)
+
+        with open(os.path.join(directory, "train.log"), "a") as log_file:
+            process = subprocess.Popen(self.command(job, attempt),
+                                       stdout=log_file,
+                                       stderr=subprocess.STDOUT,
+                                       preexec_fn=pin)
+        self._processes[job["id"]] = process
+        job.setdefault("start_timesteps", {})[str(attempt)] = \
+            self.resume_point(job)[1]
+        job.update(status=RUNNING, cores=cores, started=time.time(),
+                   attempts=attempt)
+        print("Started job %s on cores %s" % (job["id"], cores))
+
+    def _finish(self, job, returncode):
+        del self._processes[job["id"]]
+        job.update(status=DONE if returncode == 0 else FAILED,
+                   returncode=returncode,
+                   wall_seconds=time.time() - job["started"],
+                   metrics=job_metrics(self.job_directory(job)))
+        print("Job %s %s" % (job["id"], job["status"]))
+
+    def step(self):
+        """
+        Collect finished jobs and start as many pending ones as fit, in
+        order but letting smaller jobs fill in behind a larger one.
+        Returns whether anything is left to run
+        """
+        changed = False
+        for job in self.jobs:
+            if job["status"] == RUNNING:
+                returncode = self._processes[job["id"]].poll()
+                if returncode is not None:
+                    self._finish(job, returncode)
+                    changed = True
+
+        free = self.free_cpus()
+        for job in self.jobs:
+            if job["status"] == PENDING and job["cpus"] <= len(free):
+                self._launch(job, free[:job["cpus"]])
+                free = free[job["cpus"]:]
+                changed = True
+
+        if changed:
+            self.save()
+        return any(job["status"] in [PENDING, RUNNING] for job in self.jobs)
+
+    def run(self, poll_interval=10.):
+        try:
+            while self.step():
+                time.sleep(poll_interval)
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Terminate running jobs, leaving them pending for the next run
+        """
+        for job in self.jobs:
+            if job["status"] == RUNNING:
+                process = self._processes.pop(job["id"])
+                process.terminate()
+                process.wait()
+                job["status"] = PENDING
+        self.save()
+
+    def retry_failed(self):
+        for job in self.jobs:
+            if job["status"] == FAILED:
+                job["status"] = PENDING
+        self.save()
+
+    def results(self):
+        """
+        One row per job: its parameters then its final metrics
+        """
+        names = sorted({name for job in self.jobs for name in job["params"]})
+        rows = []
+        for job in self.jobs:
+            row = {"id": job["id"], "status": job["status"]}
+            for name in names:
+                row[name.lstrip("-")] = job["params"].get(name)
+            metrics = job.get("metrics") \
+                or job_metrics(self.job_directory(job))
+            row.update(metrics)
+            row["wall_seconds"] = job.get("wall_seconds")
+            rows.append(row)
+        return rows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Run a hyperparameter sweep on the local cores")
+    parser.add_argument("--dir", required=True,
+                        help="Where the queue and the jobs' outputs go")
+    parser.add_argument("--spec", type=str, default=None,
+                        help="JSON sweep spec, only needed to start a sweep")
+    parser.add_argument("--cpus", type=int, nargs="+", default=None,
+                        help="Cores to run jobs on, defaults to all")
+    parser.add_argument("--poll-interval", type=float, default=10.)
+    parser.add_argument("--retry-failed", action="store_true",
+                        help="Run failed jobs again")
+    args = parser.parse_args()
+
+    spec = None
+    if args.spec is not None:
+        with open(args.spec) as spec_file:
+            spec = json.load(spec_file)
+
+    sweep = Sweep(args.dir, spec, args.cpus)
+    if args.retry_failed:
+        sweep.retry_failed()
+    sweep.run(args.poll_interval)
+
+    results = sweep.results()
+    print(format_table(results))
+    write_csv(results, os.path.join(args.dir, "results.csv"))
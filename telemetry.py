@@ -0,0 +1,157 @@
+""" Per-iteration training metrics as JSON lines
+
+Every line covers one training iteration (from one learn() callback to the
+next): environment steps per second, the wall time split across
+simulation, policy inference, optimization and checkpointing, the number
+of episode resets, the peak resident memory of the trainer and of each of
+its environment workers, and how often each termination rule fired during
+the iteration.
+"""
+
+from contextlib import contextmanager
+import json
+import resource
+import time
+import gym
+
+PHASES = ["simulation", "inference", "optimization", "checkpoint"]
+
+
+@contextmanager
+def maybe_timed(telemetry, phase):
+    """
+    telemetry.timed(phase), or nothing at all when telemetry is None
+    """
+    if telemetry is None:
+        yield
+    else:
+        with telemetry.timed(phase):
+            yield
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process, in MB. ru_maxrss is in KB on
+    Linux. Environment workers report their own: RUSAGE_CHILDREN only
+    covers children which were waited for, and forked workers are neither
+    """
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+class Telemetry:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a")
+        self._timesteps = 0
+        self._start_iteration()
+
+    def _start_iteration(self):
+        self.seconds = dict.fromkeys(PHASES, 0.)
+        self.resets = 0
+        self._iteration_start = time.time()
+
+    @contextmanager
+    def timed(self, phase):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[phase] += time.time() - start
+
+    def wrap(self, phase, fn):
+        """
+        fn, w/ the time spent in it counted towards phase
+        """
+        def timed_fn(*args, **kwargs):
+            with self.timed(phase):
+                return fn(*args, **kwargs)
+        return timed_fn
+
+    def end_iteration(self, iteration, timesteps_so_far, termination=None,
+                      workers=None):
+        """
+        Write out the record of the iteration which just finished and start
+        timing the next one. termination is an env's TerminationRules, whose
+        counts are reset so that every record only covers its iteration.
+        workers is what SharedMemoryVecEnv.collect_usage() returned, for
+        envs running in workers of their own
+        """
+        now = time.time()
+        wall = now - self._iteration_start
+        steps = timesteps_so_far - self._timesteps
+        self._timesteps = timesteps_so_far
+
+        seconds = dict(self.seconds)
+        # pposgd_simple can't be timed from the outside, so whatever isn't
+        # accounted for (GAE and logging included) counts as optimization
+        if seconds["optimization"] == 0:
+            seconds["optimization"] = max(wall - sum(seconds.values()), 0.)
+
+        record = {"iteration": iteration, "time": now,
+                  "timesteps_so_far": timesteps_so_far,
+                  "steps": steps,
+                  "steps_per_second": steps / wall if wall > 0 else None,
+                  "wall_seconds": wall,
+                  "resets": self.resets,
+                  "peak_rss_mb": peak_rss_mb()}
+        for phase in PHASES:
+            record[phase + "_seconds"] = seconds[phase]
+        if termination is not None:
+            record["termination_checks"] = termination.num_checks
+            record["terminations"] = termination.summary()
+            termination.reset_counts()
+        if workers is not None:
+            record["peak_rss_workers_mb"] = [usage["peak_rss_mb"]
+                                             for usage in workers]
+            # Summed over the workers whose envs have termination rules
+            for usage in workers:
+                if usage["terminations"] is None:
+                    continue
+                record["termination_checks"] = \
+                    record.get("termination_checks", 0) \
+                    + usage["termination_checks"]
+                terminations = record.setdefault("terminations", {})
+                for name, count in usage["terminations"].items():
+                    terminations[name] = terminations.get(name, 0) + count
+
+        self._file.write(json.dumps(record) + "\n")
+        self._file.flush()
+        self._start_iteration()
+
+    def on_callback(self, local_vars, termination=None, workers=None):
+        """
+        Call first thing in a pposgd_simple / ppo learn() callback
+        """
+        if local_vars["iters_so_far"] == 0:
+            # Setting up the graph isn't part of any iteration
+            self._start_iteration()
+            if termination is not None:
+                termination.reset_counts()
+        else:
+            self.end_iteration(local_vars["iters_so_far"] - 1,
+                               local_vars["timesteps_so_far"], termination,
+                               workers)
+
+    def close(self):
+        self._file.close()
+
+
+class TimedEnv(gym.Wrapper):
+    """
+    Counts the time spent stepping and resetting an env as simulation, and
+    the number of resets
+    """
+
+    def __init__(self, env, telemetry):
+        super().__init__(env)
+        self.telemetry = telemetry
+
+    def step(self, action):
+        with self.telemetry.timed("simulation"):
+            return self.env.step(action)
+
+    def reset(self, **kwargs):
+        self.telemetry.resets += 1
+        with self.telemetry.timed("simulation"):
+            return self.env.reset(**kwargs)
@@ -0,0 +1,90 @@
+from collections import namedtuple
+import numpy as np
+
+# name: shows up in the counters
+# quantity: "state" for entries of the [q, dq] state vector, "root_height"
+#           for the height of the root body's COM
+# indices: index or slice into the state, ignored for root_height
+# low, high: the episode goes on while low < value < high (strictly) for
+#            every value the rule covers. NaNs always violate a rule
+TerminationRule = namedtuple("TerminationRule",
+                             ["name", "quantity", "indices", "low", "high"])
+
+KIMA_TERMINATION_RULES = [
+    TerminationRule("nonfinite_state", "state", slice(None),
+                    -np.inf, np.inf),
+    TerminationRule("state_magnitude", "state", slice(2, None), -200, 200),
+    TerminationRule("root_height", "root_height", None, -0.70, 0.40),
+    TerminationRule("q3", "state", 3, -0.4, 0.3),
+    TerminationRule("q4", "state", 4, -0.30, 0.30),
+    TerminationRule("q5", "state", 5, -0.50, 0.50),
+]
+
+
+class TerminationRules:
+    """
+    Evaluates a list of TerminationRules against one read of the state as a
+    single vectorized comparison, and counts how often every rule fires so
+    that it's possible to tell which checks end episodes
+    """
+
+    def __init__(self, rules, state_dim):
+
+        self.rules = rules
+        self.state_dim = state_dim
+
+        # Values get gathered out of [state..., root height]
+        height_index = state_dim
+        indices, rule_ids = [], []
+        for rule_id, rule in enumerate(rules):
+            if rule.quantity == "state":
+                covered = np.arange(state_dim)[rule.indices].reshape(-1)
+            elif rule.quantity == "root_height":
+                covered = [height_index]
+            else:
+                raise RuntimeError("Unrecognized quantity "
+                                   + str(rule.quantity))
+            indices.extend(covered)
+            rule_ids.extend([rule_id] * len(covered))
+
+        self._indices = np.array(indices)
+        self._rule_ids = np.array(rule_ids)
+        self._lows = np.array([rules[i].low for i in rule_ids], dtype=float)
+        self._highs = np.array([rules[i].high for i in rule_ids], dtype=float)
+        self._values = np.empty(state_dim + 1)
+
+        self.reset_counts()
+
+    def reset_counts(self):
+        self.num_checks = 0
+        self.counts = np.zeros(len(self.rules), dtype=int)
+
+    def violations(self, state, root_height):
+        """
+        Boolean array w/ an entry per rule, true for the rules broken
+        """
+        self._values[:-1] = state
+        self._values[-1] = root_height
+        values = self._values[self._indices]
+
+        with np.errstate(invalid="ignore"):
+            ok = (values > self._lows) & (values < self._highs)
+
+        return np.bincount(self._rule_ids, weights=~ok,
+                           minlength=len(self.rules)) > 0
+
+    def should_terminate(self, state, root_height):
+        """
+        Whether any rule is broken, updating the counters along the way
+        """
+        fired = self.violations(state, root_height)
+        self.num_checks += 1
+        self.counts += fired
+        return bool(fired.any())
+
+    def summary(self):
+        """
+        {rule name: number of checks in which it fired}
+        """
+        return {rule.name: int(count)
+                for rule, count in zip(self.rules, self.counts)}
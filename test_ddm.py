@@ -1,12 +1,41 @@
 import pytest
 import numpy as np
 import random
-from visak_dartdeepmimic import VisakDartDeepMimicEnv
+from visak_dartdeepmimic import VisakDartDeepMimicEnv, make_walk_env
 from env_jesus import DartHumanoid3D_cartesian
+from batched_dartdeepmimic import BatchedVisakDartDeepMimicEnv
 from baselines.ppo1 import mlp_policy
 import itertools
 from baselines.common import set_global_seeds, tf_util as U
+from obs_history import ObservationHistory
+from batch_rotations import quats2euler, euler2quats, quats_inverse, \
+    relative_angles, angle_axes2euler
+from euclideanSpace import mat2euler, euler2quat, angle_axis2euler
+from quaternions import quat2mat, mult, inverse
+from kinematics import KIMA_END_EFFECTORS
+from running_stats import RunningMeanStd, obs_stats_path
+from joint_groups import KIMA_JOINTS
+from contacts import ContactSummary, CONTACT_ROW_LENGTH, SKEL_IDS, BODY_IDS
+from termination import TerminationRules, KIMA_TERMINATION_RULES
+from vec_env import SharedMemoryVecEnv
+from async_rollout import AsyncRollouts
+from fork_server import ForkServer
+from ppo import compute_gae, minibatch_indices, learn as ppo_learn
+from ddm_argparse import DartDeepMimicArgParse
+from numpy_policy import NumpyPolicy
+from eval_harness import summarize, RSI
+from checkpoint_watcher import find_checkpoints
+from rsi_sampler import AliasTable, AdaptiveStartSampler
+from telemetry import Telemetry
+from cpu_placement import PlacementPlan, share_cpus
+from sweep import Sweep, expand_spec, job_args, job_cpus
+from rng_streams import STREAMS, stream_seed, seed_env
+import tensorflow as tf
+from functools import partial
+import json
 import os
+import subprocess
+import sys
 
 #################################################
 # Number of random test samples to fuzz against #
@@ -18,6 +47,20 @@ NUM_RANDOM_FRAMES = 10
 
 NUM_TEST_RESETS = 20
 
+# Command line of the walking env make_walk_env builds
+WALK_ARGS = ["--control-skel-path", "assets/skel/kima_original.skel",
+             "--ref-motion-path", "assets/mocap/walk/positions.txt",
+             "--ref-motion-vel-path", "assets/mocap/walk/velocities.txt",
+             "--state-mode", "1", "--action-mode", "2"]
+
+#################################################
+# Seconds a fresh interpreter may spend to load #
+# an env module, every rollout worker pays this #
+#################################################
+IMPORT_BUDGET = 3.0
+HEAVY_MODULES = ["tensorflow", "theano", "lasagne", "baselines",
+                 "transformations", "cgkit"]
+
 
 class RandomPolicyAgent:
     """The world's simplest agent!"""
@@ -299,3 +342,527 @@ def test_parity_rollout(vddm_env, raw_env, policy):
         #######################
         # End duplicated code #
         #######################
+
+def test_observation_history():
+
+    history = ObservationHistory(3, obs_dim=2, action_dim=1)
+    stacked = history.reset(np.array([1., 2.]))
+    np.testing.assert_array_equal(stacked, [1, 2, 0] * 3)
+
+    for t in range(5):
+        stacked = history.push(np.array([t, t]), np.array([-t]))
+
+    np.testing.assert_array_equal(stacked, [2, 2, -2, 3, 3, -3, 4, 4, -4])
+    # The stacked history should be handed out without copying
+    assert(np.shares_memory(stacked, history._buffer))
+
+def test_batched_quat_decoding():
+
+    quats = np.random.randn(NUM_NN_OUTPUT, 4)
+    quats[0] = [1, 0, 0, 0]
+    quats[1] = [np.cos(np.pi / 4), 0, np.sin(np.pi / 4), 0]
+
+    expected = [mat2euler(quat2mat(quat)) for quat in quats]
+    np.testing.assert_allclose(quats2euler(quats), expected, atol=1e-12)
+
+def test_batched_characters(rng_seed):
+
+    dir_prefix = os.path.dirname(os.path.realpath(__file__)) + "/"
+    env = BatchedVisakDartDeepMimicEnv(
+        2,
+        skel_path=dir_prefix + "assets/skel/kima_original.skel",
+        mocap_path=dir_prefix + "assets/mocap/walk/positions.txt",
+        mocap_vel_path=dir_prefix + "assets/mocap/walk/velocities.txt",
+        statemode=1,
+        actionmode=2,
+        pos_noise=0, vel_noise=0,
+        pos_weight=1.65, pos_decay=-2,
+        vel_weight=0.1, vel_decay=-1e-1,
+        ee_weight=0.1, ee_decay=-40,
+        com_weight=0.25, com_decay=-40,
+        delta_actions=True,
+        seed=rng_seed,
+    )
+
+    obs = env.reset_batch(framenums=[5, 5], noise=False)
+    assert(obs.shape == (2, env.obs_dim))
+    # Lanes shouldn't show up in anything the policy sees
+    np.testing.assert_allclose(obs[0], obs[1])
+
+    actions = np.zeros((2, env.action_dim))
+    obs, rewards, dones, _ = env.step_batch(actions)
+    assert(obs.shape == (2, env.obs_dim))
+    np.testing.assert_allclose(rewards[0], rewards[1])
+    np.testing.assert_array_equal(env.framenums, [6, 6])
+
+def test_ee_positions(vddm_env):
+
+    skel = vddm_env.robot_skeleton
+    expected = [skel.bodynode(name).to_world(offset)
+                for name, offset in KIMA_END_EFFECTORS]
+    np.testing.assert_allclose(vddm_env._get_ee_positions(skel), expected)
+
+def test_running_stats_merge():
+
+    samples = np.random.randn(100, 3) * [1., 10., 100.] + [0., 5., -5.]
+
+    stats = RunningMeanStd(3)
+    for sample in samples:
+        stats.update(sample)
+    np.testing.assert_allclose(stats.mean, samples.mean(axis=0))
+    np.testing.assert_allclose(stats.var, samples.var(axis=0))
+
+    # Statistics from separate workers should merge into the same thing
+    merged = RunningMeanStd(3)
+    for chunk in np.split(samples, [30, 70]):
+        worker_stats = RunningMeanStd(3)
+        worker_stats.update_batch(chunk)
+        merged.merge(worker_stats)
+    assert(merged.count == stats.count)
+    np.testing.assert_allclose(merged.mean, stats.mean)
+    np.testing.assert_allclose(merged.m2, stats.m2)
+
+    # since() undoes a merge, which is what MPI ranks exchange
+    base = RunningMeanStd(3)
+    base.update_batch(samples[:30])
+    added = merged.since(base)
+    assert(added.count == 70)
+    np.testing.assert_allclose(added.mean, samples[30:].mean(axis=0))
+    np.testing.assert_allclose(added.var, samples[30:].var(axis=0))
+
+def test_batched_quat_reward_tables():
+
+    eulers = np.random.uniform(-np.pi, np.pi, (NUM_NN_OUTPUT, 2, 3))
+    quats = euler2quats(eulers)
+    np.testing.assert_allclose(quats[:, 0],
+                               [euler2quat(*zyx) for zyx in eulers[:, 0]])
+
+    expected = [2*np.arccos(mult(inverse(ref), quat)[0])
+                for ref, quat in zip(quats[:, 0], quats[:, 1])]
+    np.testing.assert_allclose(relative_angles(quats_inverse(quats[:, 0]),
+                                               quats[:, 1]),
+                               expected)
+
+def test_kima_joint_groups(raw_env):
+
+    assert(KIMA_JOINTS.obs_dim == raw_env.obs_dim)
+    assert(KIMA_JOINTS.action_dim == raw_env.action_dim)
+
+    angle_axes = np.random.randn(NUM_NN_OUTPUT, 4)
+    expected = [angle_axis2euler(theta=aa[0], vector=aa[1:])
+                for aa in angle_axes]
+    np.testing.assert_allclose(angle_axes2euler(angle_axes), expected,
+                               atol=1e-12)
+
+@pytest.mark.parametrize("module", ["env_jesus", "raw_env_reduced",
+                                    "visak_dartdeepmimic"])
+def test_import_budget(module):
+
+    script = ("import sys, time\n"
+              + "start = time.time()\n"
+              + "import " + module + "\n"
+              + "print(time.time() - start)\n"
+              + "print(' '.join(sys.modules))")
+    output = subprocess.check_output(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.realpath(__file__)))
+    elapsed, loaded = output.decode().split("\n", 1)
+
+    loaded = set(name.split(".")[0] for name in loaded.split())
+    assert not loaded.intersection(HEAVY_MODULES)
+    assert float(elapsed) < IMPORT_BUDGET
+
+def test_contact_summary():
+
+    raw = np.zeros((3, CONTACT_ROW_LENGTH))
+    # (skel, body) pairs on each side of every contact
+    raw[:, SKEL_IDS] = [[0, 1], [1, 0], [1, 1]]
+    raw[:, BODY_IDS] = [[0, 5], [2, 0], [3, 4]]
+    contacts = ContactSummary(raw)
+
+    np.testing.assert_array_equal(np.flatnonzero(contacts.touching(1, 0, 8)),
+                                  [2, 5])
+    assert(not contacts.touching(0, 2, 1).any())
+
+def test_termination_rules():
+
+    rules = TerminationRules(KIMA_TERMINATION_RULES, 58)
+    state = np.zeros(58)
+
+    assert(not rules.should_terminate(state, 0.))
+    state[4] = 0.35
+    assert(rules.should_terminate(state, 0.))
+    state[4] = np.nan
+    assert(rules.should_terminate(state, -1.))
+
+    assert(rules.num_checks == 3)
+    assert(rules.summary() == {"nonfinite_state": 1, "state_magnitude": 1,
+                               "root_height": 1, "q3": 0, "q4": 2, "q5": 0})
+
+def test_shared_memory_vec_env(rng_seed):
+
+    env = SharedMemoryVecEnv([partial(make_walk_env, seed=rng_seed + i)
+                              for i in range(2)])
+    try:
+        obs = env.reset()
+        assert(obs.shape == (2, env.observation_space.shape[0]))
+
+        actions = np.zeros((2, env.action_space.shape[0]))
+        obs, rewards, dones, infos = env.step(actions)
+        assert(obs.shape == (2, env.observation_space.shape[0]))
+        assert(rewards.shape == dones.shape == (2,))
+        assert(len(infos) == 2)
+        assert(np.isfinite(obs).all())
+    finally:
+        env.close()
+
+
+def test_async_rollouts(rng_seed):
+
+    env = SharedMemoryVecEnv([partial(make_walk_env, seed=rng_seed + i)
+                              for i in range(3)])
+    action_dim = env.action_space.shape[0]
+
+    def act_fn(obs):
+        return np.zeros((len(obs), action_dim)), np.zeros(len(obs))
+
+    try:
+        rollouts = AsyncRollouts(env, act_fn)
+        segments = rollouts.collect(30)
+        assert(sum(len(s["rewards"]) for s in segments) == 30)
+        for segment in segments:
+            assert(len(segment["obs"]) == len(segment["actions"])
+                   == len(segment["rewards"]) == len(segment["dones"]))
+        assert(env.num_pending == 0)
+        # Fills a (T, N) layout, as ppo.learn needs
+        segments = rollouts.collect(steps_per_env=7)
+        assert([len(s["rewards"]) for s in segments]
+               == [7] * env.num_envs)
+        assert(env.num_pending == 0)
+    finally:
+        env.close()
+
+
+def test_fork_server(rng_seed):
+
+    server = ForkServer(make_walk_env)
+    try:
+        env = SharedMemoryVecEnv.from_fork_server(server, 2, rng_seed)
+        try:
+            obs = env.reset()
+            assert(obs.shape == (2, env.observation_space.shape[0]))
+            obs, rewards, dones, infos = env.step(
+                np.zeros((2, env.action_space.shape[0])))
+            assert(np.isfinite(obs).all())
+        finally:
+            env.close()
+    finally:
+        server.close()
+
+
+def test_vectorized_gae():
+
+    horizon, num_envs, gamma, lam = 50, 4, 0.99, 0.95
+    rewards = np.random.randn(horizon, num_envs)
+    vpreds = np.random.randn(horizon, num_envs)
+    dones = np.random.rand(horizon, num_envs) < 0.1
+    last_vpreds = np.random.randn(num_envs)
+
+    advantages, returns = compute_gae(rewards, vpreds, dones, last_vpreds,
+                                      gamma, lam)
+
+    # Each env on its own, the way pposgd_simple does it
+    for i in range(num_envs):
+        lastgaelam = 0
+        for t in reversed(range(horizon)):
+            next_vpred = last_vpreds[i] if t == horizon - 1 \
+                else vpreds[t + 1, i]
+            nonterminal = 1 - dones[t, i]
+            delta = rewards[t, i] + gamma * next_vpred * nonterminal \
+                - vpreds[t, i]
+            lastgaelam = delta + gamma * lam * nonterminal * lastgaelam
+            assert(np.isclose(advantages[t, i], lastgaelam))
+    np.testing.assert_allclose(returns, advantages + vpreds)
+
+    batches = list(minibatch_indices(horizon * num_envs, 64,
+                                     np.random.RandomState(0)))
+    assert(len(batches) == (horizon * num_envs) // 64)
+    assert(len(np.unique(np.concatenate(batches))) == 64 * len(batches))
+
+
+def test_numpy_policy(rng_seed, tmpdir):
+
+    env = make_walk_env(rng_seed)
+    obs = np.random.randn(5, env.observation_space.shape[0])
+    prefix = str(tmpdir.join("checkpoint"))
+
+    with tf.Graph().as_default(), U.make_session(num_cpu=1) as sess:
+        pi = mlp_policy.MlpPolicy("pi", env.observation_space,
+                                  env.action_space, hid_size=64,
+                                  num_hid_layers=2)
+        U.initialize()
+        pi.ob_rms.update(3 * obs + 1)
+
+        # Same layout as CheckpointManager writes
+        variables = tf.global_variables()
+        np.savez(prefix + ".npz",
+                 **{v.name: value for v, value
+                    in zip(variables, sess.run(variables))})
+        expected_actions, expected_vpreds = pi._act(False, obs)
+
+    policy = NumpyPolicy.load(prefix)
+    actions, vpreds = policy.act_batch(False, obs)
+    np.testing.assert_allclose(actions, expected_actions, rtol=1e-4,
+                               atol=1e-5)
+    np.testing.assert_allclose(vpreds, expected_vpreds, rtol=1e-4, atol=1e-5)
+
+    action, vpred = policy.act(False, obs[0])
+    np.testing.assert_allclose(action, actions[0])
+
+    # Env statistics saved next to the checkpoint come along
+    stats = RunningMeanStd(env.observation_space.shape[0])
+    stats.update_batch(obs)
+    np.savez(obs_stats_path(prefix), **stats.state_dict())
+    policy = NumpyPolicy.load(prefix)
+    policy.prepare_env(env)
+    assert(env.obs_stats.frozen and env.obs_stats.count == 5)
+    os.remove(obs_stats_path(prefix))
+    NumpyPolicy.load(prefix).prepare_env(env)
+    assert(env.obs_stats is None)
+
+
+def test_tracking_errors_and_summary(rng_seed):
+
+    env = make_walk_env(rng_seed)
+    env.reset(framenum=0, noise=False)
+    framenum = env.framenum
+    _, reward, done, info = env.step(np.zeros(env.action_dim))
+
+    errors = info["tracking_errors"]
+    assert(sorted(errors.keys()) == ["com", "ee", "pos", "vel"])
+    if not done:
+        assert(np.isclose(reward, env.reward_from_errors(errors)))
+    assert(np.isclose(errors["ee"],
+                      env.ee_diff(env.robot_skeleton, framenum)))
+
+    results = [{"checkpoint": "a", "seed": seed, "start": start,
+                "return": float(seed), "length": 10}
+               for seed in range(4) for start in [0, RSI]]
+    rows = summarize(results)
+    assert([(row["checkpoint"], row["start"], row["episodes"])
+            for row in rows] == [("a", "fixed", 4), ("a", RSI, 4)])
+    assert(np.isclose(rows[0]["return"][0], 1.5))
+    # t quantile w/ 3 degrees of freedom
+    assert(np.isclose(rows[0]["return"][1],
+                      3.182 * np.std(range(4), ddof=1) / 2, rtol=1e-2))
+    assert(rows[0]["length"][1] == 0)
+
+
+def test_find_checkpoints(tmpdir):
+
+    prefix = str(tmpdir.join("params_"))
+    for name in ["params_10.npz", "params_10.obs_stats.npz", "params_200.npz",
+                 "params_300.npz.tmp.npz", "other_5.npz"]:
+        tmpdir.join(name).write("")
+
+    assert(find_checkpoints(prefix) == {10: prefix + "10",
+                                        200: prefix + "200"})
+
+
+def test_adaptive_start_sampler():
+
+    weights = np.random.rand(17)
+    weights[3] = 0
+    table = AliasTable(weights)
+    np.testing.assert_allclose(table.probabilities(),
+                               weights / weights.sum())
+
+    rng = random.Random(0)
+    sampler = AdaptiveStartSampler(100, num_buckets=10, rebuild_interval=10)
+    for _ in range(1000):
+        framenum = sampler.sample(rng)
+        assert(0 <= framenum < 100)
+        sampler.record(framenum, failed=50 <= framenum < 60)
+
+    # Only the failing bucket should get more than its uniform share
+    probabilities = sampler.table.probabilities()
+    assert(np.argmax(probabilities) == sampler.bucket(55))
+    assert(probabilities[sampler.bucket(55)] > 0.5)
+
+
+def test_telemetry(tmpdir):
+
+    path = str(tmpdir.join("telemetry.jsonl"))
+    telemetry = Telemetry(path)
+    rules = TerminationRules(KIMA_TERMINATION_RULES, 58)
+    telemetry.on_callback({"iters_so_far": 0, "timesteps_so_far": 0}, rules)
+    with telemetry.timed("simulation"):
+        pass
+    telemetry.resets += 2
+    rules.should_terminate(np.zeros(58), -1.)
+    workers = [{"peak_rss_mb": 100., "termination_checks": 3,
+                "terminations": {"root_height": 1}}] * 2
+    telemetry.on_callback({"iters_so_far": 1, "timesteps_so_far": 2048},
+                          rules, workers)
+    telemetry.on_callback({"iters_so_far": 2, "timesteps_so_far": 4096},
+                          rules)
+    telemetry.close()
+
+    with open(path) as telemetry_file:
+        records = [json.loads(line) for line in telemetry_file]
+    assert(len(records) == 2)
+    assert(records[0]["iteration"] == 0)
+    assert(records[0]["steps"] == 2048 and records[0]["resets"] == 2)
+    assert(records[0]["simulation_seconds"] <= records[0]["wall_seconds"])
+    assert(records[0]["peak_rss_workers_mb"] == [100., 100.])
+    assert(records[0]["termination_checks"] == 7)
+    assert(records[0]["terminations"]["root_height"] == 3)
+    # Counts only cover their own iteration
+    assert(records[1]["termination_checks"] == 0)
+
+
+def test_placement_plan():
+
+    plan = PlacementPlan(3, cpus=range(8))
+    assert(plan.learner_cpus == [0, 1, 2, 3, 4])
+    assert(plan.worker_cpus == [5, 6, 7])
+    assert(plan.learner_threads == 5)
+
+    # Oversubscribed: the learner keeps a core, the workers share the rest
+    plan = PlacementPlan(5, cpus=range(3))
+    assert(plan.learner_cpus == [0])
+    assert(plan.worker_cpus == [1, 2, 1, 2, 1])
+
+    assert(share_cpus(list(range(8)), 1, 2) == [4, 5, 6, 7])
+
+
+def test_sweep_spec():
+
+    spec = {"args": {"--num-envs": 4},
+            "grid": {"--pos-weight": [0.5, 0.65], "--delta": [True, False]},
+            "random": {"samples": 3, "seed": 0,
+                       "params": {"--p-gain": ["log_uniform", 100, 1000]}}}
+    jobs = expand_spec(spec)
+    assert(len(jobs) == 12)
+    assert(all(100 <= job["--p-gain"] <= 1000 for job in jobs))
+    assert(jobs == expand_spec(spec))
+
+    assert(job_args({"--delta": True, "--gravity": False, "--seed": 3,
+                     "--normalize-obs": False})
+           == ["--delta", "--no-gravity", "--seed", "3"])
+    assert(job_cpus(spec, spec["args"]) == 5)
+
+
+def test_sweep_envs(tmp_path):
+
+    # Every job's command line has to make it into the env it trains on
+    spec = {"args": dict(zip(WALK_ARGS[::2], WALK_ARGS[1::2])),
+            "grid": {"--pos-weight": [0.5, 0.65], "--delta": [True, False]},
+            "cpus_per_job": 1}
+    sweep = Sweep(str(tmp_path), spec, cpus=[0])
+    for job in sweep.jobs:
+        parser = DartDeepMimicArgParse()
+        parser.add_argument('--output-params-prefix', required=True)
+        parser.parse_args(sweep.command(job)[2:])
+        env = parser.get_env()
+        assert(env.pos_weight == job["params"]["--pos-weight"])
+        assert(env.delta_actions == job["params"]["--delta"])
+
+
+def test_rng_streams(rng_seed):
+
+    seeds = [stream_seed(rng_seed, stream, rank, env_index)
+             for stream in STREAMS for rank in range(4)
+             for env_index in range(8)]
+    assert(len(set(seeds)) == len(seeds))
+    assert(seeds[0] == stream_seed(rng_seed, STREAMS[0]))
+
+    # Same streams for the same keys, different ones otherwise
+    def episode_starts(env_index):
+        env = make_walk_env()
+        seed_env(env, rng_seed, env_index=env_index)
+        starts = []
+        for _ in range(5):
+            env.reset()
+            starts.append((env.framenum, env.robot_skeleton.q.copy()))
+        return starts
+
+    first, again, other = episode_starts(0), episode_starts(0), \
+        episode_starts(1)
+    for (frame, q), (frame_again, q_again) in zip(first, again):
+        assert(frame == frame_again)
+        np.testing.assert_array_equal(q, q_again)
+    assert(not all(np.array_equal(q, q_other)
+                   for (_, q), (_, q_other) in zip(first, other)))
+
+
+def test_ppo_learn(rng_seed):
+
+    parser = DartDeepMimicArgParse()
+    parser.parse_args(WALK_ARGS + ["--seed", str(rng_seed)])
+    ppo_params = dict(parser.ppo_hyperparameters(), optim_epochs=1,
+                      optim_batchsize=8, schedule="constant")
+
+    def policy_fn(name, ob_space, ac_space):
+        return mlp_policy.MlpPolicy(name=name, ob_space=ob_space,
+                                    ac_space=ac_space, hid_size=16,
+                                    num_hid_layers=1)
+
+    timesteps = []
+    server = ForkServer(parser.get_env)
+    try:
+        env = SharedMemoryVecEnv.from_fork_server(server, 2, rng_seed)
+        try:
+            with tf.Graph().as_default(), U.make_session(num_cpu=1):
+                ppo_learn(env, policy_fn, horizon=16, max_iters=1,
+                          seed=rng_seed,
+                          callback=lambda local_vars, global_vars:
+                          timesteps.append(local_vars["timesteps_so_far"]),
+                          **ppo_params)
+        finally:
+            env.close()
+    finally:
+        server.close()
+
+    assert(timesteps == [0, 32])
+
+
+def test_env_flags():
+
+    parser = DartDeepMimicArgParse()
+    parser.parse_args(WALK_ARGS + ["--history-length", "3",
+                                   "--adaptive-rsi"])
+    env = parser.get_env()
+    assert(env.history is not None)
+    assert(env.start_sampler is not None)
+    assert(env.reset().shape == env.observation_space.shape)
+
+
+def test_vec_env_obs_stats(rng_seed):
+
+    server = ForkServer(partial(make_walk_env, normalize_obs=True))
+    try:
+        env = SharedMemoryVecEnv.from_fork_server(server, 2, rng_seed)
+        try:
+            env.reset()
+            env.step(np.zeros((2, env.action_space.shape[0])))
+            stats = env.collect_obs_stats()
+            # A reset and a step from each worker
+            assert(stats.count == 4)
+            env.broadcast_obs_stats()
+            env.step(np.zeros((2, env.action_space.shape[0])))
+            assert(env.collect_obs_stats().count == 6)
+        finally:
+            env.close()
+    finally:
+        server.close()
+
+
+def test_head_contact_termination(rng_seed):
+
+    env = DartHumanoid3D_cartesian(rng_seed, head_contact_termination=True)
+    env.reset()
+    # Pretend the head hit the ground
+    env.ground_contacts.forbidden_contact = lambda contacts: True
+    _, reward, done, _ = env.step(np.zeros(env.action_dim))
+    assert(done and reward == 0.)
@@ -1,52 +1,122 @@
+# BLAS / OpenMP read their thread counts when they load, so this comes
+# before anything imports numpy. One thread is what the vectorized workers
+# and the learner want, and single env runs don't lean on BLAS
+from cpu_placement import limit_blas_threads
+limit_blas_threads(1)
+
 from baselines.common import set_global_seeds, tf_util as U
-import tensorflow as tf
 from baselines import bench
 import os.path as osp
 import gym, logging
+import numpy as np
 from baselines.bench import Monitor
 from baselines import logger
 from baselines.ppo1 import mlp_policy, pposgd_simple
 
 from ddm_argparse import DartDeepMimicArgParse
+from checkpoints import CheckpointManager
+from telemetry import Telemetry, TimedEnv, maybe_timed
+from mpi_utils import rank, size, is_root, node_rank_and_size, \
+    shared_root_seed, RunningStatsSync
+from rng_streams import RUN_METADATA_SUFFIX, stream_seed, seed_env, \
+    write_run_metadata
+from cpu_placement import PlacementPlan, available_cpus, share_cpus
+from vec_env import SharedMemoryVecEnv
+from fork_server import ForkServer
+import ppo
 
 def train(env, initial_params_path,
           save_interval, out_prefix, num_timesteps, num_cpus,
-          hidden_dimensions):
+          hidden_dimensions, timesteps_per_batch, ppo_params,
+          keep_last, keep_best, telemetry_path, root_seed):
     sess = U.make_session(num_cpu=num_cpus).__enter__()
 
     U.initialize()
 
+    vectorized = isinstance(env, SharedMemoryVecEnv)
+
+    # Throughput and time breakdown of every iteration, see telemetry.py
+    telemetry = None
+    termination = None
+    if is_root() and telemetry_path is not None:
+        telemetry = Telemetry(telemetry_path)
+        if not vectorized:
+            termination = env.unwrapped.termination
+            env = TimedEnv(env, telemetry)
+
     def policy_fn(name, ob_space, ac_space):
         print("Policy with name: ", name)
         policy = mlp_policy.MlpPolicy(name=name, ob_space=ob_space,
                                       ac_space=ac_space,
                                       hidden_dimension_list=hidden_dimensions)
-        saver = tf.train.Saver()
-        if initial_params_path is not None:
-            saver.restore(sess, initial_params_path)
+        # ppo.learn times inference itself
+        if telemetry is not None and not vectorized and name == "pi":
+            policy.act = telemetry.wrap("inference", policy.act)
         return policy
 
-    set_global_seeds(8)
+    # Action sampling, through TF
+    set_global_seeds(stream_seed(root_seed, "policy", rank()))
     gym.logger.setLevel(logging.WARN)
 
+    # Observation statistics kept by the environment are saved and restored
+    # along with the policy parameters. The workers of a vectorized env
+    # each keep statistics of their own, which get merged every iteration
+    obs_stats = None if vectorized else env.unwrapped.obs_stats
+    obs_stats_sync = None
+
+    # The policy's variables only exist once learn() has built it, so the
+    # checkpoint manager is made on the first callback
+    checkpoints = None
+
     def callback_fn(local_vars, global_vars):
+        nonlocal checkpoints, obs_stats, obs_stats_sync
         iters = local_vars["iters_so_far"]
-        if iters == 0 and initial_params_path is not None:
-            print("Restoring from " + initial_params_path)
-            tf.train.Saver().restore(tf.get_default_session(),
-                                     initial_params_path)
-        saver = tf.train.Saver()
+        if telemetry is not None:
+            telemetry.on_callback(local_vars, termination,
+                                  env.collect_usage() if vectorized else None)
+        if vectorized:
+            obs_stats = env.collect_obs_stats()
+        if checkpoints is None:
+            checkpoints = CheckpointManager(out_prefix, keep_last=keep_last,
+                                            keep_best=keep_best,
+                                            obs_stats=obs_stats)
+            if initial_params_path is not None:
+                print("Restoring from " + initial_params_path)
+                checkpoints.restore(initial_params_path, sess)
+            # Every rank feeds its own samples in, so they need merging
+            # each iteration for all of them to normalize the same way
+            if obs_stats is not None:
+                obs_stats_sync = RunningStatsSync(obs_stats)
+        if obs_stats_sync is not None:
+            obs_stats_sync.sync()
+        if vectorized and obs_stats is not None:
+            env.broadcast_obs_stats()
+        if not is_root():
+            return
         if iters % save_interval == 0:
-            saver.save(sess, out_prefix + str(iters))
-
-    pposgd_simple.learn(env, policy_fn,
-            max_timesteps=num_timesteps,
-            callback=callback_fn,
-            timesteps_per_actorbatch=2048,
-            clip_param=0.2, entcoeff=0.0,
-            optim_epochs=10, optim_stepsize=3e-4, optim_batchsize=64,
-            gamma=1.0, lam=0.95, schedule='linear',
-        )
+            rewards = local_vars["rewbuffer"]
+            with maybe_timed(telemetry, "checkpoint"):
+                checkpoints.save(iters, np.mean(rewards) if rewards else None,
+                                 sess, local_vars["timesteps_so_far"])
+
+    if vectorized:
+        ppo.learn(env, policy_fn,
+                  max_timesteps=num_timesteps,
+                  callback=callback_fn,
+                  horizon=timesteps_per_batch // env.num_envs,
+                  telemetry=telemetry,
+                  seed=stream_seed(root_seed, "learner", rank()),
+                  **ppo_params)
+    else:
+        pposgd_simple.learn(env, policy_fn,
+                max_timesteps=num_timesteps,
+                callback=callback_fn,
+                timesteps_per_actorbatch=timesteps_per_batch,
+                **ppo_params)
+    if checkpoints is not None:
+        checkpoints.close()
+    if telemetry is not None:
+        telemetry.close()
     env.close()
 
 if __name__ == '__main__':
@@ -59,15 +129,58 @@ if __name__ == '__main__':
     parser.add_argument('--output-params-prefix', required=True,
                         help="Fire prefix of parameter saves")
     parser.add_argument('--num-cpus', type=int, default=1,
-                        help="Number of CPU cores to use? Idk...")
+                        help="Threads of TF's pools, replaced by the cores "
+                        + "left to the learner when --num-envs > 1")
+    parser.add_argument('--cpus', type=int, nargs="+", default=None,
+                        help="Cores to place the learner and the workers "
+                        + "of --num-envs > 1 on (split between the MPI "
+                        + "ranks of a machine), defaults to all available")
+    parser.add_argument('--no-pin-cpus', dest="pin_cpus",
+                        action="store_false",
+                        help="Plan the layout w/o pinning processes to it")
     parser.add_argument('--train-num-timesteps', type=int, default=7e8,
                         help="No idea what this does")
     parser.add_argument('--hidden-dims', type=str, default="64,64",
                         help="Within quotes, sizes of each hidden layer "
                         + "seperated by commas [also, no whitespace]")
+    parser.add_argument('--keep-last', type=int, default=5,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument('--keep-best', type=int, default=3,
+                        help="Number of highest reward checkpoints to keep")
+    parser.add_argument('--telemetry-path', type=str, default=None,
+                        help="JSON lines file for per-iteration throughput "
+                        + "metrics, defaults to the output prefix + "
+                        + "telemetry.jsonl")
+    parser.add_argument('--timesteps-per-batch', type=int, default=2048,
+                        help="Timesteps collected by every MPI rank per "
+                        + "iteration (split over --num-envs), run under "
+                        + "mpirun -np N to collect N times as many")
 
     args = parser.parse_args()
-    env = parser.get_env()
+    if not is_root():
+        logger.configure(format_strs=[])
+    # Every rank and env derives its streams from this, see rng_streams.py
+    root_seed = shared_root_seed(args.seed)
+    if is_root():
+        write_run_metadata(args.output_params_prefix + RUN_METADATA_SUFFIX,
+                           root_seed, num_ranks=size(),
+                           num_envs=args.num_envs)
+    server = None
+    placement = None
+    if args.num_envs > 1:
+        # A core per worker, the rest to the learner, see cpu_placement.py
+        cpus = share_cpus(args.cpus or available_cpus(),
+                          *node_rank_and_size())
+        placement = PlacementPlan(args.num_envs, cpus, pin=args.pin_cpus)
+        placement.pin_learner()
+        print("Rank %i CPU placement:\n%s" % (rank(), placement.describe()))
+        # Build the env once, then fork the workers off it
+        server = ForkServer(parser.get_env, placement=placement)
+        env = SharedMemoryVecEnv.from_fork_server(server, args.num_envs,
+                                                  root_seed, rank())
+    else:
+        env = parser.get_env()
+        seed_env(env, root_seed, rank())
     hidden_dimensions = [int(i) for i in args.hidden_dims.split(",")]
     #####################################
     # END COPY-PASTE FROM DARTDEEPMIMIC #
@@ -78,5 +191,14 @@ if __name__ == '__main__':
           save_interval=args.train_save_interval,
           out_prefix=args.output_params_prefix,
           num_timesteps=args.train_num_timesteps,
-          num_cpus=args.num_cpus,
-          hidden_dimensions=hidden_dimensions)
+          num_cpus=args.num_cpus if placement is None
+          else placement.learner_threads,
+          hidden_dimensions=hidden_dimensions,
+          timesteps_per_batch=args.timesteps_per_batch,
+          ppo_params=parser.ppo_hyperparameters(),
+          keep_last=args.keep_last, keep_best=args.keep_best,
+          telemetry_path=args.telemetry_path
+          or args.output_params_prefix + "telemetry.jsonl",
+          root_seed=root_seed)
+    if server is not None:
+        server.close()
@@ -1,11 +1,16 @@
 from baselines.common.cmd_util import common_arg_parser
 from baselines.common import tf_util as U
-import tensorflow as tf
 from baselines import logger
 from baselines.bench import Monitor
 import gym
 from baselines.common import set_global_seeds, tf_util as U
 from gym.envs.registration import register
+from mpi_utils import rank, size, is_root, shared_root_seed
+from rng_streams import RUN_METADATA_SUFFIX, stream_seed, seed_env, \
+    write_run_metadata
+from checkpoints import CheckpointManager
+from telemetry import Telemetry, TimedEnv, maybe_timed
+import numpy as np
 
 register(
     id='raw-v0',
@@ -16,39 +21,77 @@ register(
     entry_point='raw_env_reduced:raw_env_reduced',
 )
 
-def make_dart_env(env_id, seed):
+def make_dart_env(env_id, root_seed, worker_rank):
     print("#####################################")
-    print("seed",seed)
-    set_global_seeds(seed)
+    print("seed", root_seed)
+    # Action sampling, through TF
+    set_global_seeds(stream_seed(root_seed, "policy", worker_rank))
     env = gym.make(env_id)
+    seed_env(env, root_seed, worker_rank)
     env = Monitor(env, logger.get_dir())
     return env
 
 def train(env_id, num_timesteps, seed,
-          save_interval, output_prefix):
+          save_interval, output_prefix, timesteps_per_batch,
+          keep_last, keep_best):
     from baselines.ppo1 import mlp_policy, pposgd_simple
     sess = U.make_session(num_cpu=1)
     sess.__enter__()
 
+    # Throughput and time breakdown of every iteration, see telemetry.py
+    telemetry = Telemetry(output_prefix + "telemetry.jsonl") if is_root() \
+        else None
+
     def policy_fn(name, ob_space, ac_space):
-        return mlp_policy.MlpPolicy(name=name, ob_space=ob_space, ac_space=ac_space,
-            hid_size=128, num_hid_layers=2)
+        policy = mlp_policy.MlpPolicy(name=name, ob_space=ob_space,
+                                      ac_space=ac_space,
+                                      hid_size=128, num_hid_layers=2)
+        if telemetry is not None and name == "pi":
+            policy.act = telemetry.wrap("inference", policy.act)
+        return policy
+
+    # The policy's variables only exist once learn() has built it, so the
+    # checkpoint manager is made on the first callback
+    checkpoints = None
 
     def callback_fn(local_vars, global_vars):
+        nonlocal checkpoints
         iters = local_vars["iters_so_far"]
-        saver = tf.train.Saver()
+        if telemetry is not None:
+            telemetry.on_callback(local_vars,
+                                  getattr(env.unwrapped, "termination", None))
+        if not is_root():
+            return
+        if checkpoints is None:
+            checkpoints = CheckpointManager(output_prefix,
+                                            keep_last=keep_last,
+                                            keep_best=keep_best)
         if iters % save_interval == 0:
-            saver.save(sess, output_prefix + str(iters))
+            rewards = local_vars["rewbuffer"]
+            with maybe_timed(telemetry, "checkpoint"):
+                checkpoints.save(iters, np.mean(rewards) if rewards else None,
+                                 sess, local_vars["timesteps_so_far"])
 
-    env = make_dart_env(env_id, seed)
+    # Every rank derives its streams from this, see rng_streams.py
+    root_seed = shared_root_seed(seed)
+    if is_root():
+        write_run_metadata(output_prefix + RUN_METADATA_SUFFIX, root_seed,
+                           num_ranks=size())
+    env = make_dart_env(env_id, root_seed, rank())
+    if telemetry is not None:
+        env = TimedEnv(env, telemetry)
     pposgd_simple.learn(env, policy_fn,
             max_timesteps=num_timesteps,
-            timesteps_per_actorbatch=2048,
+            timesteps_per_actorbatch=timesteps_per_batch,
             clip_param=0.2, entcoeff=0.0,
             optim_epochs=10, optim_stepsize=3e-4, optim_batchsize=64,
             gamma=0.99, lam=0.95, schedule='linear',
                         callback=callback_fn
         )
+    if checkpoints is not None:
+        checkpoints.close()
+    if telemetry is not None:
+        telemetry.close()
     env.close()
 
 def main():
@@ -57,13 +100,26 @@ def main():
                         help="Interval between saves and stuff")
     parser.add_argument('--output-prefix', required=True,
                         help="Fire prefix of parameter saves")
+    parser.add_argument('--keep-last', type=int, default=5,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument('--keep-best', type=int, default=3,
+                        help="Number of highest reward checkpoints to keep")
+    parser.add_argument('--timesteps-per-batch', type=int, default=2048,
+                        help="Timesteps collected by every MPI rank per "
+                        + "iteration, run under mpirun -np N to collect N "
+                        + "times as many")
 
     args = parser.parse_args()
 
-    logger.configure()
+    if is_root():
+        logger.configure()
+    else:
+        logger.configure(format_strs=[])
     train(args.env, num_timesteps=args.num_timesteps, seed=args.seed,
           save_interval=args.save_interval,
-          output_prefix=args.output_prefix)
+          output_prefix=args.output_prefix,
+          timesteps_per_batch=args.timesteps_per_batch,
+          keep_last=args.keep_last, keep_best=args.keep_best)
 
 if __name__ == '__main__':
     main()
@@ -3,36 +3,57 @@ from baselines.common.cmd_util import common_arg_parser
 from baselines.common import tf_util as U
 from baselines.bench import Monitor
 from baselines import logger
-import tensorflow as tf
 
 from raw_env_reduced import raw_env_reduced
+from checkpoints import CheckpointManager
+from telemetry import Telemetry, TimedEnv
+import numpy as np
 from baselines.ppo1 import mlp_policy, pposgd_simple
 
 def make_dart_env(seed):
-    env = raw_env_reduced(seed)
+    # raw_env_reduced doesn't take a seed
+    env = raw_env_reduced()
+    env.seed(seed)
     env = Monitor(env, logger.get_dir())
     return env
 
 def train(num_timesteps, seed,
-          save_interval, output_prefix, ):
+          save_interval, output_prefix, keep_last, keep_best):
 
     sess = U.make_session(num_cpu=1)
     sess.__enter__()
-    env = make_dart_env(seed)
-
+    # Throughput and time breakdown of every iteration, see telemetry.py
+    telemetry = Telemetry(output_prefix + "telemetry.jsonl")
+    env = TimedEnv(make_dart_env(seed), telemetry)
 
     def policy_fn(name, ob_space, ac_space):
         # TODO Ensure that multiple-layers implementation is really solid
-        return mlp_policy.MlpPolicy(name=name,
-                                    ob_space=ob_space, ac_space=ac_space,
-                                    hid_size=128,
-                                    num_hid_layers=2)
+        policy = mlp_policy.MlpPolicy(name=name,
+                                      ob_space=ob_space, ac_space=ac_space,
+                                      hid_size=128,
+                                      num_hid_layers=2)
+        if name == "pi":
+            policy.act = telemetry.wrap("inference", policy.act)
+        return policy
+
+    # The policy's variables only exist once learn() has built it, so the
+    # checkpoint manager is made on the first callback
+    checkpoints = None
 
     def callback_fn(local_vars, global_vars):
+        nonlocal checkpoints
         iters = local_vars["iters_so_far"]
-        saver = tf.train.Saver()
+        telemetry.on_callback(local_vars,
+                              getattr(env.unwrapped, "termination", None))
+        if checkpoints is None:
+            checkpoints = CheckpointManager(output_prefix,
+                                            keep_last=keep_last,
+                                            keep_best=keep_best)
         if iters % save_interval == 0:
-            saver.save(sess, output_prefix + str(iters))
+            rewards = local_vars["rewbuffer"]
+            with telemetry.timed("checkpoint"):
+                checkpoints.save(iters, np.mean(rewards) if rewards else None,
+                                 sess, local_vars["timesteps_so_far"])
 
     pposgd_simple.learn(env, policy_fn,
             max_timesteps=num_timesteps,
@@ -42,6 +63,9 @@ def train(num_timesteps, seed,
             gamma=0.99, lam=0.95, schedule='linear',
             callback=callback_fn
         )
+    if checkpoints is not None:
+        checkpoints.close()
+    telemetry.close()
     env.close()
 
 def main():
@@ -55,6 +79,10 @@ def main():
                         help="Interval between saves and stuff")
     parser.add_argument('--output-prefix', required=True,
                         help="Fire prefix of parameter saves")
+    parser.add_argument('--keep-last', type=int, default=5,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument('--keep-best', type=int, default=3,
+                        help="Number of highest reward checkpoints to keep")
 
     # TODO Disabled for now!!! CPU thing isn't critical though
     # parser.add_argument('--num-cpus', type=int, default=1,
@@ -72,7 +100,8 @@ def main():
 
     train(num_timesteps=args.num_timesteps, seed=args.seed,
           save_interval=args.save_interval,
-          output_prefix=args.output_prefix)
+          output_prefix=args.output_prefix,
+          keep_last=args.keep_last, keep_best=args.keep_best)
 
 if __name__ == '__main__':
     main()
@@ -1,39 +1,70 @@
 from baselines.common.cmd_util import common_arg_parser
 from baselines.common import tf_util as U
-import tensorflow as tf
 from baselines import logger
 from baselines.bench import Monitor
 import gym
 from baselines.common import set_global_seeds, tf_util as U
 from gym.envs.registration import register
-from test_ddm import vddm_env
+from visak_dartdeepmimic import make_walk_env
+from checkpoints import CheckpointManager
+from telemetry import Telemetry, TimedEnv
+from rng_streams import RUN_METADATA_SUFFIX, new_root_seed, stream_seed, \
+    write_run_metadata
+import numpy as np
 
-def make_dart_env(env_id, seed):
+def make_dart_env(env_id, root_seed, **env_kwargs):
     print("#####################################")
-    print("seed",seed)
-    set_global_seeds(seed)
+    print("seed", root_seed)
+    # Action sampling, through TF
+    set_global_seeds(stream_seed(root_seed, "policy"))
 
-    env = vddm_env(seed)
+    env = make_walk_env(root_seed, **env_kwargs)
     env = Monitor(env, logger.get_dir())
     return env
 
 def train(env_id, num_timesteps, seed,
-          save_interval, output_prefix):
+          save_interval, output_prefix, keep_last, keep_best,
+          env_kwargs):
     from baselines.ppo1 import mlp_policy, pposgd_simple
     sess = U.make_session(num_cpu=1)
     sess.__enter__()
 
+    # Throughput and time breakdown of every iteration, see telemetry.py
+    telemetry = Telemetry(output_prefix + "telemetry.jsonl")
+
     def policy_fn(name, ob_space, ac_space):
-        return mlp_policy.MlpPolicy(name=name, ob_space=ob_space, ac_space=ac_space,
-            hid_size=128, num_hid_layers=2)
+        policy = mlp_policy.MlpPolicy(name=name, ob_space=ob_space,
+                                      ac_space=ac_space,
+                                      hid_size=128, num_hid_layers=2)
+        if name == "pi":
+            policy.act = telemetry.wrap("inference", policy.act)
+        return policy
+
+    # The policy's variables only exist once learn() has built it, so the
+    # checkpoint manager is made on the first callback
+    checkpoints = None
 
     def callback_fn(local_vars, global_vars):
+        nonlocal checkpoints
         iters = local_vars["iters_so_far"]
-        saver = tf.train.Saver()
+        telemetry.on_callback(local_vars,
+                              getattr(env.unwrapped, "termination", None))
+        if checkpoints is None:
+            checkpoints = CheckpointManager(output_prefix,
+                                            keep_last=keep_last,
+                                            keep_best=keep_best,
+                                            obs_stats=env.unwrapped.obs_stats)
         if iters % save_interval == 0:
-            saver.save(sess, output_prefix + str(iters))
+            rewards = local_vars["rewbuffer"]
+            with telemetry.timed("checkpoint"):
+                checkpoints.save(iters, np.mean(rewards) if rewards else None,
+                                 sess, local_vars["timesteps_so_far"])
 
-    env = make_dart_env(env_id, seed)
+    # The env's streams are derived from this too, see rng_streams.py
+    root_seed = new_root_seed() if seed is None else seed
+    write_run_metadata(output_prefix + RUN_METADATA_SUFFIX, root_seed)
+    env = TimedEnv(make_dart_env(env_id, root_seed, **env_kwargs),
+                   telemetry)
     pposgd_simple.learn(env, policy_fn,
             max_timesteps=num_timesteps,
             timesteps_per_actorbatch=2048,
@@ -42,6 +73,9 @@ def train(env_id, num_timesteps, seed,
             gamma=0.99, lam=0.95, schedule='linear',
                         callback=callback_fn
         )
+    if checkpoints is not None:
+        checkpoints.close()
+    telemetry.close()
     env.close()
 
 def main():
@@ -50,13 +84,26 @@ def main():
                         help="Interval between saves and stuff")
     parser.add_argument('--output-prefix', required=True,
                         help="Fire prefix of parameter saves")
+    parser.add_argument('--keep-last', type=int, default=5,
+                        help="Number of most recent checkpoints to keep")
+    parser.add_argument('--keep-best', type=int, default=3,
+                        help="Number of highest reward checkpoints to keep")
+    parser.add_argument('--normalize-obs', action="store_true",
+                        help="Normalize observations w/ running statistics "
+                        + "kept by the env, saved along w/ checkpoints")
+    parser.add_argument('--adaptive-rsi', action="store_true",
+                        help="Draw random start frames more often where "
+                        + "episodes fail, instead of uniformly")
 
     args = parser.parse_args()
 
     logger.configure()
     train(args.env, num_timesteps=args.num_timesteps, seed=args.seed,
           save_interval=args.save_interval,
-          output_prefix=args.output_prefix)
+          output_prefix=args.output_prefix,
+          keep_last=args.keep_last, keep_best=args.keep_best,
+          env_kwargs={"normalize_obs": args.normalize_obs,
+                      "adaptive_rsi": args.adaptive_rsi})
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,325 @@
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import resource
+import shutil
+import tempfile
+import numpy as np
+
+from running_stats import RunningMeanStd
+
+# Shared buffers go to a RAM-backed filesystem when there is one
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+class SharedBuffers:
+    """
+    Observations, actions, rewards and dones of every environment, kept in
+    memory-mapped files which the parent and all the workers map. Row i
+    belongs to environment i.
+
+    Only the directory holding the files needs to be passed to the workers,
+    so this works whatever the multiprocessing start method
+    """
+
+    FIELDS = ["obs", "actions", "rewards", "dones"]
+
+    def __init__(self, directory, num_envs, obs_dim, action_dim, create):
+        self.directory = directory
+        self.shapes = {"obs": (num_envs, obs_dim),
+                       "actions": (num_envs, action_dim),
+                       "rewards": (num_envs,),
+                       "dones": (num_envs,)}
+        dtypes = {"obs": np.float64, "actions": np.float64,
+                  "rewards": np.float64, "dones": np.bool_}
+        mode = "w+" if create else "r+"
+
+        for field in self.FIELDS:
+            setattr(self, field,
+                    np.memmap(os.path.join(directory, field), mode=mode,
+                              dtype=dtypes[field], shape=self.shapes[field]))
+
+    def spec(self):
+        """
+        What a worker needs to map the same buffers
+        """
+        return (self.directory, self.shapes["obs"][0], self.shapes["obs"][1],
+                self.shapes["actions"][1])
+
+
+def _worker(index, env_fn, conn, placement=None):
+    """
+    Build an environment then serve commands from the parent until told to
+    close. Results go straight into the shared buffers, only small control
+    messages (and infos) go through the pipe. placement is a
+    cpu_placement.PlacementPlan to pin the worker with
+    """
+    if placement is not None:
+        placement.pin_worker(index)
+    env = env_fn()
+    conn.send((env.observation_space, env.action_space))
+    buffers = SharedBuffers(*conn.recv(), create=False)
+
+    # Observation statistics kept by the env, and what they were when last
+    # handed to the parent
+    obs_stats = getattr(env.unwrapped, "obs_stats", None)
+    obs_stats_base = None if obs_stats is None else obs_stats.copy()
+
+    try:
+        while True:
+            command = conn.recv()
+
+            if command == "step":
+                ob, reward, done, info = env.step(buffers.actions[index])
+                if done:
+                    ob = env.reset()
+                buffers.obs[index] = ob
+                buffers.rewards[index] = reward
+                buffers.dones[index] = done
+                conn.send(info)
+
+            elif command == "reset":
+                buffers.obs[index] = env.reset()
+                conn.send(None)
+
+            elif command == "obs_stats":
+                if obs_stats is None:
+                    conn.send(None)
+                else:
+                    conn.send(obs_stats.since(obs_stats_base).state_dict())
+                    obs_stats_base = obs_stats.copy()
+
+            elif command == "set_obs_stats":
+                obs_stats.load_state_dict(conn.recv())
+                obs_stats_base = obs_stats.copy()
+
+            elif command == "usage":
+                # Same as telemetry.peak_rss_mb(), which would pull gym in.
+                # Termination counts start over w/ every report
+                termination = getattr(env.unwrapped, "termination", None)
+                usage = {"peak_rss_mb": resource.getrusage(
+                             resource.RUSAGE_SELF).ru_maxrss / 1024.,
+                         "termination_checks": None, "terminations": None}
+                if termination is not None:
+                    usage.update(termination_checks=termination.num_checks,
+                                 terminations=termination.summary())
+                    termination.reset_counts()
+                conn.send(usage)
+
+            elif command == "close":
+                break
+
+            else:
+                raise RuntimeError("Unrecognized command " + str(command))
+    finally:
+        env.close()
+        conn.close()
+
+
+class SharedMemoryVecEnv:
+    """
+    Runs one environment per worker process and steps all of them at once.
+
+    env_fns is a list of picklable callables each building an environment
+    (e.g. functools.partial(make_walk_env, seed=i), or a
+    DartHumanoid3D_cartesian with a seed). Observations, rewards and dones
+    live in shared memory and actions are written into a shared buffer, so
+    the only per-step traffic through the pipes is a tiny command message.
+    Environments which are done get reset automatically: the observation
+    handed back is then the first one of the next episode.
+
+    Besides the synchronous step_async/step_wait, workers can be stepped
+    independently of each other with step_async_subset/wait_ready, so that
+    whoever computes actions doesn't have to wait for the slowest simulator.
+
+    When the environments normalize observations themselves, every worker
+    updates statistics of its own: collect_obs_stats() merges what they
+    all saw into obs_stats, and broadcast_obs_stats() hands the result back
+    so that every worker normalizes the same way
+    """
+
+    def __init__(self, env_fns, start_method=None, placement=None):
+
+        context = multiprocessing.get_context(start_method)
+
+        conns, processes = [], []
+        for index, env_fn in enumerate(env_fns):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=_worker,
+                                      args=(index, env_fn, child_conn,
+                                            placement),
+                                      daemon=True)
+            process.start()
+            child_conn.close()
+            conns.append(parent_conn)
+            processes.append(process)
+
+        self._setup(conns, processes)
+
+    @classmethod
+    def from_fork_server(cls, server, num_envs, root_seed, rank=0):
+        """
+        Get num_envs workers forked off a ForkServer's template environment
+        instead of building every environment from scratch, each w/ random
+        streams of its own derived from root_seed (see rng_streams.py)
+        """
+        vec_env = cls.__new__(cls)
+        vec_env._setup([server.spawn(index, root_seed, rank)
+                        for index in range(num_envs)], [])
+        return vec_env
+
+    def _setup(self, conns, processes):
+        """
+        Hand out the shared buffers to workers which are connected through
+        conns (in order) and have sent their spaces. processes are joined on
+        close, and can be left empty when someone else reaps the workers
+        """
+        self.num_envs = len(conns)
+        self._conns = conns
+        self._processes = processes
+
+        self.observation_space, self.action_space = self._conns[0].recv()
+        for conn in self._conns[1:]:
+            conn.recv()
+
+        self._directory = tempfile.mkdtemp(prefix="ddm_vec_env_",
+                                           dir=SHM_DIR)
+        self._buffers = SharedBuffers(self._directory, self.num_envs,
+                                      self.observation_space.shape[0],
+                                      self.action_space.shape[0],
+                                      create=True)
+        for conn in self._conns:
+            conn.send(self._buffers.spec())
+
+        self._conn_indices = {conn: index
+                              for index, conn in enumerate(self._conns)}
+        # Workers which were told to step and haven't answered yet
+        self._pending = set()
+        # Merged observation statistics of the workers, see
+        # collect_obs_stats()
+        self.obs_stats = None
+        self.closed = False
+
+    def reset(self):
+        for conn in self._conns:
+            conn.send("reset")
+        for conn in self._conns:
+            conn.recv()
+        return self._buffers.obs.copy()
+
+    def step_async(self, actions):
+        """
+        Write the (num_envs, action_dim) actions into the shared buffer and
+        get every worker stepping
+        """
+        self.step_async_subset(np.arange(self.num_envs), actions)
+
+    def step_wait(self):
+        """
+        Wait for all the workers to finish their step. Returns arrays of
+        observations, rewards and dones plus a list of infos
+        """
+        infos = [None] * self.num_envs
+        while self._pending:
+            indices, _, __, ___, ready_infos = self.wait_ready()
+            for index, info in zip(indices, ready_infos):
+                infos[index] = info
+        return (self._buffers.obs.copy(), self._buffers.rewards.copy(),
+                self._buffers.dones.copy(), infos)
+
+    def step_async_subset(self, indices, actions):
+        """
+        Get only the workers in indices stepping, w/ one row of actions each
+        """
+        if self._pending.intersection(indices):
+            raise RuntimeError("Can't step a worker which is still stepping")
+        self._buffers.actions[indices] = actions
+        for index in indices:
+            self._conns[index].send("step")
+            self._pending.add(index)
+
+    def wait_ready(self, timeout=None):
+        """
+        Wait until at least one stepping worker is done (or timeout runs
+        out), then collect every worker which is. Returns their indices
+        (sorted) along with arrays of their observations, rewards and dones
+        and a list of their infos
+        """
+        ready = wait([self._conns[index] for index in self._pending],
+                     timeout)
+        indices = np.array(sorted(self._conn_indices[conn] for conn in ready),
+                           dtype=int)
+        infos = [self._conns[index].recv() for index in indices]
+        self._pending.difference_update(indices.tolist())
+
+        return (indices, self._buffers.obs[indices],
+                self._buffers.rewards[indices],
+                self._buffers.dones[indices], infos)
+
+    def collect_obs_stats(self):
+        """
+        Merge what every worker added to its observation statistics since
+        the last collect or broadcast into obs_stats, and return it. None
+        when the environments don't keep statistics
+        """
+        if self._pending:
+            raise RuntimeError("Can't collect statistics while stepping")
+        for conn in self._conns:
+            conn.send("obs_stats")
+        for conn in self._conns:
+            state = conn.recv()
+            if state is None:
+                continue
+            delta = RunningMeanStd(state["mean"].shape)
+            delta.load_state_dict(state)
+            if self.obs_stats is None:
+                self.obs_stats = RunningMeanStd(state["mean"].shape)
+            self.obs_stats.merge(delta)
+        return self.obs_stats
+
+    def broadcast_obs_stats(self):
+        """
+        Replace every worker's observation statistics w/ obs_stats
+        """
+        if self._pending:
+            raise RuntimeError("Can't set statistics while stepping")
+        state = self.obs_stats.state_dict()
+        for conn in self._conns:
+            conn.send("set_obs_stats")
+            conn.send(state)
+
+    def collect_usage(self):
+        """
+        Peak resident memory of every worker, and how often the termination
+        rules of its env fired since the last collect, as a list of dicts
+        (see telemetry.Telemetry.end_iteration)
+        """
+        if self._pending:
+            raise RuntimeError("Can't collect usage while stepping")
+        for conn in self._conns:
+            conn.send("usage")
+        return [conn.recv() for conn in self._conns]
+
+    @property
+    def num_pending(self):
+        """
+        Number of workers still busy with a step
+        """
+        return len(self._pending)
+
+    def step(self, actions):
+        self.step_async(actions)
+        return self.step_wait()
+
+    def close(self):
+        if self.closed:
+            return
+        if self._pending:
+            self.step_wait()
+        for conn in self._conns:
+            conn.send("close")
+        for process in self._processes:
+            process.join()
+        del self._buffers
+        shutil.rmtree(self._directory, ignore_errors=True)
+        self.closed = True
@@ -8,11 +8,20 @@ import copy
 import random
 import os
 from gym.envs.dart import dart_env
+from kinematics import KIMA_END_EFFECTORS
+from termination import KIMA_TERMINATION_RULES
 
 class VisakDartDeepMimicEnv(DartDeepMimicEnv):
 
+    END_EFFECTORS = KIMA_END_EFFECTORS
+    TERMINATION_RULES = KIMA_TERMINATION_RULES
+
     def __init__(self, mocap_vel_path,
-                 *args, **kwargs):
+                 *args, p_gain=None, d_gain=None, **kwargs):
+
+        # Override Visak's per-joint PD gains w/ a single value when given
+        self.p_gain = p_gain
+        self.d_gain = d_gain
 
         DartDeepMimicEnv.__init__(self, *args, **kwargs)
 
@@ -26,21 +35,28 @@ class VisakDartDeepMimicEnv(DartDeepMimicEnv):
 
         self.robot_skeleton = self.dart_world.skeletons[1]
 
-        self.robot_skeleton.set_self_collision_check(True)
+        self.configure_skeleton(self.robot_skeleton)
+
+        #################################################
+
+    def configure_skeleton(self, skel):
+        """
+        Set up collision checking, joint limits, damping and friction on a
+        humanoid skeleton in the world (and on the ground it stands on)
+        """
+        skel.set_self_collision_check(True)
 
-        for i in range(self.robot_skeleton.njoints-1):
-            self.robot_skeleton.joint(i).set_position_limit_enforced(True)
-            self.robot_skeleton.dof(i).set_damping_coefficient(10.)
+        for i in range(skel.njoints-1):
+            skel.joint(i).set_position_limit_enforced(True)
+            skel.dof(i).set_damping_coefficient(10.)
 
-        for body in self.robot_skeleton.bodynodes \
+        for body in skel.bodynodes \
             + self.dart_world.skeletons[0].bodynodes:
            body.set_friction_coeff(20.)
 
-        for jt in range(0, len(self.robot_skeleton.joints)):
-            if self.robot_skeleton.joints[jt].has_position_limit(0):
-                self.robot_skeleton.joints[jt].set_position_limit_enforced(True)
-
-        #################################################
+        for jt in range(0, len(skel.joints)):
+            if skel.joints[jt].has_position_limit(0):
+                skel.joints[jt].set_position_limit_enforced(True)
 
     def type_lambda(self, joint_name):
         if joint_name == "root1":
@@ -48,21 +64,6 @@ class VisakDartDeepMimicEnv(DartDeepMimicEnv):
         else:
             return JointType.ROT
 
-    def _get_ee_positions(self, skel):
-
-        point_rarm = [0.,-0.60,-0.15]
-        point_larm = [0.,-0.60,-0.15]
-        point_rfoot = [0.,0.,-0.20]
-        point_lfoot = [0.,0.,-0.20]
-
-        global_rarm = skel.bodynodes[16].to_world(point_rarm)
-        global_larm = skel.bodynodes[13].to_world(point_larm)
-        global_lfoot = skel.bodynodes[4].to_world(point_lfoot)
-        global_rfoot = skel.bodynodes[7].to_world(point_rfoot)
-
-        return np.array([global_rarm, global_rarm,
-                         global_rfoot, global_lfoot])
-
     def ClampTorques(self,torques):
         torqueLimits = np.array([150.0*5,
                                  80.*3,
@@ -113,6 +114,10 @@ class VisakDartDeepMimicEnv(DartDeepMimicEnv):
 
         self.kp = [item/2 for item in self.kp]
         self.kd = [item/2 for item in self.kd]
+        if self.p_gain is not None:
+            self.kp = [self.p_gain] * 23
+        if self.d_gain is not None:
+            self.kd = [self.d_gain] * 23
 
         q = skel.q
         qdot = skel.dq
@@ -132,25 +137,10 @@ class VisakDartDeepMimicEnv(DartDeepMimicEnv):
         Joint_weights[[0,3,6,9,16,20,10,16]] = 10
         Weight_matrix = np.diag(Joint_weights)
 
-        vel_diff = self.RefDQs[framenum,6:] - skel.dq[6:]
+        vel_diff = self.RefDQs[framenum,6:] - self.kinematics(skel).dq[6:]
 
         return np.sum(vel_diff.T*Weight_matrix*vel_diff)
 
-    def should_terminate(self):
-
-        skel = self.robot_skeleton
-        obs = self.state_vector()
-
-        height = skel.bodynodes[0].com()[1]
-
-        return not (np.isfinite(obs).all()
-                    and (np.abs(obs[2:]) < 200).all()
-                    and (height > -0.70) and (height < 0.40)
-                    and (abs(skel.q[4]) < 0.30)
-                    and (abs(skel.q[5]) < 0.50)
-                    and (skel.q[3] > -0.4)
-                    and (skel.q[3] < 0.3))
-
     def viewer_setup(self):
         if not self.disableViewer:
             self._get_viewer().scene.tb.trans[0] = 0
@@ -171,3 +161,28 @@ class VisakDartDeepMimicEnv(DartDeepMimicEnv):
         elif mode == 'human':
             self._get_viewer().runSingleStep()
 
+
+
+def make_walk_env(seed=None, **kwargs):
+    """
+    Build the Visak environment on the walking reference motion, w/ the same
+    settings the tests use. Module-level (and so picklable) so it can be
+    handed to worker processes; kwargs override any of the settings
+    """
+    dir_prefix = os.path.dirname(os.path.realpath(__file__)) + "/"
+    settings = dict(
+        skel_path=dir_prefix + "assets/skel/kima_original.skel",
+        mocap_path=dir_prefix + "assets/mocap/walk/positions.txt",
+        mocap_vel_path=dir_prefix + "assets/mocap/walk/velocities.txt",
+        statemode=1,
+        actionmode=2,
+        pos_noise=0.005, vel_noise=0.005,
+        pos_weight=1.65, pos_decay=-2,
+        vel_weight=0.1, vel_decay=-1e-1,
+        ee_weight=0.1, ee_decay=-40,
+        com_weight=0.25, com_decay=-40,
+        delta_actions=True,
+        seed=seed,
+    )
+    settings.update(kwargs)
+    return VisakDartDeepMimicEnv(**settings)